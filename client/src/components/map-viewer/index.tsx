@@ -9,10 +9,12 @@ import {
   CursorPosition,
   OptimizedWaypoint,
   Point,
+  PathPose,
   Marker,
 } from "../../types/waypoint";
 import WaypointsPanel from "./waypoints-panel";
 import { useWebSocket } from "../../hooks/useWebSocket";
+import { useRouteStream } from "../../hooks/useRouteStream";
 import CameraFeed from "../camera-viewer";
 
 const MapViewer = () => {
@@ -31,6 +33,7 @@ const MapViewer = () => {
   const [open, setOpen] = React.useState(false);
 
   const [pathPoints, setPathPoints] = React.useState<Array<Point>>([]);
+  const [trajectory, setTrajectory] = React.useState<Array<PathPose>>([]);
 
   const [cursorPos, setCursorPos] = React.useState<CursorPosition | null>(null);
 
@@ -69,6 +72,14 @@ const MapViewer = () => {
   });
   const zoomFactor = React.useRef<number>(1);
   const markers = React.useRef<Array<Marker>>([]);
+  // job of the last optimization sent, whose route is streamed and loaded
+  const [optimizationJob, setOptimizationJob] = React.useState<string | null>(
+    null
+  );
+  const streamedRoute = useRouteStream(
+    "ws://localhost:8000/ws/route",
+    optimizationJob
+  );
 
   const useMock = !rosContext?.state;
 
@@ -594,18 +605,17 @@ const MapViewer = () => {
   };
 
   const precomputeGraph = async () => {
-    const payload = {
-      info: mapParams.current,
-      map: mapData.current,
-    };
+    // one byte per cell instead of a JSON number; -1 (unknown) is sent as 255
+    const payload = Int8Array.from(mapData.current);
 
     try {
-      const response = await fetch("http://localhost:8000/precompute", {
+      const response = await fetch("http://localhost:8000/precompute/binary", {
         method: "POST",
         headers: {
-          "Content-Type": "application/json",
+          "Content-Type": "application/octet-stream",
+          "X-Map-Info": JSON.stringify(mapParams.current),
         },
-        body: JSON.stringify(payload),
+        body: payload,
       });
 
       if (!response.ok) {
@@ -649,15 +659,32 @@ const MapViewer = () => {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
       const data = await response.json();
+      setOptimizationJob(data.job_id ?? null);
       console.log("Response from server:", data);
     } catch (error) {
       console.error("Failed to send waypoints:", error);
     }
   };
 
+  // draw the route legs as they are streamed
+  React.useEffect(() => {
+    const legs = streamedRoute?.robots[0];
+    if (!legs) {
+      return;
+    }
+    setPathPoints(
+      legs
+        .flatMap((leg) => leg ?? [])
+        .map((p) => ({ ...p, y: mapParams.current.height - p.y }))
+    );
+  }, [streamedRoute]);
+
   const getOptimizedRoute = async () => {
     try {
-      const response = await fetch("http://localhost:8000/route", {
+      const url = optimizationJob
+        ? `http://localhost:8000/jobs/${optimizationJob}`
+        : "http://localhost:8000/route";
+      const response = await fetch(url, {
         method: "GET",
         headers: {
           "Content-Type": "application/json",
@@ -668,8 +695,12 @@ const MapViewer = () => {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
 
-      const data = await response.json();
+      const body = await response.json();
+      const data = optimizationJob ? body.result : body;
       console.log("Response from server:", data);
+      if (!data) {
+        return;
+      }
       setOptimizedWaypoints(
         data.solution_array.map((sol: any, index: number) => {
           return { ...sol, idx: data.waypoint_order[index] };
@@ -680,6 +711,8 @@ const MapViewer = () => {
           return { ...p, y: mapParams.current.height - p.y };
         })
       );
+      // a trajectory sharper than the robot can turn is not followed, the waypoints are sent instead
+      setTrajectory(data.trajectory?.feasible ? data.trajectory.poses : []);
       console.log("Response from server:", data);
     } catch (error) {
       console.error("Failed to send waypoints:", error);
@@ -687,6 +720,14 @@ const MapViewer = () => {
   };
 
   const startNavigation = async () => {
+    // follow the smoothed trajectory when the route has a feasible one, so Nav2 does not plan every leg again
+    if (trajectory.length > 0) {
+      return sendNavigation("path", {
+        frame_id: "map",
+        poses: trajectory.map((pose) => ({ ...pose, z: 0.0 })),
+      });
+    }
+
     const payload = {
       frame_id: "map",
       waypoints: optimizedWaypoints.slice(1).map((point) => {
@@ -705,8 +746,12 @@ const MapViewer = () => {
       }),
     };
 
+    return sendNavigation("waypoints", payload);
+  };
+
+  const sendNavigation = async (endpoint: string, payload: object) => {
     try {
-      const response = await fetch("http://localhost:8000/waypoints", {
+      const response = await fetch(`http://localhost:8000/${endpoint}`, {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
@@ -0,0 +1,118 @@
+import { useState, useEffect, useRef } from 'react';
+import { Point } from '../types/waypoint';
+
+// Route segment frames of /ws/route, see server/services/route_stream.py
+const SEGMENT_MAGIC = 'RSEG';
+const HEADER_SIZE = 46;
+
+export type RouteSegment = {
+  jobId: string;
+  version: number;
+  robot: number;
+  index: number;
+  count: number;
+  points: Array<Point>;
+};
+
+export type StreamedRoute = {
+  version: number;
+  // legs per robot, in leg order; a leg is undefined until it arrives
+  robots: Array<Array<Array<Point> | undefined>>;
+};
+
+export const decodeSegment = (buffer: ArrayBuffer): RouteSegment | null => {
+  const view = new DataView(buffer);
+  if (buffer.byteLength < HEADER_SIZE) {
+    return null;
+  }
+  const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+  if (magic !== SEGMENT_MAGIC) {
+    return null;
+  }
+  const jobId = Array.from(new Uint8Array(buffer, 4, 16))
+    .map((b) => b.toString(16).padStart(2, '0'))
+    .join('');
+  const version = view.getUint32(20, true);
+  const robot = view.getUint16(24, true);
+  const index = view.getUint16(26, true);
+  const count = view.getUint16(28, true);
+  const nPoints = view.getUint32(30, true);
+  const step = view.getFloat32(34, true);
+  let x = view.getInt32(38, true);
+  let y = view.getInt32(42, true);
+
+  const points: Array<Point> = [];
+  if (nPoints > 0) {
+    points.push({ x: x * step, y: y * step });
+  }
+  for (let i = 1; i < nPoints; i++) {
+    const offset = HEADER_SIZE + (i - 1) * 4;
+    x += view.getInt16(offset, true);
+    y += view.getInt16(offset + 2, true);
+    points.push({ x: x * step, y: y * step });
+  }
+  return { jobId, version, robot, index, count, points };
+};
+
+// streamed routes kept for jobs that are not (yet) the one shown
+const KEPT_JOBS = 8;
+
+export const useRouteStream = (url: string | URL, jobId: string | null) => {
+  const [route, setRoute] = useState<StreamedRoute | null>(null);
+  // latest route of every job streamed: the first frames of a job can arrive
+  // before the /optimize response with its job id
+  const routes = useRef<Map<string, StreamedRoute>>(new Map());
+  const currentJob = useRef<string | null>(jobId);
+
+  useEffect(() => {
+    currentJob.current = jobId;
+    setRoute(jobId ? routes.current.get(jobId) ?? null : null);
+  }, [jobId]);
+
+  useEffect(() => {
+    // opened on mount rather than per job, so no frame is sent before it connects
+    const ws = new WebSocket(url);
+    ws.binaryType = 'arraybuffer';
+    ws.onmessage = (event) => {
+      if (!(event.data instanceof ArrayBuffer)) {
+        return;
+      }
+      const segment = decodeSegment(event.data);
+      if (!segment) {
+        return;
+      }
+      let streamed = routes.current.get(segment.jobId);
+      if (streamed && segment.version < streamed.version) {
+        return;
+      }
+      if (!streamed || segment.version > streamed.version) {
+        streamed = { version: segment.version, robots: [] };
+      }
+      const robots = streamed.robots.slice();
+      const legs = (robots[segment.robot] ?? new Array(segment.count).fill(undefined)).slice();
+      legs[segment.index] = segment.points;
+      robots[segment.robot] = legs;
+      const updated = { version: streamed.version, robots };
+      routes.current.delete(segment.jobId);
+      routes.current.set(segment.jobId, updated);
+      if (routes.current.size > KEPT_JOBS) {
+        const oldest = routes.current.keys().next().value;
+        if (oldest !== undefined && oldest !== currentJob.current) {
+          routes.current.delete(oldest);
+        }
+      }
+      if (segment.jobId === currentJob.current) {
+        setRoute(updated);
+      }
+    };
+    ws.onerror = (error) => {
+      console.error('Route stream error:', error);
+    };
+
+    return () => {
+      ws.close();
+    };
+  }, [url]);
+
+  return route;
+};
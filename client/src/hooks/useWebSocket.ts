@@ -1,6 +1,7 @@
 import { useState, useEffect, useRef, useCallback } from 'react';
 
 export type ProcessStatus = {
+    jobId: string | null;
     current: string | null;
     progress: number,
     message: string,
@@ -11,6 +12,7 @@ export type ProcessStatus = {
 export const useWebSocket = (url: string | URL) => {
   const [connectionStatus, setConnectionStatus] = useState('Disconnected');
   const [processStatus, setProcessStatus] = useState<ProcessStatus>({
+    jobId: null,
     current: null,
     progress: 0,
     message: '',
@@ -39,6 +41,7 @@ export const useWebSocket = (url: string | URL) => {
           
           if (data.type === 'progress') {
             setProcessStatus({
+              jobId: data.job_id ?? null,
               current: data.process,
               progress: data.progress,
               message: data.message,
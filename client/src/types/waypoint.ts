@@ -32,6 +32,13 @@ export type Point = {
   y: number;
 }
 
+// pose of an optimized route's trajectory, in the map frame
+export type PathPose = {
+  x: number;
+  y: number;
+  yaw: number;
+}
+
 export type Marker = {
   x: number;
   y: number;
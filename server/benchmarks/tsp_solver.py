@@ -0,0 +1,63 @@
+"""
+Solve time of run_or_tools with arc costs evaluated from a matrix in C++
+versus the former Python transit callback.
+
+    python -m server.benchmarks.tsp_solver --waypoints 50 60 80
+
+The cost matrices are synthetic but shaped like compute_cost_matrix output:
+16 heading states per waypoint (one for the start waypoint), scaled integer
+costs and VERY_LARGE between states of the same waypoint.
+"""
+import argparse
+import math
+import time
+
+import numpy as np
+
+from server.models.waypoints_request import SolverOptions
+from server.services.optimizer import build_state_list, run_or_tools
+
+
+def synthetic_cost_matrix(n_waypoints: int, n_headings: int = 16, size: float = 400.0, scale: int = 1000, seed: int = 0):
+    """Straight-line distance plus a penalty for the heading change at both ends, per state pair."""
+    rng = np.random.default_rng(seed)
+    waypoints = rng.uniform(0, size, (n_waypoints, 2))
+    headings = np.arange(n_headings) * 2 * math.pi / n_headings
+    state_list = build_state_list(waypoints, headings, start_heading_idx=0)
+    index_map = {state: k for k, state in enumerate(state_list)}
+
+    wp = np.array([i for i, _ in state_list])
+    theta = headings[[h for _, h in state_list]]
+    delta = waypoints[wp][None, :, :] - waypoints[wp][:, None, :]
+    bearing = np.arctan2(delta[..., 1], delta[..., 0])
+    turn = np.abs(np.angle(np.exp(1j * (bearing - theta[:, None])))) + np.abs(np.angle(np.exp(1j * (theta[None, :] - bearing))))
+    distances = np.hypot(delta[..., 0], delta[..., 1]) + 12.0 * turn
+
+    cost_matrix = (distances * scale).astype(np.int64)
+    cost_matrix[wp[:, None] == wp[None, :]] = int(1e9)
+    return cost_matrix, index_map
+
+
+def benchmark(n_waypoints: int, solver: SolverOptions, repeat: int):
+    cost_matrix, index_map = synthetic_cost_matrix(n_waypoints)
+    for native_costs, label in ((False, "python callback"), (True, "transit matrix")):
+        times, costs = [], []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            _, cost = run_or_tools(cost_matrix, index_map, n_waypoints, 16, 0, solver=solver, native_costs=native_costs)
+            times.append(time.perf_counter() - start)
+            costs.append(cost)
+        print(f"{n_waypoints:4d} waypoints ({len(cost_matrix)} states), {solver.profile:6s} {label:16s}: "
+              f"{min(times):7.2f} s (best of {repeat}), cost {min(costs)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--waypoints", type=int, nargs="+", default=[50, 80])
+    parser.add_argument("--profile", choices=["fast", "guided"], default="fast")
+    parser.add_argument("--time-limit", type=float, default=60.0)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for n in args.waypoints:
+        benchmark(n, SolverOptions(profile=args.profile, time_limit=args.time_limit), args.repeat)
@@ -1,205 +1,175 @@
-import asyncio
-from concurrent.futures import ThreadPoolExecutor
-import json
-from typing import List, Optional
-import rclpy
 import time
-from nav2_simple_commander.robot_navigator import BasicNavigator, TaskResult
-import threading
-from geometry_msgs.msg import PoseStamped
-from .utils.utils import quaternion_from_euler
 
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+# start of the startup report; the imports below are its first phase
+STARTUP_STARTED = time.perf_counter()
+
+import asyncio
+from functools import partial
+import os
+from typing import Callable, Optional
+import numpy as np
+
+from fastapi import FastAPI, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
 
 from server.models.precompute_request import PrecomputeRequest
-from .models.waypoints_request import WaypointsRequest, FollowWaypointsRequest, NavigationResponse
-from .services.optimizer import optimize_waypoints, precompute_graph
+from .models.waypoints_request import MapMetaData, WaypointsRequest, FollowWaypointsRequest, FollowPathRequest, NavigationResponse
+from .services.optimizer import LATTICE_PARAMS, SolverPool, load_map, load_map_buffer, optimize_waypoints, precompute_graph, update_graph
+from .services.lattice_cache import LatticeCache
+from .services.navigation import create_backend
+from .services.distance_cache import DistanceCache
+from .services.jobs import Job, JobScheduler
 from .services.progress_checker import ProcessProgress
+from .services.socket_func import ProgressBus, progress_event
+from .services.route_render import RouteRenderer
+from .services.route_stream import encode_segment
+from .services.search import shutdown_row_search_pool
+from .services.startup import StartupReport
 from fastapi.middleware.cors import CORSMiddleware
 
-async def broadcast_to_websockets(process_type: str, progress_val: int, message: str, error: Optional[str] = None):
-    """Async function to broadcast to all WebSocket connections"""
-    if not active_connections:
-        return
-        
-    status_message = {
-        "type": "progress",
-        "process": process_type,
-        "progress": progress_val,
-        "message": message,
-        "timestamp": time.time()
-    }
-    
-    if error:
-        status_message["error"] = error
-    
-    # Send to all connected clients
-    disconnected = []
-    for connection in active_connections:
-        try:
-            await connection.send_text(json.dumps(status_message))
-        except:
-            disconnected.append(connection)
-    
-    # Remove disconnected clients
-    for conn in disconnected:
-        active_connections.remove(conn)
-
-def schedule_broadcast(process_type: str, progress_val: int, message: str, error: Optional[str] = None):
-    """Schedule a broadcast from a synchronous context"""
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    try:
-        loop.run_until_complete(broadcast_to_websockets(process_type, progress_val, message, error))
-    finally:
-        loop.close()
-
-ros_initialized = False
-navigator = None
-ros_thread = None
 G = None
 grid = None
+# latest route of any optimization job, for /route
 optimized_order = None
 
-current_process = None  # 'precomputation', 'optimization', 'navigation', or None
-process_lock = threading.Lock()
-
 
-# WebSocket connections
-active_connections: List[WebSocket] = []
-
-# Thread pool for blocking operations
-executor = ThreadPoolExecutor(max_workers=2)
+# Progress events of the worker threads, sent to the WebSocket clients
+progress_bus = ProgressBus()
 
 progress = ProcessProgress()
-progress.add_callback(schedule_broadcast)
-
-def init_ros():
-    global ros_initialized, navigator
-    
-    rclpy.init()
-    navigator = BasicNavigator()
-    
-    # Wait for Nav2 to be ready
-    navigator.waitUntilNav2Active()
-    
-    ros_initialized = True
-    
-    # Keep ROS2 running
-    while ros_initialized:
-        rclpy.spin_once(navigator, timeout_sec=0.1)
-        time.sleep(0.01)
-    
-    # Clean up when done
-    navigator.destroy_node()
-    rclpy.shutdown()
-
-def start_ros_thread():
-    global ros_thread
-    ros_thread = threading.Thread(target=init_ros)
-    ros_thread.daemon = True
-    ros_thread.start()
-
-def shutdown_ros():
-    global ros_initialized
-    ros_initialized = False
-    if ros_thread:
-        ros_thread.join(timeout=1.0)
-
-# Start the ROS thread when the module is imported
-start_ros_thread()
-
-def run_precomputation(req: PrecomputeRequest):
-    """Blocking precomputation function - runs in thread"""
-    global current_process, G, grid
+progress.add_callback(progress_bus.publish)
+
+# Route geometry of the optimization jobs, sent as binary segment frames on /ws/route;
+# routes are streamed in full every time a better one is found, so the buffers are larger
+route_bus = ProgressBus(max_pending=4096, min_interval=0.05, client_buffer=1024)
+
+# Jobs run on a thread pool: lattice (pre)computations are exclusive, optimizations
+# share the immutable lattice and run in parallel, navigation holds the navigator
+MAX_CONCURRENT_OPTIMIZATIONS = int(os.environ.get("MAX_CONCURRENT_OPTIMIZATIONS", 2))
+scheduler = JobScheduler(
+    max_workers=int(os.environ.get("MAX_CONCURRENT_JOBS", 4)),
+    limits={"optimization": MAX_CONCURRENT_OPTIMIZATIONS},
+    progress=progress
+)
+# OR-Tools solves of concurrent optimizations, one process each
+solver_pool = SolverPool(MAX_CONCURRENT_OPTIMIZATIONS)
+LATTICE_WRITE = [("lattice", True)]
+LATTICE_READ = [("lattice", False)]
+NAVIGATOR = [("navigator", True)]
+
+# route images for /route/image, rendered on a background thread; with ROUTE_PLOT_PATH set
+# (debug mode) every finished optimization also writes its image there
+route_renderer = RouteRenderer()
+ROUTE_PLOT_PATH = os.environ.get("ROUTE_PLOT_PATH")
+
+lattice_cache = LatticeCache("lattice_cache")
+# waypoint state distances of the current lattice, reused across /optimize requests
+distance_cache = DistanceCache(heuristic_params=LATTICE_PARAMS)
+
+# where navigation jobs go: "nav2" (default), "sim" for an in-process simulated robot,
+# or "none" for a planner-only server; started with the app, not at import
+navigation = create_backend(os.environ.get("NAV_BACKEND", "nav2"))
+
+startup_report = StartupReport(STARTUP_STARTED)
+
+def run_precomputation(job: Job, info: MapMetaData, load_grid: Callable[[], np.ndarray]):
+    """Blocking precomputation job - holds the lattice exclusively"""
+    global G, grid
     
     try:        
-        progress.update("precomputation", 0, "Starting precomputation...")
+        job.progress.update("precomputation", 0, "Starting precomputation...")
         
-        grid, G = precompute_graph(req, progress)
+        grid, G = precompute_graph(info, load_grid(), job.progress, cache=lattice_cache)
+        distance_cache.clear()
+        job.progress.update("precomputation", 97, "Loading heuristic table...")
+        distance_cache.prepare()
 
-        progress.update("precomputation", 100, "Finished precomputation...")
+        job.progress.update("precomputation", 100, "Finished precomputation...")
+        return {"num_nodes": G.num_nodes, "num_edges": G.num_edges}
         
     except Exception as e:
-        #progress.update("precomputation", 0, "Precomputation failed", str(e))
+        #job.progress.update("precomputation", 0, "Precomputation failed", str(e))
         raise
-    finally:
-        with process_lock:
-            current_process = None
 
-def run_optimization(req: WaypointsRequest):
-    """Blocking optimization function - runs in thread"""
-    global grid, G, optimized_order, current_process
-    
+def run_update(job: Job, info: MapMetaData, load_grid: Callable[[], np.ndarray]):
+    """Blocking incremental lattice update job - holds the lattice exclusively"""
+    global G, grid
+
     try:
-        progress.update("optimization", 0, "Starting optimizitation...")
-        optimized_order = optimize_waypoints(grid, G, req)
-        progress.update("optimization", 100, "Optimization finished...")
+        job.progress.update("precomputation", 0, "Starting lattice update...")
+
+        grid, G = update_graph(info, load_grid(), grid, G, job.progress, cache=lattice_cache)
+        distance_cache.clear()
+
+        job.progress.update("precomputation", 100, "Finished lattice update...")
+        return {"num_nodes": G.num_nodes, "num_edges": G.num_edges}
+
     except Exception as e:
-        progress.update("optimization", 0, "Optimization failed", str(e))
+        job.progress.update("precomputation", 0, "Lattice update failed", str(e))
         raise
-    finally:
-        with process_lock:
-            current_process = None
 
-def run_navigation(req: FollowWaypointsRequest):
-    """Blocking navigation function - runs in thread"""
-    global navigator, ros_initialized, current_process
-    
-    try:        
-        if not ros_initialized or navigator is None:
-            raise Exception("ROS2 navigation system not initialized")
-        
-        if len(req.waypoints) == 0:
-            raise Exception("No waypoints provided")
-        
-        progress.update("navigation", 0, "Starting navigation...")
-
-        # Convert waypoints to PoseStamped messages
-        pose_goals = []
-        for i, wp in enumerate(req.waypoints):
-            
-            goal_pose = PoseStamped()
-            goal_pose.header.frame_id = req.frame_id
-            goal_pose.header.stamp = navigator.get_clock().now().to_msg()
-            
-            # Set position
-            goal_pose.pose.position.x = wp.x
-            goal_pose.pose.position.y = wp.y
-            goal_pose.pose.position.z = wp.z
-            
-            # Set orientation from yaw
-            q = quaternion_from_euler(0, 0, wp.yaw)
-            goal_pose.pose.orientation.x = q[0]
-            goal_pose.pose.orientation.y = q[1]
-            goal_pose.pose.orientation.z = q[2]
-            goal_pose.pose.orientation.w = q[3]
-            
-            pose_goals.append(goal_pose)
-
-        navigator.followWaypoints(pose_goals)
-
-        progress.update("navigation", 10, 
-            f"Successfully sent {len(pose_goals)} waypoints to navigator")
-
-        while not navigator.isTaskComplete():
-            feedback = navigator.getFeedback()
-
-        result = navigator.getResult()
-        
-        if result == TaskResult.SUCCEEDED:
-            progress.update("navigation", 100, f"Navigation succeeded")
-        elif result == TaskResult.CANCELED:
-            progress.update("navigation", 100, f"Navigation cancelled")
-        elif result == TaskResult.FAILED:
-            progress.update("navigation", 100, f"Navigation failed")
+def publish_route(job: Job, route: dict):
+    """Serve an improving route on /jobs/{id} and /route while the solver keeps searching"""
+    global optimized_order
+    job.result = route
+    optimized_order = route
 
-        
+def publish_segment(job: Job, version: int, robot: int, index: int, count: int, xs, ys):
+    """Stream one leg of a route of job on /ws/route"""
+    route_bus.publish_frame(encode_segment(job.id, version, robot, index, count, xs, ys, G.node_spacing))
+
+def run_optimization(job: Job, req: WaypointsRequest):
+    """Blocking optimization job - shares the lattice with other optimizations"""
+    global optimized_order
+
+    try:
+        if G is None:
+            raise Exception("No lattice, run /precompute first")
+        job.progress.update("optimization", 0, "Starting optimizitation...")
+        route = optimize_waypoints(grid, G, req, job.progress, distance_cache=distance_cache,
+                                   on_route=partial(publish_route, job), solver_pool=solver_pool,
+                                   on_segment=partial(publish_segment, job))
+        optimized_order = route
+        if ROUTE_PLOT_PATH and "error" not in route:
+            route_renderer.render(job.id, grid, route, save_path=ROUTE_PLOT_PATH)
+        job.progress.update("optimization", 100, "Optimization finished...")
+        return route
     except Exception as e:
+        job.progress.update("optimization", 0, "Optimization failed", str(e))
         raise
-    finally:
-        with process_lock:
-            current_process = None
+
+def run_navigation(job: Job, req: FollowWaypointsRequest):
+    """Blocking navigation job - holds the navigator exclusively"""
+    if len(req.waypoints) == 0:
+        raise Exception("No waypoints provided")
+
+    job.progress.update("navigation", 0, "Starting navigation...")
+    return {"result": navigation.follow_waypoints(req.waypoints, req.frame_id, job.progress)}
+
+def run_follow_path(job: Job, req: FollowPathRequest):
+    """
+    Blocking navigation job along a precomputed path: the robot tracks the
+    poses directly, so Nav2's planner server does not plan each leg again.
+    """
+    if len(req.poses) == 0:
+        raise Exception("No poses provided")
+
+    job.progress.update("navigation", 0, "Starting navigation...")
+    return {"result": navigation.follow_path(req.poses, req.frame_id, job.progress)}
+
+def restore_lattice(job: Job):
+    """Startup job: restore the most recently used lattice so /optimize works without /precompute"""
+    global grid, G
+
+    with startup_report.phase("lattice restore"):
+        cached = lattice_cache.latest()
+    if cached is None:
+        return None
+    grid, G = cached
+    print(f"Restored cached lattice with {G.num_nodes} nodes")
+    with startup_report.phase("heuristic table"):
+        distance_cache.prepare()
+    return {"num_nodes": G.num_nodes, "num_edges": G.num_edges}
 
 app = FastAPI()
 
@@ -214,97 +184,199 @@ app.add_middleware(
 @app.websocket("/ws/progress")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    active_connections.append(websocket)
-    
-    # Send current status on connection
+
+    # Send current status on connection, then every progress event
+    initial = None
     if progress.current:
-        status_message = {
-            "type": "progress",
-            "process": progress.current,
-            "progress": progress.progress,
-            "message": progress.message,
-            "timestamp": time.time()
-        }
-        if progress.error:
-            status_message["error"] = progress.error
-        
-        await websocket.send_text(json.dumps(status_message))
+        initial = progress_event(progress.current, progress.progress, progress.message, progress.error,
+                                 progress.current_job)
+    progress_bus.connect(websocket, initial)
     
     try:
         while True:
             # Keep connection alive with ping/pong
             await websocket.receive_text()
     except WebSocketDisconnect:
-        active_connections.remove(websocket)
+        pass
+    finally:
+        progress_bus.disconnect(websocket)
+
+@app.websocket("/ws/route")
+async def route_stream_endpoint(websocket: WebSocket):
+    """Binary frames with the legs of every route found, see services/route_stream.py"""
+    await websocket.accept()
+    route_bus.connect(websocket)
+
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        route_bus.disconnect(websocket)
 
 @app.get("/")
 async def read_root():
     return {"Hello": "World"}
 
+async def read_binary_map(request: Request, encoding: str):
+    """
+    Parse a binary map upload: the body is the occupancy grid as uint8 cells
+    (raw, zlib or rle encoded, see load_map_buffer) and the X-Map-Info header
+    holds the MapMetaData as JSON. The grid is decoded off the event loop,
+    before any job is queued, so a malformed upload is rejected with 400.
+    """
+    try:
+        info = MapMetaData.model_validate_json(request.headers.get("x-map-info", ""))
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid X-Map-Info header: {e}")
+    if encoding not in ("raw", "zlib", "rle"):
+        raise HTTPException(status_code=400, detail=f"Unknown map encoding: {encoding}")
+
+    body = await request.body()
+    try:
+        decoded = await asyncio.to_thread(load_map_buffer, body, info.width, info.height, encoding)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return info, lambda: decoded
+
+def submit_precomputation(info: MapMetaData, load_grid: Callable[[], np.ndarray]):
+    job = scheduler.submit("precomputation", partial(run_precomputation, info=info, load_grid=load_grid), LATTICE_WRITE)
+    
+    return {"success": True, "message": "Precomputation queued", "job_id": job.id}
+
+def submit_update(info: MapMetaData, load_grid: Callable[[], np.ndarray]):
+    if G is None or grid is None:
+        raise HTTPException(status_code=409, detail="No lattice to update, run /precompute first")
+    if (info.height, info.width) != grid.shape:
+        raise HTTPException(status_code=400,
+                          detail="Map size changed, run /precompute instead")
+
+    job = scheduler.submit("precomputation", partial(run_update, info=info, load_grid=load_grid), LATTICE_WRITE)
+
+    return {"success": True, "message": "Lattice update queued", "job_id": job.id}
+
 @app.post("/precompute")
 async def precompute(req: PrecomputeRequest):
-    global current_process
+    return submit_precomputation(req.info, partial(load_map, req.map, req.info.width, req.info.height))
 
-    with process_lock:
-        if current_process is not None:
-            raise HTTPException(status_code=409, 
-                              detail=f"Another process is running: {current_process}")
-        current_process = "precomputation"
+@app.post("/precompute/binary")
+async def precompute_binary(request: Request, encoding: str = "raw"):
+    return submit_precomputation(*await read_binary_map(request, encoding))
 
-    # Submit to thread pool
-    executor.submit(run_precomputation, req)
-    
-    return {"success": True, "message": "Precomputation started"}
+@app.post("/precompute/update")
+async def precompute_update(req: PrecomputeRequest):
+    return submit_update(req.info, partial(load_map, req.map, req.info.width, req.info.height))
+
+@app.post("/precompute/update/binary")
+async def precompute_update_binary(request: Request, encoding: str = "raw"):
+    return submit_update(*await read_binary_map(request, encoding))
 
 @app.post("/optimize")
 async def optimize(req: WaypointsRequest):
-    global current_process
-
-    with process_lock:
-        if current_process is not None:
-            raise HTTPException(status_code=409, 
-                              detail=f"Another process is running: {current_process}")
-        current_process = "optimization"
-        
-    # Submit to thread pool
-    executor.submit(run_optimization, req)
+    job = scheduler.submit("optimization", partial(run_optimization, req=req), LATTICE_READ)
 
-    return {"success": True, "message": "Optimization started"}
+    return {"success": True, "message": "Optimization queued", "job_id": job.id}
 
 @app.get("/route")
 async def route():
+    """Latest route of any optimization; /jobs/{id} has the route of one request"""
     return optimized_order
 
 
+@app.get("/route/image")
+async def route_image(job_id: Optional[str] = None):
+    """PNG of the latest route, or of the route of an optimization job, over the map"""
+    if job_id is not None:
+        job = scheduler.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+        route = job.result
+    else:
+        route = optimized_order
+    if not isinstance(route, dict) or "error" in route or grid is None:
+        raise HTTPException(status_code=404, detail="No route to render")
+    image = await asyncio.wrap_future(route_renderer.render(job_id or "latest", grid, route))
+    return Response(content=image, media_type="image/png")
+
+
 @app.post("/waypoints", response_model=NavigationResponse)
 async def follow_waypoints(req: FollowWaypointsRequest):
-    global current_process
-    
-    with process_lock:
-        if current_process is not None:
-            raise HTTPException(status_code=409, 
-                              detail=f"Another process is running: {current_process}")
-        current_process = "navigation"
-    
-    # Submit to thread pool
-    executor.submit(run_navigation, req)
+    job = scheduler.submit("navigation", partial(run_navigation, req=req), NAVIGATOR)
     
     return NavigationResponse(
         success=True,
-        message="Navigation started",
-        waypoints_accepted=len(req.waypoints)
+        message="Navigation queued",
+        waypoints_accepted=len(req.waypoints),
+        job_id=job.id
     )
 
+@app.post("/path", response_model=NavigationResponse)
+async def follow_path(req: FollowPathRequest):
+    """Follow the poses of an optimized route's trajectory"""
+    job = scheduler.submit("navigation", partial(run_follow_path, req=req), NAVIGATOR)
+
+    return NavigationResponse(
+        success=True,
+        message="Navigation queued",
+        waypoints_accepted=len(req.poses),
+        job_id=job.id
+    )
+
+@app.get("/jobs")
+async def list_jobs():
+    """Status of the queued, running and recently finished jobs"""
+    return [job.to_dict(with_result=False) for job in scheduler.jobs()]
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, include_path: bool = True):
+    """
+    Status and result of one job; an optimization's result is its best route so far.
+    Clients that draw the route from /ws/route can leave out the path_points.
+    """
+    job = scheduler.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    status = job.to_dict()
+    if not include_path and isinstance(status["result"], dict):
+        status["result"] = without_path_points(status["result"])
+    return status
+
+def without_path_points(result: dict) -> dict:
+    """Route response without its path geometry (fleet responses have it per robot)"""
+    result = {key: value for key, value in result.items() if key not in ("path_points", "trajectory")}
+    if "routes" in result:
+        result["routes"] = [without_path_points(route) for route in result["routes"]]
+    return result
+
 @app.get("/status")
 async def get_status():
     """Get current process status"""
+    running = scheduler.running()
     return {
-        "current_process": current_process,
+        "current_process": running[0].kind if running else None,
+        "running_jobs": [job.to_dict(with_result=False) for job in running],
         "progress": progress.progress,
         "message": progress.message,
-        "error": progress.error
+        "error": progress.error,
+        "navigation": navigation.status(),
+        "startup": startup_report.to_dict()
     }
 
+@app.on_event("startup")
+def startup_event():
+    """Start the navigation backend; the cached lattice is restored by a job, so requests are served right away"""
+    startup_report.record("imports", time.perf_counter() - STARTUP_STARTED)
+    with startup_report.phase(f"{navigation.name} backend start"):
+        navigation.start()
+    scheduler.submit("precomputation", restore_lattice, LATTICE_WRITE)
+    startup_report.ready()
+
 @app.on_event("shutdown")
 def shutdown_event():
-    shutdown_ros()
\ No newline at end of file
+    navigation.shutdown()
+    scheduler.shutdown()
+    solver_pool.shutdown()
+    route_renderer.shutdown()
+    shutdown_row_search_pool()
\ No newline at end of file
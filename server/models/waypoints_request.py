@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Tuple
+from typing import List, Literal, Optional, Tuple
 
 class Point(BaseModel):
     x: float
@@ -12,10 +12,26 @@ class MapMetaData(BaseModel):
     height: int
     origin: Point
 
+class SolverOptions(BaseModel):
+    # "fast": cheapest-arc solution descended to its local optimum;
+    # "guided": keep improving it with guided local search until time_limit
+    # (time_limit also caps "fast")
+    profile: Literal["fast", "guided"] = "fast"
+    time_limit: float = 10.0  # seconds
+
+class RobotStart(BaseModel):
+    x: int
+    y: int
+    heading: float  # in radians
+
 class WaypointsRequest(BaseModel):
     info: MapMetaData
     start_heading: float
     waypoints: List[Tuple[int, int]]
+    solver: SolverOptions = SolverOptions()
+    # fleet mode: one route per robot from its start pose, and waypoints
+    # (including waypoints[0]) are only goals; start_heading is unused
+    robots: List[RobotStart] = []
 
 class WaypointModel(BaseModel):
     x: float
@@ -27,7 +43,13 @@ class FollowWaypointsRequest(BaseModel):
     waypoints: List[WaypointModel]
     frame_id: str = "map"
 
+class FollowPathRequest(BaseModel):
+    # dense poses to track, e.g. the "trajectory" of an optimization response
+    poses: List[WaypointModel]
+    frame_id: str = "map"
+
 class NavigationResponse(BaseModel):
     success: bool
     message: str
     waypoints_accepted: int
+    job_id: Optional[str] = None
@@ -0,0 +1,302 @@
+import math
+import threading
+from collections import OrderedDict
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from server.services.heuristic_table import heuristic_table
+from server.services.lattice import Lattice, LatticeParams
+from server.services.search import LatticeSearch, PathTree, row_search_pool
+
+
+class _Entry:
+    """Cached data of one state: distances to other states and the trees they came from."""
+
+    __slots__ = ('distances', 'forward', 'backward')
+
+    def __init__(self):
+        self.distances = {}  # target node -> distance from this node (inf if unreachable)
+        self.forward: List[PathTree] = []  # searches from this node
+        self.backward: List[PathTree] = []  # searches toward this node, on the reversed lattice
+
+    @property
+    def size(self) -> int:
+        return len(self.distances) + sum(len(tree.nodes) for tree in self.forward + self.backward)
+
+
+class CachedRow:
+    """Row of a cached distance matrix, used like the PathTree of its origin state."""
+
+    def __init__(self, cache: 'DistanceCache', source: int):
+        self.cache = cache
+        self.source = source
+
+    def distance_to(self, target: int) -> float:
+        return self.cache.distance(self.source, target)
+
+    def path_to(self, target: int) -> Optional[List[int]]:
+        return self.cache.path(self.source, target)
+
+
+class DistanceCache:
+    """
+    State-to-state lattice distances kept across optimization requests.
+
+    Entries belong to one lattice version and are keyed by the lattice node of
+    each (x, y, heading_idx) state. A request only searches the pairs that are
+    not cached yet: new origin states get a forward search to every state, and
+    the missing columns of known origins come from one search per new target
+    state on the reversed lattice. Memory is bounded by max_items cached
+    distances and tree nodes, evicting least recently used states first.
+    Binding another lattice, or clear() when /precompute replaces the graph,
+    drops every entry. Single pairs missing from the cache, and searches
+    toward the states of a single waypoint, run A* guided by the
+    obstacle-free heuristic table of heuristic_params if given. Every search
+    logs its node expansions.
+    """
+
+    def __init__(
+        self,
+        max_items: int = 4_000_000,
+        heuristic_params: Optional[LatticeParams] = None
+    ):
+        self.max_items = max_items
+        self.heuristic_params = heuristic_params
+        # guards the entries only; searches run outside it, each thread with its own LatticeSearch
+        self._lock = threading.RLock()
+        self._lattice: Optional[Lattice] = None
+        self._reversed: Optional[Lattice] = None
+        self._local = threading.local()
+        self._entries: 'OrderedDict[int, _Entry]' = OrderedDict()
+
+    def prepare(self):
+        """
+        Load (or build and save, about 5 s the first time) the heuristic table,
+        so that the point-to-point queries of the requests do not wait for it.
+        """
+        if self.heuristic_params is not None:
+            heuristic_table(self.heuristic_params)
+
+    def clear(self):
+        with self._lock:
+            self._lattice = None
+            self._reversed = None
+            self._entries.clear()
+
+    def _bind(self, lattice: Lattice):
+        if lattice is not self._lattice:
+            self.clear()
+            self._lattice = lattice
+
+    def _reversed_lattice(self, lattice: Lattice) -> Lattice:
+        """Reversed copy of lattice, shared by the threads' reverse searches."""
+        with self._lock:
+            if lattice is not self._lattice:
+                return lattice.reversed()
+            if self._reversed is None:
+                self._reversed = lattice.reversed()
+            return self._reversed
+
+    def _thread_search(self, lattice: Lattice, reverse: bool = False) -> LatticeSearch:
+        """
+        LatticeSearch of the calling thread over lattice (or its reversed copy).
+        A search keeps per-node buffers, so concurrent requests cannot share one.
+        """
+        searches = getattr(self._local, 'searches', None)
+        if searches is None or searches[0] is not lattice:
+            searches = self._local.searches = [lattice, None, None]
+        if searches[1 + reverse] is None:
+            searches[1 + reverse] = LatticeSearch(self._reversed_lattice(lattice) if reverse else lattice)
+        return searches[1 + reverse]
+
+    def _heuristic(self, lattice: Lattice, search: LatticeSearch, targets, reverse: bool = False):
+        """
+        A* bound toward targets from the heuristic table, or Euclidean without
+        one and on the reversed lattice (the table only bounds forward motion).
+        """
+        if self.heuristic_params is not None and not reverse:
+            table = heuristic_table(self.heuristic_params)
+            if table.matches(lattice):
+                return table.heuristic(search, targets)
+        return search.euclidean_heuristic(targets)
+
+    def _point_heuristic(self, lattice: Lattice, search: LatticeSearch, source: int, targets, reverse: bool = False):
+        """
+        _heuristic if the targets other than source share one position (the
+        states of one waypoint), else None: toward targets spread over the map
+        the bound to the nearest one prunes too little to pay for itself.
+        """
+        targets = np.asarray(targets, dtype=np.int64)
+        others = targets[(targets >= 0) & (targets != source)]
+        positions = others // lattice.n_headings
+        if others.size and (positions == positions[0]).all():
+            return self._heuristic(lattice, search, others, reverse)
+        return None
+
+    def _missing(self, node_list: List[int], found: dict) -> Tuple[List[int], dict]:
+        """
+        Origins without an entry, to search forward, and target -> origins of
+        the other missing pairs, to search backward. Called with the lock held.
+        """
+        sources, columns = [], {}
+        for n in node_list:
+            entry = self._entries.get(n)
+            if entry is None:
+                if any((n, t) not in found for t in node_list):
+                    sources.append(n)
+                continue
+            self._entries.move_to_end(n)
+            for t in node_list:
+                if t not in entry.distances and (n, t) not in found:
+                    columns.setdefault(t, []).append(n)
+        return sources, columns
+
+    def _entry(self, node: int) -> _Entry:
+        entry = self._entries.get(node)
+        if entry is None:
+            entry = self._entries[node] = _Entry()
+        return entry
+
+    def distance_matrix(
+        self,
+        lattice: Lattice,
+        node_ids: np.ndarray,
+        workers: int = 1,
+        on_search: Optional[Callable[[int, int], None]] = None
+    ) -> Tuple[np.ndarray, List[CachedRow]]:
+        """
+        Distances between all pairs of node_ids (inf if unreachable or not a node,
+        -1) and a CachedRow per origin for path reconstruction. on_search(done, total)
+        is called after every search that was needed.
+
+        The lock is only held to find the missing pairs and to merge the search
+        results, so concurrent requests on the same lattice search in parallel.
+        If another request evicted pairs in between, they are searched again.
+        """
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        nodes = np.unique(node_ids[node_ids >= 0])
+        node_list = nodes.tolist()
+        found = {}  # (origin, target) -> distance, from the searches of this call
+        total = done = 0
+
+        def searched():
+            nonlocal done
+            done += 1
+            if on_search is not None:
+                on_search(done, total)
+
+        while True:
+            with self._lock:
+                self._bind(lattice)
+                sources, columns = self._missing(node_list, found)
+                if not sources and not columns:
+                    known = np.array([
+                        [found[(s, t)] if (s, t) in found else self._entries[s].distances[t] for t in node_list]
+                        for s in node_list
+                    ]).reshape(len(nodes), len(nodes))
+                    break
+            total += len(sources) + len(columns)
+
+            # missing rows from forward searches, missing columns of known origins backwards from each target
+            if workers > 1 and len(sources) > 1 and lattice.path is not None:
+                rows, trees = row_search_pool(lattice.path, workers).distance_rows(
+                    np.array(sources, dtype=np.int64), nodes, lambda *_: searched())
+            else:
+                search = self._thread_search(lattice)
+                rows, trees = [], []
+                for source in sources:
+                    row, tree = search.distances(source, nodes, return_tree=True,
+                                                 heuristic=self._point_heuristic(lattice, search, source, nodes))
+                    rows.append(row)
+                    trees.append(tree)
+                    searched()
+            column_results = []
+            if columns:
+                reverse_search = self._thread_search(lattice, reverse=True)
+                for target, column_sources in columns.items():
+                    column, tree = reverse_search.distances(
+                        target, np.array(column_sources), return_tree=True,
+                        heuristic=self._point_heuristic(lattice, reverse_search, target, column_sources, reverse=True)
+                    )
+                    column_results.append((target, column_sources, column.tolist(), tree))
+                    searched()
+
+            for source, row in zip(sources, rows):
+                found.update(((source, t), d) for t, d in zip(node_list, row.tolist()))
+            for target, column_sources, column, _ in column_results:
+                found.update(((source, target), d) for source, d in zip(column_sources, column))
+
+            with self._lock:
+                if self._lattice is lattice:
+                    for source, row, tree in zip(sources, rows, trees):
+                        entry = self._entry(source)
+                        entry.distances.update(zip(node_list, row.tolist()))
+                        entry.forward.append(tree)
+                    for target, column_sources, column, tree in column_results:
+                        for source, d in zip(column_sources, column):
+                            self._entry(source).distances[target] = d
+                        self._entry(target).backward.append(tree)
+                    self._evict(keep=node_list)
+            expanded = sum(tree.expanded for tree in trees) + sum(result[3].expanded for result in column_results)
+            print(f"Distance cache: {len(sources)} forward and {len(columns)} reverse searches "
+                  f"for {len(node_list)} states, {expanded} nodes expanded")
+
+        valid = node_ids >= 0
+        pos = np.searchsorted(nodes, node_ids[valid])
+        distances = np.full((len(node_ids), len(node_ids)), np.inf)
+        distances[np.ix_(valid, valid)] = known[np.ix_(pos, pos)]
+        return distances, [CachedRow(self, int(n)) for n in node_ids]
+
+    def distance(self, source: int, target: int) -> float:
+        """Cached distance between two states, searched if it is not cached."""
+        if source < 0 or target < 0:
+            return math.inf
+        with self._lock:
+            entry = self._entries.get(source)
+            if entry is not None and target in entry.distances:
+                return entry.distances[target]
+            lattice = self._lattice
+        search = self._thread_search(lattice)
+        distance = float(search.distances(source, [target], heuristic=self._heuristic(lattice, search, [target]))[0])
+        print(f"Distance cache: A* query expanded {search.expanded} nodes")
+        return distance
+
+    def path(self, source: int, target: int) -> Optional[List[int]]:
+        """
+        Node ids of the shortest path between two states, backtracked from the
+        cached trees. Falls back to an A* search if they were evicted.
+        """
+        if source < 0 or target < 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(source)
+            if entry is not None and entry.distances.get(target) == math.inf:
+                return None
+            for tree in entry.forward if entry is not None else ():
+                path = tree.path_to(target)
+                if path is not None:
+                    return path
+            target_entry = self._entries.get(target)
+            for tree in target_entry.backward if target_entry is not None else ():
+                path = tree.path_to(source)
+                if path is not None:
+                    return path[::-1]
+            lattice = self._lattice
+        search = self._thread_search(lattice)
+        _, tree = search.distances(
+            source, [target], return_tree=True, heuristic=self._heuristic(lattice, search, [target])
+        )
+        print(f"Distance cache: A* path query expanded {tree.expanded} nodes")
+        return tree.path_to(target)
+
+    def _evict(self, keep: Iterable[int] = ()):
+        """Drop least recently used states until the cache fits in max_items."""
+        keep = set(keep)
+        total = sum(entry.size for entry in self._entries.values())
+        for node in list(self._entries):
+            if total <= self.max_items:
+                break
+            if node in keep:
+                continue
+            total -= self._entries.pop(node).size
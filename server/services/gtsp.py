@@ -0,0 +1,97 @@
+"""
+Generalized TSP helpers for the waypoint tour.
+
+Every waypoint is a cluster of (waypoint, heading) states and the tour
+visits exactly one state per cluster. Before solving, states that can never
+do better than another state of their cluster are pruned, so OR-Tools works
+on the useful states only; after solving, the headings along the found
+waypoint order are chosen exactly by dynamic programming.
+"""
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+
+def waypoint_clusters(index_map: Dict[Tuple[int, int], int], starts: List[int]) -> List[np.ndarray]:
+    """
+    State indices of every waypoint: first one cluster per start state, where
+    a route begins (other states of a start waypoint are dropped), then the
+    remaining waypoints in waypoint order.
+    """
+    clusters = {}
+    for (wp, _), idx in index_map.items():
+        clusters.setdefault(wp, []).append(idx)
+    start_wps = {wp for wp, states in clusters.items() if set(states) & set(starts)}
+    return [np.array([start], dtype=np.int64) for start in starts] + [
+        np.array(sorted(clusters[wp]), dtype=np.int64) for wp in sorted(clusters) if wp not in start_wps
+    ]
+
+
+def prune_dominated_states(cost_matrix: np.ndarray, clusters: List[np.ndarray], n_starts: int = 1) -> List[np.ndarray]:
+    """
+    Drop the states of open routes starting at the first n_starts clusters that are
+    dominated by another state of their cluster: for every pair of states u, v
+    of other clusters, going u -> dominator -> v is no more expensive than
+    going through the dominated state (nor is ending the tour there). Swapping
+    a dominated state for its dominator never makes a tour longer, so an
+    optimal tour over the kept states is optimal overall (and, route by route,
+    so is a set of routes). Repeats until no
+    state is dominated, as pruning shrinks the sets compared against.
+    """
+    cost_matrix = cost_matrix.astype(np.float64)
+    keep = [cluster.copy() for cluster in clusters]
+    while True:
+        pruned = False
+        kept = np.concatenate(keep)
+        owner = np.repeat(np.arange(len(keep)), [len(cluster) for cluster in keep])
+        starts = np.concatenate(keep[:n_starts])
+        for c in range(n_starts, len(keep)):
+            states = keep[c]
+            if len(states) < 2:
+                continue
+            others = kept[owner != c]
+            incoming = cost_matrix[np.ix_(others, states)].T
+            # routes never return to a start; ending the route is free
+            outgoing = cost_matrix[np.ix_(states, others[~np.isin(others, starts)])]
+            # worst extra cost of a over b when entering, and when leaving
+            extra_in = (incoming[:, None, :] - incoming[None, :, :]).max(axis=2)
+            extra_out = np.maximum((outgoing[:, None, :] - outgoing[None, :, :]).max(axis=2, initial=0.0), 0.0)
+            no_worse = extra_in + extra_out <= 0
+            # among equivalent states the first one stays
+            order = np.arange(len(states))
+            dominates = no_worse & (~no_worse.T | (order[:, None] < order[None, :]))
+            np.fill_diagonal(dominates, False)
+            dominated = dominates.any(axis=0)
+            if dominated.any():
+                keep[c] = states[~dominated]
+                pruned = True
+        if not pruned:
+            return keep
+
+
+def optimize_headings(cost_matrix: np.ndarray, clusters: List[np.ndarray], tour: List[int]) -> Tuple[List[int], int]:
+    """
+    Cheapest states for the waypoint order of tour, keeping its first state:
+    a shortest path through the layered graph of the clusters in that order.
+    Returns the new tour and its cost (without the free return to the start).
+    """
+    cluster_of = np.empty(len(cost_matrix), dtype=np.int64)
+    for c, cluster in enumerate(clusters):
+        cluster_of[cluster] = c
+
+    layers = [np.array([tour[0]], dtype=np.int64)] + [clusters[cluster_of[state]] for state in tour[1:]]
+    cost = np.zeros(1, dtype=np.int64)
+    back = []
+    for prev, layer in zip(layers, layers[1:]):
+        total = cost[:, None] + cost_matrix[np.ix_(prev, layer)]
+        back.append(total.argmin(axis=0))
+        cost = total.min(axis=0)
+
+    pos = int(cost.argmin())
+    best_cost = int(cost[pos])
+    states = [int(layers[-1][pos])]
+    for layer, parent in zip(reversed(layers[:-1]), reversed(back)):
+        pos = int(parent[pos])
+        states.append(int(layer[pos]))
+    states.reverse()
+    return states, best_cost
@@ -0,0 +1,139 @@
+"""
+Obstacle-free cost table used as a search heuristic.
+
+Shortest paths on the lattice of an empty map are a lower bound on the
+shortest paths of any map built with the same parameters (obstacles only
+remove edges) and, unlike a closed-form Reeds-Shepp length, they account
+exactly for the discrete headings, the snapped primitive ends and the reverse
+penalty. The table holds them for every (start_heading, dy, dx, goal_heading)
+within radius nodes, floored to 1/TABLE_SCALE and stored as uint16.
+
+Generate it offline with
+
+    python -m server.services.heuristic_table
+
+or let heuristic_table() build it on first use; either way it is saved to
+the lattice cache directory and loaded once per process. The server loads
+it as soon as it has a lattice (see DistanceCache.prepare), so no query
+waits for it.
+"""
+import hashlib
+import json
+import math
+import os
+from functools import lru_cache
+from typing import Callable
+
+import numpy as np
+
+from server.services.lattice import EDGE_COST_VERSION, Lattice, LatticeParams, build_lattice_graph_from_pgm
+from server.services.progress_checker import ProcessProgress
+from server.services.search import LatticeSearch
+
+# radius of the table in nodes (80 map cells at node_spacing=2)
+DEFAULT_RADIUS = 40
+# table entries are costs in units of 1 / TABLE_SCALE
+TABLE_SCALE = 16
+UNKNOWN = np.iinfo(np.uint16).max
+
+
+def build_heuristic_table(params: LatticeParams, radius: int = DEFAULT_RADIUS) -> np.ndarray:
+    """
+    Search the lattice of an empty map from its centre node, once per start
+    heading. The map extends well past radius so that shortest paths which
+    swing outside the table are not cut off.
+    """
+    margin = radius + 2 * math.ceil((params.turning_radius + params.primitive_length) / params.node_spacing)
+    center = radius + margin
+    size = int(2 * center * params.node_spacing) + 1
+    lattice = build_lattice_graph_from_pgm(
+        np.zeros((size, size), dtype=np.uint8),
+        params.node_spacing,
+        params.n_headings,
+        params.turning_radius,
+        params.primitive_length,
+        ProcessProgress(),
+        nb_points=params.nb_points,
+        reverse_penalty_factor=params.reverse_penalty_factor,
+        footprint_radius=params.footprint_radius
+    )
+    search = LatticeSearch(lattice)
+
+    H = params.n_headings
+    offsets = np.arange(-radius, radius + 1)
+    iy, ix, goal_heading = np.meshgrid(offsets + center, offsets + center, np.arange(H), indexing='ij')
+    box = ((iy * lattice.cols + ix) * H + goal_heading).ravel()
+
+    table = np.empty((H, len(offsets), len(offsets), H), dtype=np.uint16)
+    for h in range(H):
+        dist = search.distances((center * lattice.cols + center) * H + h, box)
+        table[h] = np.where(
+            np.isfinite(dist), np.minimum(np.floor(dist * TABLE_SCALE), UNKNOWN - 1), UNKNOWN
+        ).reshape(table.shape[1:])
+        print(f"Heuristic table: start heading {h + 1}/{H} done")
+    return table
+
+
+class HeuristicTable:
+    """Lookup of the obstacle-free costs, with a scaled Euclidean bound outside the table."""
+
+    def __init__(self, table: np.ndarray, node_spacing: float):
+        self.table = table
+        self.node_spacing = node_spacing
+        self.n_headings = table.shape[0]
+        self.radius = (table.shape[1] - 1) // 2
+
+    def matches(self, lattice: Lattice) -> bool:
+        return lattice.node_spacing == self.node_spacing and lattice.n_headings == self.n_headings
+
+    def heuristic(self, search: LatticeSearch, targets) -> Callable[[np.ndarray], np.ndarray]:
+        """Admissible heuristic for LatticeSearch.distances: bound to the nearest target."""
+        lattice = search.lattice
+        H, R = self.n_headings, self.radius
+        targets = np.asarray(targets, dtype=np.int64)
+        goal_pos, goal_heading = np.divmod(np.unique(targets[targets >= 0]), H)
+        goal_iy, goal_ix = np.divmod(goal_pos, lattice.cols)
+
+        def heuristic(nodes):
+            pos, heading = np.divmod(np.asarray(nodes, dtype=np.int64), H)
+            iy, ix = np.divmod(pos, lattice.cols)
+            dy = goal_iy[None, :] - iy[:, None]
+            dx = goal_ix[None, :] - ix[:, None]
+            bounds = search.cost_per_distance * self.node_spacing * np.hypot(dx, dy)
+
+            inside = (np.abs(dx) <= R) & (np.abs(dy) <= R)
+            rows, cols = np.nonzero(inside)
+            entries = self.table[heading[rows], dy[rows, cols] + R, dx[rows, cols] + R, goal_heading[cols]]
+            known = entries != UNKNOWN
+            rows, cols = rows[known], cols[known]
+            bounds[rows, cols] = np.maximum(bounds[rows, cols], entries[known] / TABLE_SCALE)
+            return bounds.min(axis=1)
+
+        return heuristic
+
+
+def table_path(params: LatticeParams, radius: int = DEFAULT_RADIUS, directory: str = "lattice_cache") -> str:
+    digest = hashlib.sha256(json.dumps([params._asdict(), radius, TABLE_SCALE, EDGE_COST_VERSION], sort_keys=True).encode())
+    return os.path.join(os.path.abspath(directory), f"heuristic_{digest.hexdigest()[:16]}.npy")
+
+
+@lru_cache(maxsize=None)
+def heuristic_table(params: LatticeParams, radius: int = DEFAULT_RADIUS, directory: str = "lattice_cache") -> HeuristicTable:
+    """Load the table for params, generating and saving it first if it does not exist."""
+    path = table_path(params, radius, directory)
+    try:
+        table = np.load(path, mmap_mode='r')
+    except (FileNotFoundError, ValueError):
+        table = build_heuristic_table(params, radius)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+        np.save(tmp_path, table)
+        os.replace(tmp_path, path)
+    return HeuristicTable(np.asarray(table), params.node_spacing)
+
+
+if __name__ == "__main__":
+    from server.services.optimizer import LATTICE_PARAMS
+
+    loaded = heuristic_table(LATTICE_PARAMS)
+    print(f"Heuristic table {table_path(LATTICE_PARAMS)}: {loaded.table.shape}, {loaded.table.nbytes / 1e6:.1f} MB")
@@ -0,0 +1,158 @@
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from server.services.progress_checker import ProcessProgress
+
+# resource access of a job: (resource name, exclusive)
+Claim = Tuple[str, bool]
+
+
+class Job:
+    """One submitted operation, with its status, progress and result."""
+
+    def __init__(self, kind: str, target: Callable[['Job'], Any], claims: List[Claim]):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.target = target
+        self.claims = claims
+        self.status = "queued"  # queued, running, succeeded or failed
+        self.result = None
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        # per-job progress, forwarded with the job id to the scheduler's shared progress
+        self.progress = ProcessProgress(job_id=self.id)
+
+    def to_dict(self, with_result: bool = True) -> Dict[str, Any]:
+        job = {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": self.progress.progress,
+            "message": self.progress.message,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+        if with_result:
+            job["result"] = self.result
+        return job
+
+
+class JobScheduler:
+    """
+    Queue of jobs run on a thread pool. Every job claims named resources,
+    shared or exclusive, like a readers-writer lock: jobs that only share a
+    resource run in parallel, an exclusive claim waits for every other job on
+    that resource. Queued jobs start in submission order per resource, so a
+    waiting exclusive job is not overtaken by later shared ones. limits caps
+    the number of running jobs of a kind. The last keep_finished finished
+    jobs are kept for status queries.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 4,
+        limits: Optional[Dict[str, int]] = None,
+        progress: Optional[ProcessProgress] = None,
+        keep_finished: int = 100
+    ):
+        self.max_workers = max_workers
+        self.limits = limits or {}
+        self.progress = progress
+        self.keep_finished = keep_finished
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        self._jobs: 'OrderedDict[str, Job]' = OrderedDict()
+        self._queue: List[Job] = []
+        self._running: List[Job] = []
+
+    def submit(self, kind: str, target: Callable[[Job], Any], claims: List[Claim]) -> Job:
+        """Queue target(job) as a job of kind; its return value becomes the job result."""
+        job = Job(kind, target, claims)
+        if self.progress is not None:
+            job.progress.add_callback(self.progress.update)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._queue.append(job)
+            self._dispatch()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self) -> List[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def running(self) -> List[Job]:
+        with self._lock:
+            return list(self._running)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _blocked(self, claims: List[Claim], held: Dict[str, bool]) -> bool:
+        """Whether claims conflict with held (resource -> exclusive)."""
+        return any(name in held and (exclusive or held[name]) for name, exclusive in claims)
+
+    def _dispatch(self):
+        """Start every queued job whose resources and limits allow it. Called with the lock held."""
+        held: Dict[str, bool] = {}
+        counts: Dict[str, int] = {}
+        for job in self._running:
+            counts[job.kind] = counts.get(job.kind, 0) + 1
+            for name, exclusive in job.claims:
+                held[name] = held.get(name, False) or exclusive
+        # resources wanted by earlier queued jobs that could not start
+        waiting: Dict[str, bool] = {}
+
+        for job in list(self._queue):
+            if len(self._running) >= self.max_workers:
+                break
+            blocked = (
+                self._blocked(job.claims, held)
+                or self._blocked(job.claims, waiting)
+                or counts.get(job.kind, 0) >= self.limits.get(job.kind, self.max_workers)
+            )
+            if blocked:
+                for name, exclusive in job.claims:
+                    waiting[name] = waiting.get(name, False) or exclusive
+                continue
+
+            self._queue.remove(job)
+            self._running.append(job)
+            counts[job.kind] = counts.get(job.kind, 0) + 1
+            for name, exclusive in job.claims:
+                held[name] = held.get(name, False) or exclusive
+            job.status = "running"
+            job.started = time.time()
+            self._executor.submit(self._run, job)
+
+    def _run(self, job: Job):
+        try:
+            job.result = job.target(job)
+            job.status = "succeeded"
+        except Exception as e:
+            traceback.print_exc()
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished = time.time()
+            with self._lock:
+                self._running.remove(job)
+                self._forget_finished()
+                self._dispatch()
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished is not None]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job_id]
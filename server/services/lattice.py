@@ -0,0 +1,487 @@
+import math
+from collections import namedtuple
+from concurrent.futures import as_completed
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from server.services.process_pool import spawn_pool, worker_state
+from server.services.progress_checker import ProcessProgress
+
+# bump when the edge costs change, so cached lattices and heuristic tables are rebuilt
+EDGE_COST_VERSION = 2
+
+# primitive names, indexed by the primitive id stored on every edge
+PRIMITIVES = ('S', 'L', 'R', 'B', 'LB', 'RB')
+REVERSE_PRIMITIVES = ('B', 'LB', 'RB')
+
+# parameters that determine the lattice built from an occupancy grid
+LatticeParams = namedtuple(
+    'LatticeParams',
+    ['node_spacing', 'n_headings', 'turning_radius', 'primitive_length', 'nb_points', 'reverse_penalty_factor',
+     'footprint_radius'],
+    defaults=[20, 1.9, 0.0]
+)
+
+# a motion primitive relative to the origin, for one start heading
+Primitive = namedtuple('Primitive', ['name', 'end_x', 'end_y', 'end_heading', 'path', 'checks', 'cost'])
+
+
+class Lattice:
+    """
+    State lattice stored as CSR arrays.
+
+    Nodes are integer ids derived from (ix, iy, heading_idx), where (ix, iy)
+    index the node grid (x = ix * node_spacing) so no per-state Python objects
+    are needed. Outgoing edges of node u are targets[indptr[u]:indptr[u+1]],
+    with matching costs and primitive ids.
+    """
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        node_spacing: float,
+        n_headings: int,
+        free: np.ndarray,
+        indptr: np.ndarray,
+        targets: np.ndarray,
+        costs: np.ndarray,
+        primitives: np.ndarray,
+        path: Optional[str] = None
+    ):
+        self.width = width
+        self.height = height
+        self.node_spacing = node_spacing
+        self.n_headings = n_headings
+        self.free = free
+        self.indptr = indptr
+        self.targets = targets
+        self.costs = costs
+        self.primitives = primitives
+        # lattice file the arrays are mapped from, if any (see lattice_io)
+        self.path = path
+        self.rows, self.cols = free.shape
+
+    @classmethod
+    def from_edges(cls, width, height, node_spacing, n_headings, free, src, dst, costs, primitives, presorted=False):
+        """
+        Build the CSR arrays from edge lists. Unless presorted (as returned by
+        sort_edges), edges are sorted and the cheapest duplicate edge is kept.
+        """
+        n_nodes = free.size * n_headings
+        if not presorted:
+            src, dst, costs, primitives = sort_edges(src, dst, costs, primitives)
+
+        indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n_nodes), out=indptr[1:])
+        return cls(width, height, node_spacing, n_headings, free,
+                   indptr, dst.astype(np.int32), costs, primitives)
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.indptr) - 1
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.targets)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.free, self.indptr, self.targets, self.costs, self.primitives))
+
+    @property
+    def headings(self) -> List[float]:
+        return lattice_headings(self.n_headings)
+
+    def node_id(self, x: float, y: float, heading_idx: int) -> int:
+        """Return the node id of a state, or -1 if it is not a free lattice node."""
+        ix = x / self.node_spacing
+        iy = y / self.node_spacing
+        if not (float(ix).is_integer() and float(iy).is_integer()):
+            return -1
+        ix, iy = int(ix), int(iy)
+        if ix < 0 or ix >= self.cols or iy < 0 or iy >= self.rows or not self.free[iy, ix]:
+            return -1
+        return (iy * self.cols + ix) * self.n_headings + heading_idx
+
+    def node_state(self, node: int) -> Tuple[float, float, int]:
+        """Return (x, y, heading_idx) of a node id."""
+        pos, heading_idx = divmod(int(node), self.n_headings)
+        iy, ix = divmod(pos, self.cols)
+        return ix * self.node_spacing, iy * self.node_spacing, heading_idx
+
+    def node_xy(self, nodes) -> Tuple[np.ndarray, np.ndarray]:
+        """Vectorized (x, y) coordinates of an array of node ids."""
+        pos = np.asarray(nodes, dtype=np.int64) // self.n_headings
+        return (pos % self.cols) * self.node_spacing, (pos // self.cols) * self.node_spacing
+
+    def reversed(self) -> 'Lattice':
+        """Lattice with every edge reversed, for searches toward a node instead of from it."""
+        src = np.repeat(np.arange(self.num_nodes, dtype=np.int64), np.diff(self.indptr))
+        return Lattice.from_edges(self.width, self.height, self.node_spacing, self.n_headings, self.free,
+                                  self.targets, src, self.costs, self.primitives)
+
+
+def sort_edges(src, dst, costs, primitives):
+    """Sort edges by (src, dst) and drop duplicate edges, keeping the cheapest one."""
+    src = np.asarray(src, dtype=np.int64)
+    dst = np.asarray(dst, dtype=np.int64)
+    costs = np.asarray(costs, dtype=np.float32)
+    primitives = np.asarray(primitives, dtype=np.uint8)
+
+    order = np.lexsort((costs, dst, src))
+    src, dst, costs, primitives = src[order], dst[order], costs[order], primitives[order]
+    if len(src):
+        keep = np.ones(len(src), dtype=bool)
+        keep[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+        src, dst, costs, primitives = src[keep], dst[keep], costs[keep], primitives[keep]
+    return src, dst, costs, primitives
+
+
+def lattice_headings(n_headings: int) -> List[float]:
+    """Heading angle of every heading index, in [-π, π)."""
+    return [
+        ((2 * math.pi * i / n_headings) + math.pi) % (2*math.pi) - math.pi
+        for i in range(n_headings)
+    ]
+
+
+def generate_primitives(headings, turning_radius, primitive_length, nb_points):
+    """
+    Motion primitive templates for every start heading, relative to the origin.
+    Returns {heading_idx: [(name, (end_x, end_y, end_theta), path), ...]}.
+    """
+    def make_backward_primitive(forward_path, forward_end, end_heading):
+        """generate backward primitive from forward primitive"""
+        # reverse the sampling, then shift so that the first point is (0,0)
+        bx = [ x - forward_end[0] for x, _ in reversed(forward_path) ]
+        by = [ y - forward_end[1] for _, y in reversed(forward_path) ]
+        return (bx[-1], by[-1], end_heading), list(zip(bx, by))
+
+    prim_templates = {}
+    for hi, th0 in enumerate(headings):
+        # straight
+        xs = np.linspace(0, primitive_length * math.cos(th0), nb_points)
+        ys = np.linspace(0, primitive_length * math.sin(th0), nb_points)
+        straight_path = list(zip(xs, ys))
+        straight_end = (xs[-1], ys[-1], th0)
+
+        # left
+        dth = primitive_length / turning_radius
+        thetas = np.linspace(0, dth, nb_points)
+        cx = -turning_radius * math.sin(th0)
+        cy = turning_radius * math.cos(th0)
+        left_path = [(cx + turning_radius * math.sin(th0 + t), cy - turning_radius * math.cos(th0 + t)) for t in thetas]
+        left_end = (left_path[-1][0], left_path[-1][1], (th0 + dth) % (2*math.pi))
+
+        # right
+        cx = turning_radius * math.sin(th0)
+        cy = -turning_radius * math.cos(th0)
+        right_path = [(cx - turning_radius * math.sin(th0 - t), cy + turning_radius * math.cos(th0 - t)) for t in thetas]
+        right_end = (right_path[-1][0], right_path[-1][1], (th0 - dth) % (2*math.pi))
+
+        # backward straight
+        b_end, b_path = make_backward_primitive(straight_path, straight_end, th0)
+
+        # backward left
+        lb_end, lb_path = make_backward_primitive(right_path, right_end, (th0 + dth) % (2*math.pi))
+
+        # backward right
+        rb_end, rb_path = make_backward_primitive(left_path, left_end, (th0 - dth) % (2*math.pi))
+
+        prim_templates[hi] = [
+            ('S', straight_end, straight_path),
+            ('L', left_end, left_path),
+            ('R', right_end, right_path),
+            ('B', b_end, b_path),
+            ('LB', lb_end, lb_path),
+            ('RB', rb_end, rb_path),
+        ]
+    return prim_templates
+
+
+def heading_index(theta: float, n_headings: int) -> int:
+    """Index of the lattice heading closest to theta."""
+    return int(round(theta / (2 * math.pi / n_headings))) % n_headings
+
+
+def compile_primitives(
+    n_headings: int,
+    turning_radius: float,
+    primitive_length: float,
+    nb_points: int = 20,
+    reverse_penalty_factor: float = 1.9
+) -> List[List[Primitive]]:
+    """
+    Precompute, for every start heading, the primitives relative to the origin:
+    collision check points, end offset, snapped end heading and cost (arc
+    length, with the reverse penalty). build_edges scales the cost to the
+    snapped end position.
+    """
+    headings = lattice_headings(n_headings)
+    templates = generate_primitives(headings, turning_radius, primitive_length, nb_points)
+
+    primitives = []
+    for hi in range(n_headings):
+        heading_prims = []
+        for name, (end_x, end_y, end_theta), path in templates[hi]:
+            path = np.asarray(path, dtype=np.float64)
+
+            # distance along path, with penalty for reverse motions
+            cost = float(np.hypot(*np.diff(path, axis=0).T).sum())
+            if name in REVERSE_PRIMITIVES:
+                cost *= reverse_penalty_factor
+
+            # every swept point is checked against the inflated occupancy grid
+            checks = path
+
+            heading_prims.append(Primitive(
+                name, end_x, end_y, heading_index(end_theta, n_headings), path, checks, cost
+            ))
+        primitives.append(heading_prims)
+    return primitives
+
+
+def build_edges(
+    occ: np.ndarray,
+    free: np.ndarray,
+    node_spacing: float,
+    primitives: List[List[Primitive]],
+    iy: np.ndarray,
+    ix: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Apply every primitive to the node positions (iy, ix) at once.
+    Returns (src, dst, costs, primitive ids) of the collision-free edges.
+
+    An edge costs its primitive's cost scaled by the ratio of the snapped
+    displacement to the primitive's own chord: what the robot covers to reach
+    the node. Snapping then never moves a state for free, a straight edge
+    costs exactly its displacement and a turning one (arc longer than its
+    chord) more, so wiggling between headings is never cheaper than driving
+    straight.
+    """
+    h, w = occ.shape
+    rows, cols = free.shape
+    n_headings = len(primitives)
+    iy = np.asarray(iy, dtype=np.int64)
+    ix = np.asarray(ix, dtype=np.int64)
+    x = ix * node_spacing
+    y = iy * node_spacing
+    pos = iy * cols + ix
+    # node positions are even integers, so rint(x + c) == x + rint(c): round each
+    # check offset once and drop the points that fall into the same cell
+    integral = float(node_spacing).is_integer() and int(node_spacing) % 2 == 0
+
+    src, dst, edge_costs, edge_prims = [], [], [], []
+    for hi, heading_prims in enumerate(primitives):
+        for prim in heading_prims:
+            # translate the check points to every position and look them up in occ
+            if integral:
+                offsets = np.unique(np.rint(prim.checks).astype(np.int64), axis=0)
+                px = x[:, None] + offsets[:, 0]
+                py = y[:, None] + offsets[:, 1]
+            else:
+                px = np.rint(x[:, None] + prim.checks[:, 0]).astype(np.int64)
+                py = np.rint(y[:, None] + prim.checks[:, 1]).astype(np.int64)
+            inside = (px >= 0) & (px < w) & (py >= 0) & (py < h)
+            blocked = ~inside | occ[np.clip(py, 0, h - 1), np.clip(px, 0, w - 1)]
+            ok = ~blocked.any(axis=1)
+
+            # snap the end point to the nearest free node position
+            end_x = x + prim.end_x
+            end_y = y + prim.end_y
+            sx = np.rint(end_x / node_spacing).astype(np.int64)
+            sy = np.rint(end_y / node_spacing).astype(np.int64)
+            ok &= (sx >= 0) & (sx < cols) & (sy >= 0) & (sy < rows)
+            ok &= free[np.clip(sy, 0, rows - 1), np.clip(sx, 0, cols - 1)]
+            ok &= np.hypot(sx * node_spacing - end_x, sy * node_spacing - end_y) <= node_spacing * 0.6
+
+            snapped = np.hypot(sx[ok] * node_spacing - x[ok], sy[ok] * node_spacing - y[ok])
+            n = int(ok.sum())
+            src.append(pos[ok] * n_headings + hi)
+            dst.append((sy[ok] * cols + sx[ok]) * n_headings + prim.end_heading)
+            edge_costs.append((prim.cost * snapped / math.hypot(prim.end_x, prim.end_y)).astype(np.float32))
+            edge_prims.append(np.full(n, PRIMITIVES.index(prim.name), dtype=np.uint8))
+
+    if not src:
+        return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64),
+                np.empty(0, dtype=np.float32), np.empty(0, dtype=np.uint8))
+    return np.concatenate(src), np.concatenate(dst), np.concatenate(edge_costs), np.concatenate(edge_prims)
+
+
+def inflate_obstacles(occ: np.ndarray, footprint_radius: float) -> np.ndarray:
+    """
+    Cells where a circular footprint of footprint_radius cells, centred there,
+    would overlap an occupied cell or leave the map, from the Euclidean
+    distance transform of the free space. Checking a swept point is then a
+    single lookup in the returned grid.
+    """
+    if footprint_radius <= 0:
+        return occ
+    # scipy is only needed to build lattices; imported here to keep server startup fast
+    from scipy.ndimage import distance_transform_edt
+
+    # a border of occupied cells keeps the footprint inside the map
+    padded = np.pad(occ, 1, constant_values=True)
+    return (distance_transform_edt(~padded) <= footprint_radius)[1:-1, 1:-1]
+
+
+def node_grid(occ: np.ndarray, node_spacing: float) -> np.ndarray:
+    """Boolean (rows, cols) mask of node positions whose map cell is free."""
+    h, w = occ.shape
+    xs = np.arange(0, w, node_spacing)
+    ys = np.arange(0, h, node_spacing)
+    xv, yv = np.meshgrid(xs, ys)
+    return ~occ[np.round(yv).astype(int), np.round(xv).astype(int)]
+
+
+def build_tile_edges(occ, free, node_spacing, primitives, row_start, row_end):
+    """Sorted edges leaving the node rows [row_start, row_end)."""
+    iy, ix = np.nonzero(free[row_start:row_end])
+    src, dst, costs, prims = sort_edges(*build_edges(occ, free, node_spacing, primitives, iy + row_start, ix))
+    # node ids fit in int32 (see Lattice.targets); halves the transfer from workers
+    return src.astype(np.int32), dst.astype(np.int32), costs, prims
+
+
+# lattices smaller than this are built in-process: spawning a worker (a fresh
+# interpreter importing numpy) takes about as long as building ~500k nodes serially
+MIN_PARALLEL_NODES = 1 << 19
+
+def _build_tile(row_start, row_end):
+    occ, free, node_spacing, primitives = worker_state()
+    return build_tile_edges(occ, free, node_spacing, primitives, row_start, row_end)
+
+
+def build_lattice_graph_from_pgm(
+    map: np.ndarray,
+    node_spacing: float,
+    n_headings: int,
+    turning_radius: float,
+    primitive_length: float,
+    progress_logger: ProcessProgress,
+    nb_points: int = 20,
+    reverse_penalty_factor: float = 1.9,
+    workers: int = 1,
+    tile_rows: int = 32,
+    footprint_radius: float = 0.0
+) -> Lattice:
+    """
+    build a state lattice graph from a PGM occupancy map.
+
+    The node grid is split into tiles of tile_rows node rows. With workers > 1
+    and at least MIN_PARALLEL_NODES nodes the tiles are built in a process
+    pool; progress is reported per tile.
+    Obstacles are inflated by footprint_radius cells (see inflate_obstacles).
+    """
+    occ = inflate_obstacles(map > 0, footprint_radius)
+    h, w = occ.shape
+    free = node_grid(occ, node_spacing)
+    rows = free.shape[0]
+
+    primitives = compile_primitives(n_headings, turning_radius, primitive_length, nb_points, reverse_penalty_factor)
+
+    tiles = [(r, min(r + tile_rows, rows)) for r in range(0, rows, tile_rows)]
+    results = [None] * len(tiles)
+    last_reported = None
+
+    def report(done):
+        nonlocal last_reported
+        percent = 5 + 90 * done // len(tiles)
+        if percent != last_reported:
+            last_reported = percent
+            progress_logger.update("precomputation", percent, f"Applied primitives to {done}/{len(tiles)} tiles")
+
+    if workers > 1 and len(tiles) > 1 and free.size * n_headings >= MIN_PARALLEL_NODES:
+        with spawn_pool(min(workers, len(tiles)), args=(occ, free, node_spacing, primitives)) as pool:
+            futures = {pool.submit(_build_tile, *tile): i for i, tile in enumerate(tiles)}
+            for done, future in enumerate(as_completed(futures), 1):
+                results[futures[future]] = future.result()
+                report(done)
+    else:
+        for i, (row_start, row_end) in enumerate(tiles):
+            results[i] = build_tile_edges(occ, free, node_spacing, primitives, row_start, row_end)
+            report(i + 1)
+
+    # tiles cover increasing, disjoint node id ranges, so concatenation stays sorted
+    src, dst, costs, prims = (np.concatenate(parts) for parts in zip(*results))
+    return Lattice.from_edges(w, h, node_spacing, n_headings, free, src, dst, costs, prims, presorted=True)
+
+
+def primitive_reach(primitives: List[List[Primitive]], node_spacing: float) -> float:
+    """Largest distance from a source node at which a primitive can read occ or free."""
+    reach = 0.0
+    for heading_prims in primitives:
+        for prim in heading_prims:
+            reach = max(reach, float(np.hypot(*prim.checks.T).max()),
+                        math.hypot(prim.end_x, prim.end_y) + node_spacing * 0.6)
+    # rounding of check points and node cells
+    return reach + node_spacing
+
+
+def update_lattice(
+    lattice: Lattice,
+    old_map: np.ndarray,
+    new_map: np.ndarray,
+    params: LatticeParams
+) -> Tuple[Lattice, int]:
+    """
+    Update a lattice for a changed occupancy map, rebuilding only the edges of
+    nodes within primitive reach of a changed cell. Every other edge neither
+    sweeps over a changed cell nor ends at a node whose free state changed.
+    Returns the new lattice and the number of rebuilt node positions.
+    """
+    if old_map.shape != new_map.shape:
+        raise ValueError(f"Map shape changed from {old_map.shape} to {new_map.shape}")
+
+    occ = inflate_obstacles(new_map > 0, params.footprint_radius)
+    # compared after inflation: a changed cell also changes the cells around it
+    changed = inflate_obstacles(old_map > 0, params.footprint_radius) != occ
+    if not changed.any():
+        return lattice, 0
+
+    spacing = lattice.node_spacing
+    n_headings = lattice.n_headings
+    primitives = compile_primitives(n_headings, params.turning_radius, params.primitive_length,
+                                    params.nb_points, params.reverse_penalty_factor)
+    free = node_grid(occ, spacing)
+    rows, cols = free.shape
+
+    # node positions whose edges may touch a changed cell: a box of primitive reach around it
+    radius = int(math.ceil(primitive_reach(primitives, spacing) / spacing))
+    cy, cx = np.nonzero(changed)
+    near = np.zeros((rows, cols), dtype=bool)
+    near[np.clip(np.rint(cy / spacing).astype(int), 0, rows - 1),
+         np.clip(np.rint(cx / spacing).astype(int), 0, cols - 1)] = True
+    from scipy.ndimage import binary_dilation
+    affected = binary_dilation(near, structure=np.ones((2 * radius + 1, 2 * radius + 1), dtype=bool))
+
+    iy, ix = np.nonzero(affected & free)
+    new_src, new_dst, new_costs, new_prims = sort_edges(*build_edges(occ, free, spacing, primitives, iy, ix))
+
+    # per-node edge counts: affected nodes take their rebuilt edges, others keep theirs
+    affected_nodes = np.repeat(affected.ravel(), n_headings)
+    counts = np.diff(lattice.indptr)
+    counts[affected_nodes] = 0
+    counts += np.bincount(new_src, minlength=lattice.num_nodes)
+    indptr = np.zeros(lattice.num_nodes + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+
+    # splice the edge arrays run by run of (un)affected node ids
+    flips = np.flatnonzero(affected_nodes[1:] != affected_nodes[:-1]) + 1
+    bounds = np.concatenate(([0], flips, [lattice.num_nodes]))
+    new_starts = np.searchsorted(new_src, bounds)
+    parts = []
+    for run, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+        if affected_nodes[start]:
+            edges = slice(new_starts[run], new_starts[run + 1])
+            parts.append((new_dst[edges], new_costs[edges], new_prims[edges]))
+        else:
+            edges = slice(lattice.indptr[start], lattice.indptr[end])
+            parts.append((lattice.targets[edges], lattice.costs[edges], lattice.primitives[edges]))
+    targets, costs, prims = (np.concatenate(arrays) for arrays in zip(*parts))
+
+    updated = Lattice(lattice.width, lattice.height, spacing, n_headings, free,
+                      indptr, targets.astype(np.int32), costs.astype(np.float32), prims.astype(np.uint8))
+    return updated, len(iy)
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Optional, Tuple
+
+import numpy as np
+
+from server.models.waypoints_request import MapMetaData
+from server.services.lattice import EDGE_COST_VERSION, Lattice, LatticeParams
+from server.services.lattice_io import load_lattice, save_lattice
+
+# bump when the stored lattice layout changes, so stale entries are never matched
+CACHE_VERSION = 2
+SUFFIX = ".lattice"
+
+
+class LatticeCache:
+    """
+    On-disk lattice cache keyed by a hash of the occupancy grid, the map
+    metadata and the lattice parameters.
+
+    Entries are binary lattice files (see lattice_io) opened with np.memmap,
+    so a hit costs no deserialization. Entries are evicted least-recently-used
+    first (by file mtime, refreshed on every hit) once the directory grows past
+    max_bytes.
+    """
+
+    def __init__(self, directory: str = "lattice_cache", max_bytes: int = 4 * 1024**3):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(grid: np.ndarray, info: MapMetaData, params: LatticeParams) -> str:
+        digest = hashlib.sha256()
+        digest.update(f"v{CACHE_VERSION}.{EDGE_COST_VERSION}".encode())
+        digest.update(json.dumps(info.model_dump(), sort_keys=True).encode())
+        digest.update(json.dumps(params._asdict(), sort_keys=True).encode())
+        digest.update(str(grid.shape).encode())
+        digest.update(np.ascontiguousarray(grid, dtype=np.uint8).tobytes())
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}{SUFFIX}")
+
+    def get(self, key: str) -> Optional[Tuple[np.ndarray, Lattice]]:
+        """Return (grid, lattice) for key, or None on a miss."""
+        path = self._path(key)
+        try:
+            grid, lattice, _ = load_lattice(path)
+            os.utime(path)  # mark as most recently used
+        except (FileNotFoundError, ValueError):
+            return None
+        return grid, lattice
+
+    def put(self, key: str, grid: np.ndarray, lattice: Lattice, info: MapMetaData) -> Tuple[np.ndarray, Lattice]:
+        """Store an entry; returns it mapped from the cache file, so callers can drop the in-memory copy."""
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        save_lattice(tmp_path, grid, lattice, meta={"info": info.model_dump()})
+        os.replace(tmp_path, path)
+        self.evict(keep=key)
+        grid, lattice, _ = load_lattice(path)
+        return grid, lattice
+
+    def latest(self) -> Optional[Tuple[np.ndarray, Lattice]]:
+        """Most recently used entry, used to restore the lattice at startup."""
+        entries = self._entries()
+        for key, _, _ in sorted(entries, key=lambda e: e[1], reverse=True):
+            cached = self.get(key)
+            if cached is not None:
+                return cached
+        return None
+
+    def evict(self, keep: Optional[str] = None):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda e: e[1])
+            total = sum(size for _, _, size in entries)
+            for key, _, size in entries:
+                if total <= self.max_bytes:
+                    break
+                if key == keep:
+                    continue
+                try:
+                    os.remove(self._path(key))
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def _entries(self):
+        """(key, mtime, size) of every cache entry."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(SUFFIX):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((name[:-len(SUFFIX)], stat.st_mtime, stat.st_size))
+        return entries
@@ -0,0 +1,122 @@
+"""
+Binary lattice file format.
+
+    magic    8 bytes   b"LATTICE\\0"
+    version  uint32    FORMAT_VERSION
+    length   uint32    byte length of the JSON header
+    header   JSON      lattice scalars, caller metadata and {name: [dtype, shape, offset]}
+    arrays   raw       grid, free, indptr, targets, costs, primitives, each ALIGN-aligned
+
+Arrays are stored little-endian in C order so load_lattice can map them with
+np.memmap: opening a file costs no deserialization and every process mapping
+the same file shares one copy through the page cache.
+"""
+import json
+import struct
+from typing import Optional, Tuple
+
+import numpy as np
+
+from server.services.lattice import Lattice
+
+MAGIC = b"LATTICE\0"
+FORMAT_VERSION = 1
+ALIGN = 64
+
+_PREAMBLE = struct.Struct("<8sII")
+_ARRAYS = ('grid', 'free', 'indptr', 'targets', 'costs', 'primitives')
+
+
+def _aligned(offset: int) -> int:
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def save_lattice(path: str, grid: np.ndarray, lattice: Lattice, meta: Optional[dict] = None):
+    """Write grid and lattice to path in the binary lattice format."""
+    arrays = {
+        'grid': np.ascontiguousarray(grid, dtype=np.uint8),
+        'free': np.ascontiguousarray(lattice.free, dtype=np.bool_),
+        'indptr': np.ascontiguousarray(lattice.indptr, dtype='<i8'),
+        'targets': np.ascontiguousarray(lattice.targets, dtype='<i4'),
+        'costs': np.ascontiguousarray(lattice.costs, dtype='<f4'),
+        'primitives': np.ascontiguousarray(lattice.primitives, dtype=np.uint8),
+    }
+
+    def build_layout(data_start):
+        layout, offset = {}, data_start
+        for name in _ARRAYS:
+            offset = _aligned(offset)
+            layout[name] = [arrays[name].dtype.str, list(arrays[name].shape), offset]
+            offset += arrays[name].nbytes
+        return layout
+
+    def build_header(layout):
+        return json.dumps({
+            'width': lattice.width,
+            'height': lattice.height,
+            'node_spacing': lattice.node_spacing,
+            'n_headings': lattice.n_headings,
+            'meta': meta or {},
+            'arrays': layout,
+        }).encode()
+
+    # the header size depends on the offsets it records; settle it with a padded estimate
+    data_start = _aligned(_PREAMBLE.size + len(build_header(build_layout(0))) + 256)
+    layout = build_layout(data_start)
+    header = build_header(layout)
+    assert _PREAMBLE.size + len(header) <= data_start
+
+    with open(path, 'wb') as f:
+        f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header)))
+        f.write(header)
+        for name in _ARRAYS:
+            f.seek(layout[name][2])
+            arrays[name].tofile(f)
+
+
+def read_header(path: str) -> dict:
+    """Read and validate the JSON header of a lattice file."""
+    with open(path, 'rb') as f:
+        preamble = f.read(_PREAMBLE.size)
+        if len(preamble) != _PREAMBLE.size:
+            raise ValueError(f"{path} is not a lattice file")
+        magic, version, length = _PREAMBLE.unpack(preamble)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a lattice file")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"{path} has lattice format version {version}, expected {FORMAT_VERSION}")
+        return json.loads(f.read(length))
+
+
+def load_lattice(path: str, mmap: bool = True) -> Tuple[np.ndarray, Lattice, dict]:
+    """
+    Open a lattice file. Returns (grid, lattice, meta). With mmap the arrays are
+    read-only np.memmap views of the file; otherwise they are loaded into memory.
+    """
+    header = read_header(path)
+    arrays = {}
+    for name, (dtype, shape, offset) in header['arrays'].items():
+        if mmap:
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.empty(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=tuple(shape))
+        else:
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                arrays[name] = np.fromfile(f, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+    lattice = Lattice(
+        header['width'],
+        header['height'],
+        header['node_spacing'],
+        header['n_headings'],
+        arrays['free'],
+        arrays['indptr'],
+        arrays['targets'],
+        arrays['costs'],
+        arrays['primitives'],
+        path=path if mmap else None
+    )
+    return arrays['grid'], lattice, header['meta']
+
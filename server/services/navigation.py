@@ -0,0 +1,231 @@
+"""
+Navigation backends: where the navigation jobs send their goals.
+
+- "nav2" drives the robot through Nav2's BasicNavigator. The ROS packages
+  are imported, and the ROS thread started, only when the backend starts.
+- "sim" moves a simulated robot in process, so the API and the client can
+  be used without ROS.
+- "none" rejects navigation (a planner-only server).
+
+Navigation jobs hold the navigator claim of the JobScheduler, so a backend
+runs one navigation at a time.
+"""
+import math
+import threading
+import time
+from typing import List, Optional
+
+from server.models.waypoints_request import WaypointModel
+from server.services.progress_checker import ProcessProgress
+from server.utils.utils import quaternion_from_euler
+
+
+class NavigationBackend:
+    """Backend without a robot: every navigation fails."""
+    name = "none"
+
+    def __init__(self):
+        self.error: Optional[str] = None
+        self.ready_after: Optional[float] = None  # seconds from start() until ready
+
+    @property
+    def ready(self) -> bool:
+        return False
+
+    def start(self):
+        pass
+
+    def follow_waypoints(self, poses: List[WaypointModel], frame_id: str, progress: ProcessProgress) -> str:
+        """Navigate through poses one goal after the other; returns the TaskResult name"""
+        raise Exception(f"Navigation is disabled ({self.name} backend)")
+
+    def follow_path(self, poses: List[WaypointModel], frame_id: str, progress: ProcessProgress) -> str:
+        """Track poses as one precomputed path; returns the TaskResult name"""
+        raise Exception(f"Navigation is disabled ({self.name} backend)")
+
+    def status(self) -> dict:
+        return {"backend": self.name, "ready": self.ready, "ready_after": self.ready_after, "error": self.error}
+
+    def shutdown(self):
+        pass
+
+
+class Nav2Backend(NavigationBackend):
+    """Nav2 through BasicNavigator, spun on a ROS thread started by start()."""
+    name = "nav2"
+
+    def __init__(self):
+        super().__init__()
+        self.navigator = None
+        self._initialized = False
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._initialized and self.navigator is not None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        started = time.perf_counter()
+        try:
+            import rclpy
+            from nav2_simple_commander.robot_navigator import BasicNavigator
+        except ImportError as e:
+            self.error = f"ROS2 is not available: {e}"
+            print(f"Navigation disabled, {self.error}")
+            return
+
+        rclpy.init()
+        self.navigator = BasicNavigator()
+
+        # Wait for Nav2 to be ready
+        self.navigator.waitUntilNav2Active()
+
+        self._initialized = True
+        self.ready_after = time.perf_counter() - started
+        print(f"Nav2 active after {self.ready_after:.1f} s")
+
+        # Keep ROS2 running
+        while self._initialized:
+            rclpy.spin_once(self.navigator, timeout_sec=0.1)
+            time.sleep(0.01)
+
+        # Clean up when done
+        self.navigator.destroy_node()
+        rclpy.shutdown()
+
+    def _pose_stamped(self, wp: WaypointModel, frame_id: str):
+        from geometry_msgs.msg import PoseStamped
+
+        pose = PoseStamped()
+        pose.header.frame_id = frame_id
+        pose.header.stamp = self.navigator.get_clock().now().to_msg()
+
+        # Set position
+        pose.pose.position.x = wp.x
+        pose.pose.position.y = wp.y
+        pose.pose.position.z = wp.z
+
+        # Set orientation from yaw
+        q = quaternion_from_euler(0, 0, wp.yaw)
+        pose.pose.orientation.x = q[0]
+        pose.pose.orientation.y = q[1]
+        pose.pose.orientation.z = q[2]
+        pose.pose.orientation.w = q[3]
+        return pose
+
+    def _check_ready(self):
+        if not self.ready:
+            raise Exception(self.error or "ROS2 navigation system not initialized")
+
+    def follow_waypoints(self, poses: List[WaypointModel], frame_id: str, progress: ProcessProgress) -> str:
+        self._check_ready()
+        # Convert waypoints to PoseStamped messages
+        pose_goals = [self._pose_stamped(wp, frame_id) for wp in poses]
+
+        self.navigator.followWaypoints(pose_goals)
+
+        progress.update("navigation", 10,
+            f"Successfully sent {len(pose_goals)} waypoints to navigator")
+
+        return self._wait(progress)
+
+    def follow_path(self, poses: List[WaypointModel], frame_id: str, progress: ProcessProgress) -> str:
+        from nav_msgs.msg import Path
+
+        self._check_ready()
+        path = Path()
+        path.header.frame_id = frame_id
+        path.header.stamp = self.navigator.get_clock().now().to_msg()
+        path.poses = [self._pose_stamped(wp, frame_id) for wp in poses]
+
+        # the controller tracks the poses directly, Nav2's planner server does not plan each leg again
+        self.navigator.followPath(path)
+
+        progress.update("navigation", 10, f"Successfully sent a path of {len(path.poses)} poses to navigator")
+
+        return self._wait(progress)
+
+    def _wait(self, progress: ProcessProgress) -> Optional[str]:
+        """Block until the navigator's task ends and report its result"""
+        from nav2_simple_commander.robot_navigator import TaskResult
+
+        while not self.navigator.isTaskComplete():
+            feedback = self.navigator.getFeedback()
+
+        result = self.navigator.getResult()
+
+        if result == TaskResult.SUCCEEDED:
+            progress.update("navigation", 100, f"Navigation succeeded")
+        elif result == TaskResult.CANCELED:
+            progress.update("navigation", 100, f"Navigation cancelled")
+        elif result == TaskResult.FAILED:
+            progress.update("navigation", 100, f"Navigation failed")
+
+        return result.name if result is not None else None
+
+    def shutdown(self):
+        self._initialized = False
+        if self._thread:
+            self._thread.join(timeout=1.0)
+
+
+class SimulatorBackend(NavigationBackend):
+    """
+    In-process stand-in for Nav2: a robot that drives straight from pose to
+    pose at speed m/s, taking time_scale seconds of real time per simulated
+    second (0 finishes at once). Its pose is kept between navigations.
+    """
+    name = "sim"
+
+    def __init__(self, speed: float = 0.5, time_scale: float = 1.0):
+        super().__init__()
+        self.speed = speed
+        self.time_scale = time_scale
+        self.pose: Optional[WaypointModel] = None
+        self._running = False
+
+    @property
+    def ready(self) -> bool:
+        return self._running
+
+    def start(self):
+        self._running = True
+        self.ready_after = 0.0
+
+    def _drive(self, poses: List[WaypointModel], progress: ProcessProgress) -> str:
+        if not self._running:
+            raise Exception("Simulator stopped")
+        for i, wp in enumerate(poses):
+            if self.pose is not None and self.time_scale > 0:
+                distance = math.hypot(wp.x - self.pose.x, wp.y - self.pose.y)
+                time.sleep(distance / self.speed * self.time_scale)
+            self.pose = wp
+            progress.update("navigation", 10 + int(89 * (i + 1) / len(poses)),
+                            f"Simulated robot at ({wp.x:.2f}, {wp.y:.2f})")
+        progress.update("navigation", 100, f"Navigation succeeded")
+        return "SUCCEEDED"
+
+    def follow_waypoints(self, poses: List[WaypointModel], frame_id: str, progress: ProcessProgress) -> str:
+        progress.update("navigation", 10, f"Successfully sent {len(poses)} waypoints to simulator")
+        return self._drive(poses, progress)
+
+    def follow_path(self, poses: List[WaypointModel], frame_id: str, progress: ProcessProgress) -> str:
+        progress.update("navigation", 10, f"Successfully sent a path of {len(poses)} poses to simulator")
+        return self._drive(poses, progress)
+
+    def shutdown(self):
+        self._running = False
+
+
+NAVIGATION_BACKENDS = {"nav2": Nav2Backend, "sim": SimulatorBackend, "none": NavigationBackend}
+
+
+def create_backend(name: str) -> NavigationBackend:
+    """Navigation backend by name ("nav2", "sim" or "none")"""
+    if name not in NAVIGATION_BACKENDS:
+        raise ValueError(f"Unknown navigation backend {name!r}, expected one of {', '.join(NAVIGATION_BACKENDS)}")
+    return NAVIGATION_BACKENDS[name]()
@@ -1,21 +1,50 @@
-from networkx import DiGraph
-from server.models.precompute_request import PrecomputeRequest
 from server.services.progress_checker import ProcessProgress
-from ..models.waypoints_request import WaypointsRequest
+from server.services.lattice import (
+    Lattice, LatticeParams, build_lattice_graph_from_pgm, inflate_obstacles, lattice_headings, update_lattice
+)
+from server.services.lattice_cache import LatticeCache
+from server.services.distance_cache import DistanceCache
+from server.services.gtsp import optimize_headings, prune_dominated_states, waypoint_clusters
+from server.services.process_pool import spawn_manager, spawn_pool
+from server.services.search import LatticeSearch, row_search_pool
+from server.services.trajectory import smooth_trajectory, trajectory_poses
+from ..models.waypoints_request import MapMetaData, SolverOptions, WaypointsRequest
 import numpy as np
+import itertools
 import math
-from ortools.constraint_solver import routing_enums_pb2
-from ortools.constraint_solver import pywrapcp
-import matplotlib.pyplot as plt
-from scipy.spatial import KDTree
-import networkx as nx
-import pickle
-from collections import defaultdict, namedtuple
-from functools import lru_cache
-from typing import Dict, List, Optional, Tuple
+import os
+import queue
+import threading
+import time
+import zlib
+from collections import namedtuple
+from typing import Callable, Dict, List, Optional, Tuple
 
 State = namedtuple('State', ['x', 'y', 'theta'])
 
+# run-length record of the "rle" map encoding
+RLE_RECORD = np.dtype([('count', '<u4'), ('value', 'u1')])
+
+# lattice used for every map: 2-cell node grid, 16 headings, 12-cell turning radius,
+# 2-cell footprint radius (about 10 cm at the usual 0.05 m/cell)
+LATTICE_PARAMS = LatticeParams(node_spacing=2, n_headings=16, turning_radius=12, primitive_length=4, footprint_radius=2)
+
+# cost of skipping a waypoint in solve_routes, and of a leg without a lattice path: above
+# the penalty, so the solver leaves an unreachable waypoint out rather than route to it
+SKIP_PENALTY = int(1e9)
+UNREACHABLE_COST = int(1e12)
+
+
+class UnreachableWaypoints(Exception):
+    """
+    Waypoints that no route can visit: off the lattice (inside the inflated
+    footprint of an obstacle) or cut off from the start by obstacles.
+    """
+
+    def __init__(self, waypoints: List[int], reason: str = "cannot be reached from the start"):
+        self.waypoints = list(waypoints)
+        super().__init__(f"Waypoints {self.waypoints} {reason}")
+
 def load_map(map, width, height):
     arr = np.array(map, dtype=np.uint8).reshape((height, width))
     arr = np.flipud(arr)
@@ -24,6 +53,41 @@ def load_map(map, width, height):
 
     return arr
 
+def load_map_buffer(buffer: bytes, width: int, height: int, encoding: str = "raw"):
+    """
+    Decode an occupancy grid sent as a byte buffer, one uint8 per cell in row order.
+    encoding is "raw", "zlib" (zlib stream of the raw bytes) or "rle"
+    (records of little-endian uint32 run length followed by the uint8 value).
+    Raises ValueError if the buffer does not decode to exactly width x height cells.
+    """
+    size = width * height
+    if encoding == "raw":
+        data = np.frombuffer(buffer, dtype=np.uint8)
+    elif encoding == "zlib":
+        # bound the output so a malformed stream cannot inflate past the map size
+        decompressor = zlib.decompressobj()
+        try:
+            data = np.frombuffer(decompressor.decompress(buffer, size + 1), dtype=np.uint8)
+        except zlib.error as e:
+            raise ValueError(f"Invalid zlib map payload: {e}")
+        if data.size > size:
+            raise ValueError(f"Map payload has more than {width}x{height} cells")
+        if not decompressor.eof or decompressor.unused_data:
+            raise ValueError("Map payload is not a single complete zlib stream")
+    elif encoding == "rle":
+        if len(buffer) % RLE_RECORD.itemsize:
+            raise ValueError(f"RLE payload of {len(buffer)} bytes is not a whole number of records")
+        runs = np.frombuffer(buffer, dtype=RLE_RECORD)
+        if runs['count'].sum(dtype=np.int64) != size:
+            raise ValueError(f"RLE runs cover {runs['count'].sum(dtype=np.int64)} cells, expected {size}")
+        data = np.repeat(runs['value'], runs['count'])
+    else:
+        raise ValueError(f"Unknown map encoding: {encoding}")
+
+    if data.size != size:
+        raise ValueError(f"Map payload has {data.size} cells, expected {width}x{height}")
+    return np.flipud(data.reshape((height, width)))
+
 def normalize_angle_to_minus_pi_pi(angle):
     """Convert angle from [0, 2π] to [-π, π]"""
     # normalize to [0, 2π]
@@ -67,373 +131,320 @@ def create_response(
         "path_points": path_points
     }
 
-def find_best_snap(
-    end_x: float,
-    end_y: float,
-    end_theta: float,
-    node_kdtree: KDTree,
-    xy_coords: np.ndarray,
-    position_to_nodes: Dict[Tuple[float,float], List[State]],
-    node_spacing: float,
-    turning_radius: float,
-    k: int = 10
-) -> Optional[State]:
-    """
-    Snap to the nearest even-positioned node with minimal combined (positional+heading) cost.
-    Only considers nodes at even coordinate positions (x, y).
-    """
-    # 1) Round to nearest even position
-    snapped_x = round(end_x / 2) * 2
-    snapped_y = round(end_y / 2) * 2
-    
-    # 2) Check if this position exists in our graph
-    if (snapped_x, snapped_y) not in position_to_nodes:
-        # If not available, we could check other nearby even positions
-        # But for simplicity, let's return None if exact snap point doesn't exist
-        return None
-    
-    # 3) Find best heading at this position
-    best, bestd = None, float('inf')
-    for candidate in position_to_nodes[(snapped_x, snapped_y)]:
-        # Calculate positional distance
-        dist = math.hypot(candidate.x - end_x, candidate.y - end_y)
-        
-        # Calculate angular distance (shortest path)
-        dth = abs(candidate.theta - end_theta)
-        dth = min(dth, 2*math.pi - dth)
-        
-        # Combined cost
-        cost = dist + turning_radius * dth
-        if cost < bestd:
-            best, bestd = candidate, cost
-    
-    return best
-
-def build_lattice_graph_from_pgm(
-    map: str,
-    node_spacing: float,
-    n_headings: int,
-    turning_radius: float,
-    primitive_length: float,
-    progress_logger: ProcessProgress,
-    nb_points: int = 20,
-    reverse_penalty_factor: float = 1.9
-) -> nx.DiGraph:
-    """
-    build a state lattice graph from a PGM occupancy map.
-    """
-    occ = (map > 0)
-    h, w = occ.shape
-    headings = [
-        ((2 * math.pi * i / n_headings) + math.pi) % (2*math.pi) - math.pi
-        for i in range(n_headings)
-    ]
-
-    @lru_cache(maxsize=1024)
-    def is_collision(x, y):
-        ix = int(round(x))
-        iy = int(round(y))
-        return ix < 0 or ix >= w or iy < 0 or iy >= h or occ[iy, ix]
-
-    def collision(path):
-        step = max(1, len(path) // 5)  # Check  5 points along path
-        for i in range(0, len(path), step):
-            x, y = path[i]
-            if is_collision(x, y):
-                return True
-        # Always check endpoint
-        x, y = path[-1]
-        return is_collision(x, y)
-
-    def make_backward_primitive(forward_path, forward_end, end_heading):
-        """generate backward primitive from forward primitive"""
-        # reverse the sampling, then shift so that the first point is (0,0)
-        bx = [ x - forward_end[0] for x, _ in reversed(forward_path) ]
-        by = [ y - forward_end[1] for _, y in reversed(forward_path) ]
-        return State(bx[-1], by[-1], end_heading), list(zip(bx, by))
-
-    def generate_primitives():
-        prim_templates = {}
-        for th0 in headings:
-            # straight
-            xs = np.linspace(0, primitive_length * math.cos(th0), nb_points)
-            ys = np.linspace(0, primitive_length * math.sin(th0), nb_points)
-            straight_path = list(zip(xs, ys))
-            straight_end = State(xs[-1], ys[-1], th0)
-            
-            # left
-            dth = primitive_length / turning_radius
-            thetas = np.linspace(0, dth, nb_points)
-            cx = -turning_radius * math.sin(th0)
-            cy = turning_radius * math.cos(th0)
-            left_path = [(cx + turning_radius * math.sin(th0 + t), cy - turning_radius * math.cos(th0 + t)) for t in thetas]
-            left_end = State(left_path[-1][0], left_path[-1][1], (th0 + dth) % (2*math.pi))
-            
-            # right
-            thetas = np.linspace(0, dth, nb_points)
-            cx = turning_radius * math.sin(th0)
-            cy = -turning_radius * math.cos(th0)
-            right_path = [(cx - turning_radius * math.sin(th0 - t), cy + turning_radius * math.cos(th0 - t)) for t in thetas]
-            right_end = State(right_path[-1][0], right_path[-1][1], (th0 - dth) % (2*math.pi))
-
-             # backward straight
-            b_end,  b_path  = make_backward_primitive(straight_path,
-                                            (straight_end.x, straight_end.y),
-                                            th0)
-
-            # backward left
-            lb_end, lb_path = make_backward_primitive(
-                right_path,
-                (right_end.x, right_end.y),
-                (th0 + dth) % (2*math.pi)
-            )
-
-            # backward right
-            rb_end, rb_path = make_backward_primitive(
-                left_path,
-                (left_end.x, left_end.y),
-                (th0 - dth) % (2*math.pi)
-            )
-            
-            prim_templates[th0] = {
-                'S': (straight_end, straight_path),
-                'L': (left_end, left_path),
-                'R': (right_end, right_path),
-                'B' : (b_end,  b_path),
-                'LB': (lb_end, lb_path),
-                'RB': (rb_end, rb_path),
-            }
-        return prim_templates
-    
-    def get_valid_positions():
-        """generate valid (x, y) positions"""
-        xs = np.arange(0, w, node_spacing)
-        ys = np.arange(0, h, node_spacing)
-
-        xv, yv = np.meshgrid(xs, ys)
-        xv = xv.flatten()
-        yv = yv.flatten()
-
-        ixs = np.round(xv).astype(int)
-        iys = np.round(yv).astype(int)
-
-        mask = (
-            (0 <= ixs) & (ixs < w) &
-            (0 <= iys) & (iys < h) &
-            (~occ[iys, ixs])
-        )
-        return list(zip(xv[mask], yv[mask]))
-
-    valid_positions = get_valid_positions()
-
-    # create nodes for valid positions
-    all_nodes = [State(x, y, th) for x, y in valid_positions for th in headings]
-
-    # add nodes in graph
-    G = nx.DiGraph()
-    G.add_nodes_from(all_nodes)
-
-    xy_coords = np.array([(node.x, node.y) for node in all_nodes])
-    node_kdtree = KDTree(xy_coords)
-
-    position_to_nodes = defaultdict(list)
-    for node in all_nodes:
-        position_to_nodes[(node.x, node.y)].append(node)
-
-    progress_logger.update("precomputation", 50, f"Applying primitives...")
-
-    prim_templates = generate_primitives()
-    
-    # apply primitives to create edges
-    # process in batches to improve locality
-    batch_size = 100
-    for i in range(0, len(all_nodes), batch_size):
-        batch_nodes = all_nodes[i:i+batch_size]
-        
-        for s in batch_nodes:
-            th0 = s.theta
-            templates = prim_templates[th0]
-            
-            for name, (template_end, template_path) in templates.items():
-                # apply primitive
-                actual_path = [(s.x + x, s.y + y) for x, y in template_path]
-                end_x = s.x + template_end.x
-                end_y = s.y + template_end.y
-                end_theta = template_end.theta
-                
-                # skip collision
-                if collision(actual_path):
-                    continue
-                
-                # search nearest node for snapping
-                best = find_best_snap(
-                    end_x, end_y, end_theta,
-                    node_kdtree, xy_coords, position_to_nodes,
-                    node_spacing, turning_radius, k=10
-                )
-                
-                # add edge if found valid snap target
-                if best is not None and math.hypot(best.x - end_x, best.y - end_y) <= node_spacing * 0.6:
-                    # calculate edge cost (distance along path)
-                    cost = sum(math.hypot(actual_path[i+1][0]-actual_path[i][0], 
-                                         actual_path[i+1][1]-actual_path[i][1])
-                              for i in range(len(actual_path)-1))
-                    
-                    # apply penalty for reverse motions
-                    if name in ['B', 'LB', 'RB']:  # reverse primitives
-                        cost *= reverse_penalty_factor
-
-                    G.add_edge(s, best, primitive=name, cost=cost)
-    return G
-
 def build_state_list(waypoints, headings, start_heading_idx = None):
     """
     Generate ordered list of all (waypoint_index, heading_index).
     If start_heading_idx is provided, only include that specific heading for the first waypoint.
+    A list of heading indices fixes the headings of that many first waypoints (the robots' starts).
     """
     state_list = []
     
-    if start_heading_idx is not None:
-        state_list.append((0, start_heading_idx))
-    else:
+    if start_heading_idx is None:
         for hi in range(len(headings)):
             state_list.append((0, hi))
+        n_starts = 1
+    else:
+        start_heading_idxs = [start_heading_idx] if np.ndim(start_heading_idx) == 0 else list(start_heading_idx)
+        for i, hi in enumerate(start_heading_idxs):
+            state_list.append((i, hi))
+        n_starts = len(start_heading_idxs)
     
-    for i in range(1, len(waypoints)):
+    for i in range(n_starts, len(waypoints)):
         for hi in range(len(headings)):
             state_list.append((i, hi))
     
     return state_list
 
-def compute_cost_matrix(G, waypoints, headings, start_heading_idx = None, scale=1000, unreachable_cost=1e9):
+def compute_cost_matrix(
+    lattice: Lattice,
+    waypoints,
+    headings,
+    start_heading_idx = None,
+    scale=1000,
+    unreachable_cost=UNREACHABLE_COST,
+    search: Optional[LatticeSearch] = None,
+    progress: Optional[ProcessProgress] = None,
+    workers: int = 1,
+    distance_cache: Optional[DistanceCache] = None
+):
     """
     Compute an MxM cost matrix of Reeds-Shepp (or Dubins) distances between all state pairs.
-    Uses single-source Dijkstra per origin state for efficiency.
+    Runs one early-terminating lattice search per origin state, stopping once
+    every waypoint state is settled, and fills a NumPy int64 matrix.
+    With workers > 1 and a file-backed lattice, rows are searched in a process pool.
+    Also returns the PathTree of every origin state, so tour legs can be
+    backtracked without searching again. With a distance_cache, only the state
+    pairs missing from it are searched and the trees are its CachedRows.
     """
     VERY_LARGE = int(1e9)
-    N = len(waypoints)
-    H = len(headings)
     state_list = build_state_list(waypoints, headings, start_heading_idx)
     M = len(state_list)
     index_map = {state_list[k]: k for k in range(M)}
 
-    # Initialize matrix with unreachable costs
-    cost_matrix = [[int(unreachable_cost)] * M for _ in range(M)]
-
-    # For each origin state, run single-source Dijkstra
-    for idx, (i, hi) in enumerate(state_list):
-        # origin State
-        x0, y0 = waypoints[i]
-        th0 = headings[hi]
-        s0 = State(x0, y0, th0)
-        # Compute lengths to all reachable nodes
-        lengths = nx.single_source_dijkstra_path_length(G, s0, weight='cost')
-        # Fill row idx
-        for jdx, (j, hj) in enumerate(state_list):
-            x1, y1 = waypoints[j]
-            th1 = headings[hj]
-            s1 = State(x1, y1, th1)
-            d = lengths.get(s1, math.inf)
-            cost_matrix[idx][jdx] = int(d * scale) if d < math.inf else int(unreachable_cost)
-            if i == j:
-                cost_matrix[idx][jdx] = VERY_LARGE
-
-    return cost_matrix, index_map
-
-def run_or_tools(cost_matrix, index_map, N, H, depot_index):
-    """Set up and solve the TSP on the provided cost_matrix with OR-Tools, enforcing one state per waypoint."""
-    modified_cost_matrix = modify_cost_matrix_for_open_tour(cost_matrix, index_map, start_waypoint_idx=0)
-
-    M = len(modified_cost_matrix)
-    manager = pywrapcp.RoutingIndexManager(M, 1, depot_index)
+    # lattice node id of every state, -1 if the state is not a free node
+    node_ids = np.array([lattice.node_id(*waypoints[i], hi) for i, hi in state_list], dtype=np.int64)
+    state_wp = np.array([i for i, _ in state_list])
+
+    last_reported = None
+
+    def report(done, total):
+        nonlocal last_reported
+        percent = 5 + 75 * done // total
+        if progress is not None and percent != last_reported:
+            last_reported = percent
+            progress.update("optimization", percent, f"Computed {done}/{total} cost matrix rows")
+
+    if distance_cache is not None:
+        distances, trees = distance_cache.distance_matrix(lattice, node_ids, workers, report)
+    elif workers > 1 and M > 1 and lattice.path is not None:
+        distances, trees = row_search_pool(lattice.path, workers).distance_rows(node_ids, node_ids, report)
+    else:
+        search = search or LatticeSearch(lattice)
+        distances = np.empty((M, M))
+        trees = []
+        for idx in range(M):
+            distances[idx], tree = search.distances(node_ids[idx], node_ids, return_tree=True)
+            trees.append(tree)
+            report(idx + 1, M)
+
+    if distance_cache is None:
+        print(f"Cost matrix: {M} searches, {sum(tree.expanded for tree in trees)} nodes expanded")
+
+    cost_matrix = np.where(np.isfinite(distances), distances * scale, unreachable_cost).astype(np.int64)
+    # no transitions between states of the same waypoint
+    cost_matrix[state_wp[:, None] == state_wp[None, :]] = VERY_LARGE
+
+    return cost_matrix, index_map, trees
+
+def unreachable_waypoints(cost_matrix, index_map, n_starts: int = 1, unreachable_cost=UNREACHABLE_COST) -> List[int]:
+    """
+    Waypoints of compute_cost_matrix (after the n_starts start waypoints)
+    none of whose states the start states reach, including waypoints with no
+    free lattice node at all.
+    """
+    states = np.array(list(index_map.keys()))
+    rows = np.array(list(index_map.values()))
+    start_rows = rows[states[:, 0] < n_starts]
+    reached = (np.asarray(cost_matrix)[start_rows] < unreachable_cost).any(axis=0)
+    reachable = set(states[reached[rows], 0].tolist())
+    return [wp for wp in range(n_starts, int(states[:, 0].max()) + 1) if wp not in reachable]
+
+def run_or_tools(
+    cost_matrix,
+    index_map,
+    N,
+    H,
+    depot_index,
+    solver: Optional[SolverOptions] = None,
+    on_solution: Optional[Callable[[List[int], int], None]] = None,
+    native_costs: bool = True,
+    pool: Optional['SolverPool'] = None
+):
+    """
+    Set up and solve the TSP on the provided cost_matrix with OR-Tools, enforcing one state per waypoint.
+
+    The "fast" profile returns the PATH_CHEAPEST_ARC solution after greedy descent;
+    "guided" keeps improving it with guided local search until the time limit.
+    on_solution(tour, cost) is called for every improving solution found.
+    This is solve_routes with a single route starting at depot_index, run in
+    pool if given.
+    """
+    def route_found(routes, costs):
+        on_solution(routes[0], costs[0])
+
+    routes, costs = (pool.solve_routes if pool is not None else solve_routes)(
+        cost_matrix,
+        index_map,
+        [depot_index],
+        solver=solver,
+        on_solution=route_found if on_solution is not None else None,
+        native_costs=native_costs
+    )
+    if routes is None:
+        return None, None
+    return routes[0], costs[0]
+
+def solve_routes(
+    cost_matrix,
+    index_map,
+    starts: List[int],
+    solver: Optional[SolverOptions] = None,
+    on_solution: Optional[Callable[[List[List[int]], List[int]], None]] = None,
+    native_costs: bool = True
+):
+    """
+    Open routes, one per start state, that together visit one state of every
+    other waypoint, solved with OR-Tools as a vehicle routing problem. With
+    several routes the longest one (the makespan) is minimized first, then
+    the total cost. Returns the routes as state indices and their costs, or
+    (None, None); on_solution(routes, costs) is called for every solution
+    that improves on the ones reported before.
+
+    The problem is solved as a generalized TSP: one disjunction per waypoint
+    over its states, after pruning the states dominated by another heading of
+    the same waypoint, and the headings of every route found are then chosen
+    exactly for its waypoint order. Solutions are compared by these final
+    costs, not by the solver's objective, and the best one is returned.
+
+    Arc costs are handed to OR-Tools as a matrix and evaluated in C++; with
+    native_costs=False they go through a Python callback instead (kept for
+    benchmarks/tsp_solver.py).
+    """
+    # OR-Tools is loaded by the first solve (usually in a SolverPool process), not at server startup
+    from ortools.constraint_solver import pywrapcp, routing_enums_pb2
+
+    solver = solver or SolverOptions()
+    cost_matrix = np.asarray(cost_matrix, dtype=np.int64)
+    clusters = waypoint_clusters(index_map, starts)
+    kept = prune_dominated_states(cost_matrix, clusters, len(starts))
+    print(f"Solving over {sum(len(states) for states in kept)} of {len(cost_matrix)} states")
+
+    # solver node -> state index; the starts are the first nodes
+    R = len(starts)
+    nodes = np.concatenate(kept)
+    solver_cost_matrix = cost_matrix[np.ix_(nodes, nodes)]
+    # open routes: every route ends at its start, and returning there is free
+    solver_cost_matrix[:, :R] = 0
+
+    manager = pywrapcp.RoutingIndexManager(len(nodes), R, list(range(R)), list(range(R)))
     routing = pywrapcp.RoutingModel(manager)
 
-    # Transit callback
-    def cost_cb(from_index, to_index):
-        i = manager.IndexToNode(from_index)
-        j = manager.IndexToNode(to_index)
-        return modified_cost_matrix[i][j]
+    if native_costs:
+        cb_idx = routing.RegisterTransitMatrix(solver_cost_matrix.tolist())
+    else:
+        # Transit callback
+        def cost_cb(from_index, to_index):
+            i = manager.IndexToNode(from_index)
+            j = manager.IndexToNode(to_index)
+            return int(solver_cost_matrix[i][j])
 
-    cb_idx = routing.RegisterTransitCallback(cost_cb)
+        cb_idx = routing.RegisterTransitCallback(cost_cb)
     routing.SetArcCostEvaluatorOfAllVehicles(cb_idx)
 
-    # Enforce at most one state per waypoint, and force visiting each waypoint once via large penalty
-    PENALTY = int(1e8)
-    VERY_LARGE = int(1e9)
-    for wp in range(1, N):  # Skip first waypoint as it has a fixed heading
-        state_idxs = []
-        for (i, _), idx in index_map.items():
-            if i == wp:
-                state_idxs.append(manager.NodeToIndex(idx))
-        routing.AddDisjunction(state_idxs, PENALTY)
-
-    for wp in range(1, N):  # Skip first waypoint as it has fixed heading
-        state_idxs = [manager.NodeToIndex(index_map[(wp, h)]) 
-                     for h in range(H) if (wp, h) in index_map]
-        routing.AddDisjunction(state_idxs, VERY_LARGE)
+    # Visit exactly one state per waypoint; skipping one is only cheaper if it is unreachable
+    offset = R
+    for states in kept[R:]:
+        routing.AddDisjunction([manager.NodeToIndex(offset + k) for k in range(len(states))], SKIP_PENALTY)
+        offset += len(states)
 
-    # # Prevent return to depot (open tour)
-    # routing.AddVariableMinimizedByFinalizer(routing.End(0))
+    # makespan: the global span of the route lengths outweighs their sum
+    makespan_weight = 100 if R > 1 else 0
+    if R > 1:
+        routing.AddDimension(cb_idx, 0, int(1e15), True, "Distance")
+        routing.GetDimensionOrDie("Distance").SetGlobalSpanCostCoefficient(makespan_weight)
 
     # Search parameters
     params = pywrapcp.DefaultRoutingSearchParameters()
     params.first_solution_strategy = (
         routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
+    if solver.profile == "guided":
+        params.local_search_metaheuristic = (
+            routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH)
+    params.time_limit.FromMilliseconds(int(solver.time_limit * 1000))
+
+    def extract_routes(next_of):
+        routes, costs = [], []
+        for vehicle in range(R):
+            idx = routing.Start(vehicle)
+            route = []
+            while not routing.IsEnd(idx):
+                route.append(int(nodes[manager.IndexToNode(idx)]))
+                idx = next_of(idx)
+            # cost from the original matrix, without the free return
+            route, cost = optimize_headings(cost_matrix, clusters, route)
+            routes.append(route)
+            costs.append(cost)
+        return routes, costs
+
+    def objective(routes, costs):
+        skipped = len(clusters) - sum(len(route) for route in routes)
+        return sum(costs) + makespan_weight * max(costs) + SKIP_PENALTY * skipped
+
+    # judged by the routes as returned, after their headings are re-chosen: a solution
+    # the solver sees as better can come out no better than the best one so far
+    best = None
+
+    def solution_found():
+        nonlocal best
+        routes, costs = extract_routes(lambda idx: routing.NextVar(idx).Value())
+        if best is not None and objective(routes, costs) >= objective(*best):
+            return
+        best = routes, costs
+        if on_solution is not None:
+            on_solution(routes, costs)
+
+    routing.AddAtSolutionCallback(solution_found)
 
     solution = routing.SolveWithParameters(params)
     if not solution:
         return None, None
 
-    # Extract tour
-    idx = routing.Start(0)
-    tour = []
-    cost = 0
-    while not routing.IsEnd(idx):
-        node = manager.IndexToNode(idx)
-        tour.append(node)
-        next_idx = solution.Value(routing.NextVar(idx))
-        
-        # nly add cost if we're not at the end
-        if not routing.IsEnd(next_idx):
-            next_node = manager.IndexToNode(next_idx)
-            cost += cost_matrix[node][next_node]  # use original costs for reporting
-        
-        idx = next_idx
-    return tour, cost
+    final = extract_routes(lambda idx: solution.Value(routing.NextVar(idx)))
+    return best if best is not None and objective(*best) < objective(*final) else final
 
-def modify_cost_matrix_for_open_tour(cost_matrix, index_map, start_waypoint_idx=0):
+def _solve_routes_worker(cost_matrix, index_map, starts, solver, native_costs, solutions):
+    return solve_routes(
+        cost_matrix, index_map, starts, solver=solver,
+        on_solution=(lambda routes, costs: solutions.put((routes, costs))) if solutions is not None else None,
+        native_costs=native_costs
+    )
+
+class SolverPool:
     """
-    Modify the cost matrix to eliminate return costs to the starting waypoint.
-    Sets all costs TO the starting waypoint states to zero, effectively making
-    the return "free" so OR-Tools ignores it in optimization.
+    Process pool for OR-Tools solves. The solver holds the GIL while it
+    searches, so optimizations running in threads would take turns; in worker
+    processes they run in parallel. Improving solutions are passed back
+    through a manager queue while the solve runs.
     """
-    modified_matrix = [row[:] for row in cost_matrix]
-    
-    start_state_indices = []
-    for (wp_idx, _), matrix_idx in index_map.items():
-        if wp_idx == start_waypoint_idx:
-            start_state_indices.append(matrix_idx)
-    
-    for i in range(len(modified_matrix)):
-        for start_idx in start_state_indices:
-            modified_matrix[i][start_idx] = 0  
-    
-    return modified_matrix
 
-def plot_or_tools_path(G, waypoints, headings, tour, grid, turning_radius, start_heading_idx = None, save_path=None):
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._executor = None
+        self._manager = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._executor is None:
+                self._manager = spawn_manager()
+                self._executor = spawn_pool(self.workers)
+            return self._executor, self._manager
+
+    def solve_routes(
+        self,
+        cost_matrix,
+        index_map,
+        starts: List[int],
+        solver: Optional[SolverOptions] = None,
+        on_solution: Optional[Callable[[List[List[int]], List[int]], None]] = None,
+        native_costs: bool = True
+    ):
+        """solve_routes in a worker process; on_solution is called in the calling thread."""
+        executor, manager = self._start()
+        solutions = manager.Queue() if on_solution is not None else None
+        future = executor.submit(_solve_routes_worker, np.asarray(cost_matrix), index_map, starts, solver, native_costs, solutions)
+        while solutions is not None:
+            try:
+                on_solution(*solutions.get(timeout=0.1))
+            except queue.Empty:
+                if future.done() and solutions.empty():
+                    break
+        return future.result()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._manager.shutdown()
+                self._executor = None
+                self._manager = None
+
+def tour_paths(lattice: Lattice, waypoints, headings, tour, trees, start_heading_idx = None, on_segment=None):
     """
-    Plot the final path from OR-Tools TSP solution.
-    
-    Args:
-        G: The lattice graph
-        waypoints: List of [x,y] waypoint coordinates
-        headings: List of heading angles
-        tour: The tour returned by OR-Tools as indices
-        grid: np array with map
-        turning_radius: Minimum turning radius (used for finding nearest nodes)
-        save_path: Optional path to save the plot
+    Backtrack the lattice paths of the tour legs from the trees of compute_cost_matrix.
+    on_segment(index, count, xs, ys) is called with the map coordinates of every
+    leg as soon as it is backtracked (empty for a leg without a path).
     """
-    
     # Create state list mapping
     state_list = build_state_list(waypoints, headings, start_heading_idx)
     
@@ -450,98 +461,160 @@ def plot_or_tools_path(G, waypoints, headings, tour, grid, turning_radius, start
         theta = headings[heading_idx]
         states.append(State(x, y, theta))
 
-    # Find paths between consecutive nodes
+    # Backtrack paths (as lattice node ids) between consecutive nodes
     paths = []
     for i in range(len(states) - 1):
-        try:
-            path = nx.shortest_path(G, states[i], states[i+1], weight='cost')
-            paths.append(path)
-            print(f"Found path from waypoint {state_tour[i][0]} to waypoint {state_tour[i+1][0]}")
-        except nx.NetworkXNoPath:
+        path = trees[tour[i]].path_to(
+            lattice.node_id(states[i+1].x, states[i+1].y, state_tour[i+1][1])
+        )
+        if path is None:
             print(f"No path found between states {i} and {i+1}")
-    
-    # Plot the paths
-    plt.figure(figsize=(12, 12))
-    plt.imshow(grid, cmap='gray_r', origin='upper')
-    
-    # Plot waypoints
-    wp_x = [wp[0] for wp in waypoints]
-    wp_y = [wp[1] for wp in waypoints]
-    plt.scatter(wp_x, wp_y, c='blue', s=80, marker='o', label='Waypoints')
-    
-    # Plot all path segments as one connected path
-    all_x = []
-    all_y = []
+            if on_segment is not None:
+                on_segment(i, len(states) - 1, np.empty(0), np.empty(0))
+            continue
+        paths.append(path)
+        if on_segment is not None:
+            on_segment(i, len(states) - 1, *lattice.node_xy(path))
+    return state_tour, states, paths
+
+def tour_path_points(lattice: Lattice, paths):
+    """Path points of the whole tour, as [{"x", "y"}] map coordinates."""
+    points = []
     for path in paths:
-        xs = [s.x for s in path]
-        ys = [s.y for s in path]
-        all_x.extend(xs)
-        all_y.extend(ys)
-    
-    plt.plot(all_x, all_y, '-r', linewidth=2, label='Complete Path')
-    
-    # Mark start and end of the complete path
-    if paths:
-        plt.scatter([paths[0][0].x], [paths[0][0].y], c='green', s=80, marker='o', label='Start')
-        plt.scatter([paths[-1][-1].x], [paths[-1][-1].y], c='red', s=80, marker='x', label='End')
-    
-    # Show orientations at waypoints
-    for state, (wp_idx, heading_idx) in zip(states, state_tour):
-        # Draw orientation arrows
-        arrow_length = 0.3 
-        dx = arrow_length * math.cos(state.theta)
-        dy = arrow_length * math.sin(state.theta)
-        plt.arrow(state.x, state.y, dx, dy, head_width=0.1, head_length=0.1, 
-                  fc='orange', ec='orange', alpha=0.7)
-    
-    plt.legend()
-    plt.title('TSP Solution Path')
-    plt.axis('equal')
-    
-    if save_path:
-        plt.savefig(save_path, dpi=300)
-        print(f"Plot saved to {save_path}")
+        xs, ys = lattice.node_xy(path)
+        points.extend({"x": float(x), "y": float(y)} for x, y in zip(xs, ys))
+    return points
+
+def tour_distance(lattice: Lattice, waypoints, tour, trees, inv_map):
+    """Sum of the tree distances of the tour legs (inf if a leg has no path)."""
+    total_distance = 0
+    for a, b in zip(tour, tour[1:]):
+        x, y = waypoints[inv_map[b][0]]
+        total_distance += trees[a].distance_to(lattice.node_id(x, y, inv_map[b][1]))
+    return total_distance
+
+def nearest_heading_idx(headings, yaw):
+    """Index of the lattice heading closest to yaw."""
+    return min(range(len(headings)),
+        key = lambda i: min(abs(headings[i] - yaw),
+        2*math.pi - abs(headings[i] - yaw)))
+
+def _route_segments(on_segment, version, robot):
+    """on_segment of optimize_waypoints bound to one route, as tour_paths expects it."""
+    if on_segment is None:
+        return None
+    return lambda index, count, xs, ys: on_segment(version, robot, index, count, xs, ys)
 
+def route_occupancy(grid: np.ndarray) -> np.ndarray:
+    """Occupancy the lattice of grid was built from, which route trajectories are checked against."""
+    return inflate_obstacles(grid > 0, LATTICE_PARAMS.footprint_radius)
 
-    path_points = [{"x": float(x), "y": float(y)} for x, y in zip(all_x, all_y)]
-    
-    return paths, path_points
+def route_trajectory(occ: np.ndarray, lattice: Lattice, paths, info: MapMetaData) -> dict:
+    """Curvature-bounded trajectory of a route's leg paths as a nav_msgs/Path-style dict in the map frame."""
+    trajectory = smooth_trajectory(lattice, LATTICE_PARAMS, paths, occ)
+    return {
+        "frame_id": "map",
+        "poses": trajectory_poses(trajectory, info.resolution, info.origin.x, info.origin.y, info.height),
+        "max_curvature": trajectory.max_curvature / info.resolution,  # 1/m
+        # within 1/turning_radius; the client sends the waypoints instead if not
+        "feasible": trajectory.feasible
+    }
 
 def process_waypoints(raw_waypoints):
     return raw_waypoints
 
-def precompute_graph(req: PrecomputeRequest, progress: ProcessProgress):
-    node_spacing = 2
-    theta_bins = 16
-    min_turning_radius = 12
-    primitive_length = 4
+def precompute_graph(
+    info: MapMetaData,
+    grid: np.ndarray,
+    progress: ProcessProgress,
+    workers: Optional[int] = None,
+    cache: Optional[LatticeCache] = None
+):
+    params = LATTICE_PARAMS
 
-    # construct map
-    h = req.info.height
-    w = req.info.width
-    grid = load_map(req.map, w, h)
+    h, w = grid.shape
     print(f"Loaded map ({h}x{w})")
-    progress.update("precomputation", 25, f"Loaded map ({h}x{w})")
+    progress.update("precomputation", 5, f"Loaded map ({h}x{w})")
+
+    if cache is not None:
+        key = cache.key(grid, info, params)
+        cached = cache.get(key)
+        if cached is not None:
+            print(f"Lattice {key[:12]} loaded from cache")
+            progress.update("precomputation", 95, "Loaded lattice from cache")
+            return cached
 
-    G = build_lattice_graph_from_pgm(
+    lattice = build_lattice_graph_from_pgm(
         grid,
-        node_spacing,
-        theta_bins,
-        min_turning_radius,
-        primitive_length,
-        progress
+        params.node_spacing,
+        params.n_headings,
+        params.turning_radius,
+        params.primitive_length,
+        progress,
+        nb_points=params.nb_points,
+        reverse_penalty_factor=params.reverse_penalty_factor,
+        workers=workers or os.cpu_count() or 1,
+        footprint_radius=params.footprint_radius
     )
 
-    with open("map.pkl", 'wb') as f:
-        pickle.dump(G, f, pickle.HIGHEST_PROTOCOL)
-
-    return grid, G
+    print(f"Lattice built with {lattice.num_nodes} nodes, {lattice.num_edges} edges ({lattice.nbytes / 1e6:.1f} MB)")
+
+    if cache is not None:
+        grid, lattice = cache.put(key, grid, lattice, info)
+
+    return grid, lattice
+
+def update_graph(
+    info: MapMetaData,
+    new_grid: np.ndarray,
+    grid: np.ndarray,
+    lattice: Lattice,
+    progress: ProcessProgress,
+    cache: Optional[LatticeCache] = None
+):
+    """Update the lattice for a changed map, rebuilding only edges near changed cells."""
+    if new_grid.shape != grid.shape:
+        raise ValueError(f"Map size changed from {grid.shape} to {new_grid.shape}, run a full precomputation")
+
+    changed_cells = int(np.count_nonzero((grid > 0) != (new_grid > 0)))
+    progress.update("precomputation", 5, f"{changed_cells} map cells changed")
+
+    lattice, rebuilt = update_lattice(lattice, grid, new_grid, LATTICE_PARAMS)
+    print(f"Lattice updated: {changed_cells} changed cells, {rebuilt} node positions rebuilt")
+    progress.update("precomputation", 90, f"Rebuilt {rebuilt} node positions")
+
+    if cache is not None and changed_cells:
+        new_grid, lattice = cache.put(cache.key(new_grid, info, LATTICE_PARAMS), new_grid, lattice, info)
+
+    return new_grid, lattice
+
+def optimize_waypoints(
+    grid,
+    lattice: Lattice,
+    req: WaypointsRequest,
+    progress: Optional[ProcessProgress] = None,
+    workers: Optional[int] = None,
+    distance_cache: Optional[DistanceCache] = None,
+    on_route: Optional[Callable[[dict], None]] = None,
+    solver_pool: Optional[SolverPool] = None,
+    on_segment: Optional[Callable[[int, int, int, int, np.ndarray, np.ndarray], None]] = None
+):
+    """
+    Optimize the waypoint order for req. Every improving route the solver finds
+    is reported as a progress event and, as a full response, to on_route, so a
+    route is available before a "guided" solve finishes. Requests with robots
+    are planned for the whole fleet by optimize_fleet. With a solver_pool the
+    solve runs in one of its processes. on_segment(version, robot, index, count, xs, ys)
+    receives the geometry of every route leg as it is reconstructed; each
+    route found gets a new version.
+    """
+    if req.robots:
+        return optimize_fleet(grid, lattice, req, progress, workers, distance_cache, on_route, solver_pool, on_segment)
 
-def optimize_waypoints(grid, G: DiGraph, req: WaypointsRequest):
     # const variables
     resolution = req.info.resolution
-    theta_bins = 16
-    min_turning_radius = 12
+    # the headings of the waypoint states are those of the lattice nodes
+    theta_bins = lattice.n_headings
 
 
     ros_yaw = req.start_heading
@@ -550,57 +623,173 @@ def optimize_waypoints(grid, G: DiGraph, req: WaypointsRequest):
     yaw_0_2pi = ros_yaw % (2.0 * math.pi)
 
     # compute headings and find the start heading index
-    headings = [
-        ((2 * math.pi * i / theta_bins) + math.pi) % (2*math.pi) - math.pi
-        for i in range(theta_bins)
-    ]
-    start_heading_idx = min(range(len(headings)), 
-        key = lambda i: min(abs(headings[i] - ros_yaw), 
-        2*math.pi - abs(headings[i] - ros_yaw)))
+    headings = lattice_headings(theta_bins)
+    start_heading_idx = nearest_heading_idx(headings, ros_yaw)
     
     print(headings[start_heading_idx])
 
     waypoints = process_waypoints(req.waypoints)
 
-    cost_matrix, index_map = compute_cost_matrix(
-        G, 
+    cost_matrix, index_map, trees = compute_cost_matrix(
+        lattice, 
         waypoints, 
         headings, 
-        start_heading_idx=start_heading_idx
+        start_heading_idx=start_heading_idx,
+        progress=progress,
+        workers=workers or os.cpu_count() or 1,
+        distance_cache=distance_cache
     )
 
-    print(f"Lattice stored with {G.number_of_nodes()} nodes to maps folder")
+    print(f"Lattice stored with {lattice.num_nodes} nodes to maps folder")
 
-    tour, raw_cost = run_or_tools(cost_matrix, index_map, len(waypoints), theta_bins, 0)
+    unreachable = unreachable_waypoints(cost_matrix, index_map)
+    if unreachable:
+        raise UnreachableWaypoints(unreachable)
+
+    inv_map = {v: k for k, v in index_map.items()}
+    solve_start = time.time()
+    versions = itertools.count(1)
+    last_tour = None
+
+    def solution_found(tour, cost):
+        nonlocal last_tour
+        last_tour = tour
+        _, _, paths = tour_paths(lattice, waypoints, headings, tour, trees, start_heading_idx,
+                                 _route_segments(on_segment, next(versions), 0))
+        response = create_response(tour, tour_distance(lattice, waypoints, tour, trees, inv_map),
+                                   waypoints, headings, index_map, tour_path_points(lattice, paths))
+        if progress is not None:
+            elapsed = min(1.0, (time.time() - solve_start) / max(req.solver.time_limit, 1e-3))
+            progress.update("optimization", 80 + int(19 * elapsed),
+                            f"Found route: distance {response['distance']:.1f}, order {response['waypoint_order']}")
+        if on_route is not None:
+            on_route(response)
+
+    tour, raw_cost = run_or_tools(
+        cost_matrix,
+        index_map,
+        len(waypoints),
+        theta_bins,
+        0,
+        solver=req.solver,
+        on_solution=solution_found if progress is not None or on_route is not None or on_segment is not None else None,
+        pool=solver_pool
+    )
     
     if not tour:
         return {"error": "No solution found"}
-    
 
-    inv_map = {v: k for k, v in index_map.items()}
+    # every waypoint is reachable from the start, but not necessarily from the others
+    skipped = sorted(set(range(len(waypoints))) - {inv_map[idx][0] for idx in tour})
+    if skipped:
+        raise UnreachableWaypoints(skipped, "cannot be reached from the other waypoints")
+    
     state_tour = [inv_map[idx] for idx in tour]
     print(f'Tour in state-list indices: {tour}')
     print(f'Tour as (waypoint,heading) pairs: {state_tour}')
     print(f'Total scaled cost: {raw_cost}')
     print(f'Total distance: ${raw_cost * resolution}')
-    paths, path_points = plot_or_tools_path(
-        G, 
-        waypoints, 
-        headings, 
-        tour, 
-        grid,
-        min_turning_radius,
-        start_heading_idx=start_heading_idx,
-        save_path="tsp_solution_path.png"
-    )
+    # the last route reported is already streamed
+    segments = None if tour == last_tour else _route_segments(on_segment, next(versions), 0)
+    _, _, paths = tour_paths(lattice, waypoints, headings, tour, trees, start_heading_idx, segments)
+    path_points = tour_path_points(lattice, paths)
 
-    total_distance = 0
-    for path in paths:
-        for i in range(len(path) - 1):
-            edge_data = G.get_edge_data(path[i], path[i+1])
-            if edge_data:
-                total_distance += edge_data.get('cost', 0)
+    total_distance = tour_distance(lattice, waypoints, tour, trees, inv_map)
     
     return_object = create_response(tour, total_distance, waypoints, headings, index_map, path_points)
+    return_object["trajectory"] = route_trajectory(route_occupancy(grid), lattice, paths, req.info)
     
-    return return_object
\ No newline at end of file
+    return return_object
+
+def optimize_fleet(
+    grid,
+    lattice: Lattice,
+    req: WaypointsRequest,
+    progress: Optional[ProcessProgress] = None,
+    workers: Optional[int] = None,
+    distance_cache: Optional[DistanceCache] = None,
+    on_route: Optional[Callable[[dict], None]] = None,
+    solver_pool: Optional[SolverPool] = None,
+    on_segment: Optional[Callable[[int, int, int, int, np.ndarray, np.ndarray], None]] = None
+):
+    """
+    Split req.waypoints across the robots of req.robots. The robots' start
+    states are put in front of the waypoints, so one cost matrix serves the
+    whole fleet, and one vehicle routing problem over it minimizes the
+    longest route. The response has a route per robot (waypoint_order indexes
+    req.waypoints), lists the waypoints no robot can reach as unreachable and
+    every waypoint left out of the routes (those, and any the solver could
+    only reach through an unreachable one) as unassigned.
+    """
+    R = len(req.robots)
+    headings = lattice_headings(lattice.n_headings)
+    start_heading_idxs = [nearest_heading_idx(headings, robot.heading) for robot in req.robots]
+    points = [(robot.x, robot.y) for robot in req.robots] + list(process_waypoints(req.waypoints))
+
+    cost_matrix, index_map, trees = compute_cost_matrix(
+        lattice,
+        points,
+        headings,
+        start_heading_idx=start_heading_idxs,
+        progress=progress,
+        workers=workers or os.cpu_count() or 1,
+        distance_cache=distance_cache
+    )
+
+    unreachable = [wp - R for wp in unreachable_waypoints(cost_matrix, index_map, R)]
+    inv_map = {v: k for k, v in index_map.items()}
+    versions = itertools.count(1)
+
+    def create_fleet_response(routes, with_trajectory=False, stream=True):
+        version = next(versions) if stream else None
+        occ = route_occupancy(grid) if with_trajectory else None
+        robot_routes = []
+        for robot, tour in enumerate(routes):
+            _, _, paths = tour_paths(lattice, points, headings, tour, trees, start_heading_idxs,
+                                     _route_segments(on_segment, version, robot) if stream else None)
+            route = create_response(tour, tour_distance(lattice, points, tour, trees, inv_map),
+                                    points, headings, index_map, tour_path_points(lattice, paths))
+            route["robot"] = robot
+            route["waypoint_order"] = [wp - R for wp in route["waypoint_order"][1:]]
+            if with_trajectory:
+                route["trajectory"] = route_trajectory(occ, lattice, paths, req.info)
+            robot_routes.append(route)
+        assigned = {wp for route in robot_routes for wp in route["waypoint_order"]}
+        return {
+            "makespan": max(route["distance"] for route in robot_routes),
+            "distance": sum(route["distance"] for route in robot_routes),
+            "routes": robot_routes,
+            "unreachable": unreachable,
+            "unassigned": [wp for wp in range(len(req.waypoints)) if wp not in assigned]
+        }
+
+    solve_start = time.time()
+    last_routes = None
+
+    def solution_found(routes, costs):
+        nonlocal last_routes
+        last_routes = routes
+        response = create_fleet_response(routes)
+        if progress is not None:
+            elapsed = min(1.0, (time.time() - solve_start) / max(req.solver.time_limit, 1e-3))
+            progress.update("optimization", 80 + int(19 * elapsed),
+                            f"Found routes for {R} robots: makespan {response['makespan']:.1f}")
+        if on_route is not None:
+            on_route(response)
+
+    routes, costs = (solver_pool.solve_routes if solver_pool is not None else solve_routes)(
+        cost_matrix,
+        index_map,
+        [index_map[(robot, heading_idx)] for robot, heading_idx in enumerate(start_heading_idxs)],
+        solver=req.solver,
+        on_solution=solution_found if progress is not None or on_route is not None or on_segment is not None else None
+    )
+
+    if not routes:
+        return {"error": "No solution found"}
+
+    for robot, tour in enumerate(routes):
+        print(f'Robot {robot} tour as (waypoint,heading) pairs: {[inv_map[idx] for idx in tour]}')
+
+    # the last routes reported are already streamed
+    return create_fleet_response(routes, with_trajectory=True, stream=routes != last_routes)
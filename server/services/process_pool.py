@@ -0,0 +1,45 @@
+"""
+Process pools for the CPU-bound work of the server (lattice tiles, row
+searches, OR-Tools solves).
+
+Workers are started with spawn rather than fork: the server process runs ROS
+and uvicorn threads, and a forked child would inherit their locks in whatever
+state they were in.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Optional
+
+_context = multiprocessing.get_context("spawn")
+
+# state of the current worker process, set once by the pool initializer
+_worker_state = None
+
+
+def _init_worker(setup, args):
+    global _worker_state
+    _worker_state = setup(*args) if setup is not None else args
+
+
+def worker_state() -> Any:
+    """State of the current worker process, as built by the setup of its pool."""
+    return _worker_state
+
+
+def spawn_pool(workers: int, setup: Optional[Callable] = None, args: tuple = ()) -> ProcessPoolExecutor:
+    """
+    Process pool of spawned workers. Each worker calls setup(*args) once (or
+    keeps args itself without setup) and reads the result with worker_state().
+    setup must be a module-level function, as it is pickled to the workers.
+    """
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=_context,
+        initializer=_init_worker,
+        initargs=(setup, args)
+    )
+
+
+def spawn_manager():
+    """Manager process for queues shared with spawned workers."""
+    return _context.Manager()
@@ -2,15 +2,26 @@ from typing import Callable, List, Optional
 
 
 class ProcessProgress:
-    def __init__(self):
+    def __init__(self, job_id: Optional[str] = None):
+        self.job_id = job_id  # job whose progress this is, passed on to the callbacks
         self.current = None
+        self.current_job = None
         self.progress = 0
         self.message = ""
         self.error = None
         self._callbacks: List[Callable] = []
     
-    def update(self, process_type: str, progress: int, message: str, error: Optional[str] = None):
+    def update(
+        self,
+        process_type: str,
+        progress: int,
+        message: str,
+        error: Optional[str] = None,
+        job_id: Optional[str] = None
+    ):
+        job_id = job_id if job_id is not None else self.job_id
         self.current = process_type
+        self.current_job = job_id
         self.progress = progress
         self.message = message
         self.error = error
@@ -18,7 +29,7 @@ class ProcessProgress:
         # Trigger all callbacks (WebSocket broadcasts)
         for callback in self._callbacks:
             try:
-                callback(process_type, progress, message, error)
+                callback(process_type, progress, message, error, job_id)
             except Exception as e:
                 print(f"Callback error: {e}")
     
@@ -27,6 +38,7 @@ class ProcessProgress:
     
     def clear(self):
         self.current = None
+        self.current_job = None
         self.progress = 0
         self.message = ""
         self.error = None
\ No newline at end of file
@@ -0,0 +1,104 @@
+"""
+PNG images of optimized routes, rendered off the request threads.
+
+Rendering is only needed for /route/image and the ROUTE_PLOT_PATH debug
+mode, so matplotlib is imported on first use. The figures are built with
+the object-oriented API instead of pyplot: they are plain objects freed
+with the image, and concurrent renders share no global state.
+"""
+import io
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+
+ROUTE_COLORS = ['tab:red', 'tab:blue', 'tab:green', 'tab:purple', 'tab:orange', 'tab:brown']
+
+
+def render_route_png(grid: np.ndarray, route: dict, size: float = 8.0, dpi: int = 100) -> bytes:
+    """PNG of a route response (single robot or fleet) drawn over its map grid."""
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(size, size), dpi=dpi)
+    ax = fig.add_subplot()
+    ax.imshow(grid, cmap='gray_r', origin='upper')
+
+    routes = route.get("routes", [route])
+    for i, robot_route in enumerate(routes):
+        color = ROUTE_COLORS[i % len(ROUTE_COLORS)]
+        label = f"Robot {robot_route['robot']}" if "robot" in robot_route else "Path"
+        points = robot_route.get("path_points") or []
+        if points:
+            xs = [p["x"] for p in points]
+            ys = [p["y"] for p in points]
+            ax.plot(xs, ys, '-', color=color, linewidth=1.5, label=label)
+            ax.scatter([xs[0]], [ys[0]], c='green', s=40, marker='o', zorder=3)
+
+        # waypoint states with their headings
+        states = robot_route.get("solution_array") or []
+        if states:
+            x = np.array([s["x"] for s in states], dtype=float)
+            y = np.array([s["y"] for s in states], dtype=float)
+            theta = np.array([s["theta"] for s in states], dtype=float)
+            ax.scatter(x, y, c=color, s=30, marker='o', edgecolors='black', zorder=3)
+            ax.quiver(x, y, np.cos(theta), np.sin(theta), color='orange', angles='xy', scale=40, width=0.004, zorder=4)
+
+    ax.set_title('Optimized Route')
+    ax.set_aspect('equal')
+    if any(r.get("path_points") for r in routes):
+        ax.legend(loc='upper right')
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', bbox_inches='tight')
+    return buffer.getvalue()
+
+
+class RouteRenderer:
+    """
+    Renders route images on one background thread. The image of the last
+    few keys is kept while the key's grid and route are the same objects,
+    so repeated requests for an unchanged route are served from the cache
+    and concurrent ones wait for the same render.
+    """
+
+    def __init__(self, cache_size: int = 8):
+        self.cache_size = cache_size
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._images: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def render(self, key: str, grid: np.ndarray, route: dict, save_path: Optional[str] = None) -> Future:
+        """Future of the PNG bytes of route on grid; with save_path the image is also written there."""
+        with self._lock:
+            cached = self._images.get(key)
+            if cached is not None and cached[0] is grid and cached[1] is route and not save_path:
+                future = cached[2]
+                if not future.done() or future.exception() is None:
+                    self._images.move_to_end(key)
+                    return future
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="route-render")
+            future = self._executor.submit(self._render, grid, route, save_path)
+            self._images[key] = (grid, route, future)
+            self._images.move_to_end(key)
+            while len(self._images) > self.cache_size:
+                self._images.popitem(last=False)
+            return future
+
+    @staticmethod
+    def _render(grid: np.ndarray, route: dict, save_path: Optional[str]) -> bytes:
+        image = render_route_png(grid, route)
+        if save_path:
+            with open(save_path, 'wb') as f:
+                f.write(image)
+            print(f"Plot saved to {save_path}")
+        return image
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            self._images.clear()
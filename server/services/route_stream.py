@@ -0,0 +1,42 @@
+"""
+Binary frames of route geometry, streamed on /ws/route while routes are
+reconstructed.
+
+Every frame holds one leg of a route (the lattice path between two
+consecutive waypoints), little-endian:
+
+    magic      4s   b"RSEG"
+    job        16s  job id (uuid bytes)
+    version    u32  route version within the job; a higher one replaces the route
+    robot      u16  route of this robot (0 for single-robot requests)
+    index      u16  leg index
+    count      u16  number of legs of the route
+    n_points   u32  points in this leg (0 if the leg has no path)
+    step       f32  map cells per coordinate unit (the lattice node spacing)
+    x0, y0     i32  first point, in units of step
+    deltas     i16  (dx, dy) per following point, in units of step
+
+Lattice paths move between neighbouring nodes, so a point takes 4 bytes
+instead of the ~30 of a JSON {"x", "y"} object.
+"""
+import struct
+
+import numpy as np
+
+SEGMENT_MAGIC = b"RSEG"
+SEGMENT_HEADER = struct.Struct("<4s16sIHHHIfii")
+
+
+def encode_segment(job_id: str, version: int, robot: int, index: int, count: int, xs, ys, step: float) -> bytes:
+    """Frame of one route leg with points (xs, ys) in map cells."""
+    qx = np.rint(np.asarray(xs, dtype=np.float64) / step).astype(np.int64)
+    qy = np.rint(np.asarray(ys, dtype=np.float64) / step).astype(np.int64)
+    deltas = np.stack([np.diff(qx), np.diff(qy)], axis=1)
+    if deltas.size and np.abs(deltas).max() > np.iinfo(np.int16).max:
+        raise ValueError("Route points too far apart for a segment frame")
+    header = SEGMENT_HEADER.pack(
+        SEGMENT_MAGIC, bytes.fromhex(job_id), version, robot, index, count, len(qx), step,
+        int(qx[0]) if len(qx) else 0, int(qy[0]) if len(qy) else 0
+    )
+    return header + deltas.astype('<i2').tobytes()
+
@@ -0,0 +1,322 @@
+import math
+import threading
+from concurrent.futures import as_completed
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from server.services.lattice import Lattice
+from server.services.lattice_io import load_lattice
+from server.services.process_pool import spawn_pool, worker_state
+
+
+class PathTree:
+    """
+    Shortest path tree of one search, pruned to the paths that reach its
+    targets. Nodes are sorted; parent_pos indexes the parent of each node in
+    nodes (-1 for the source) and edges holds the lattice edge into it.
+    expanded counts the node expansions of the search.
+    """
+
+    def __init__(
+        self,
+        source: int,
+        nodes: np.ndarray,
+        parent_pos: np.ndarray,
+        edges: np.ndarray,
+        dist: np.ndarray,
+        expanded: int = 0
+    ):
+        self.source = source
+        self.nodes = nodes
+        self.parent_pos = parent_pos
+        self.edges = edges
+        self.dist = dist
+        self.expanded = expanded
+
+    def _position(self, node: int) -> int:
+        pos = int(np.searchsorted(self.nodes, node))
+        if pos < len(self.nodes) and self.nodes[pos] == node:
+            return pos
+        return -1
+
+    def distance_to(self, target: int) -> float:
+        pos = self._position(target)
+        return float(self.dist[pos]) if pos >= 0 else math.inf
+
+    def path_to(self, target: int) -> Optional[List[int]]:
+        """Node ids from the source to target, or None if target is not in the tree."""
+        pos = self._position(target)
+        if pos < 0:
+            return None
+        positions = [pos]
+        while self.parent_pos[positions[-1]] >= 0:
+            positions.append(int(self.parent_pos[positions[-1]]))
+        positions.reverse()
+        return self.nodes[positions].tolist()
+
+
+class LatticeSearch:
+    """
+    Single-source shortest path search over the CSR arrays of a Lattice.
+
+    Every edge costs at least delta (the cheapest edge), so all open nodes
+    whose distance lies within delta of the smallest open distance are final
+    and are expanded together as one NumPy frontier: a bucketed Dijkstra
+    that needs one vectorized step per delta of path length. The search stops
+    as soon as every target is settled. Distance buffers are allocated once
+    and only the touched entries are reset between searches.
+
+    Given an admissible heuristic, buckets are taken by distance plus the
+    heuristic instead (A*): the search is drawn toward the targets, and nodes
+    improved after their expansion are simply expanded again. expanded counts
+    the node expansions of the last search.
+    """
+
+    def __init__(self, lattice: Lattice):
+        self.lattice = lattice
+        # plain ndarray views, memmap subclasses add overhead to every gather
+        self.indptr = np.asarray(lattice.indptr)
+        self.targets = np.asarray(lattice.targets)
+        self.costs = np.asarray(lattice.costs)
+        self.delta = float(self.costs.min()) if len(self.costs) else 1.0
+        self._dist = np.full(lattice.num_nodes, np.inf)
+        # edge into every touched node; only read for nodes of the current search
+        self._pred = np.empty(lattice.num_nodes, dtype=np.int32 if len(self.targets) < 2**31 else np.int64)
+        self._mark = np.zeros(lattice.num_nodes, dtype=bool)
+        self._h = None
+        self._cost_per_distance = None
+        self.expanded = 0
+
+    def distances(
+        self,
+        source: int,
+        targets: np.ndarray,
+        limit: float = math.inf,
+        return_tree: bool = False,
+        heuristic: Optional[Callable[[np.ndarray], np.ndarray]] = None
+    ):
+        """
+        Shortest distances from source to each node in targets (inf if unreachable,
+        not a node (-1), or farther than limit). With return_tree, also returns the
+        PathTree of the paths to the reached targets. heuristic maps node ids to
+        lower bounds on their distance to the nearest target, e.g.
+        euclidean_heuristic(targets).
+        """
+        targets = np.asarray(targets, dtype=np.int64)
+        result = np.full(len(targets), np.inf)
+        valid = targets >= 0
+        goal = np.unique(targets[valid])
+        self.expanded = 0
+        if source < 0 or goal.size == 0:
+            return (result, self._empty_tree(source)) if return_tree else result
+
+        touched = []
+        try:
+            dist = self._run(source, goal, limit, heuristic, touched)
+            found = dist[targets[valid]]
+            result[valid] = np.where(found <= limit, found, np.inf)
+            if not return_tree:
+                return result
+            goal_dist = dist[goal]
+            reached = goal[np.isfinite(goal_dist) & (goal_dist <= limit)]
+            return result, self._prune_tree(source, reached)
+        finally:
+            self._dist[np.concatenate(touched)] = np.inf
+
+    def _run(self, source: int, goal: np.ndarray, limit: float, heuristic, touched: list) -> np.ndarray:
+        """
+        Search from source until every goal node is settled. Returns the
+        distance buffer; touched collects the nodes whose distance was set,
+        for the caller to reset.
+        """
+        dist = self._dist
+        dist[source] = 0.0
+        self._pred[source] = -1
+        touched.append(np.array([source], dtype=np.int64))
+        open_nodes = touched[0]
+        if heuristic is not None:
+            if self._h is None:
+                self._h = np.zeros(self.lattice.num_nodes)
+            h = self._h
+            h[source] = heuristic(open_nodes)[0]
+
+        while open_nodes.size:
+            open_dist = dist[open_nodes] if heuristic is None else dist[open_nodes] + h[open_nodes]
+            lo = open_dist.min()
+            # every goal settled (or beyond the limit, or unreachable by the heuristic): nothing left to improve
+            if lo > limit or lo == math.inf or dist[goal].max() < lo:
+                break
+
+            in_bucket = open_dist < lo + self.delta
+            frontier = np.unique(open_nodes[in_bucket])
+            open_nodes = open_nodes[~in_bucket]
+            self.expanded += frontier.size
+
+            improved, new_dist, via = self._relax(frontier, dist)
+            if improved.size:
+                dist[improved] = new_dist
+                self._pred[improved] = via
+                if heuristic is not None:
+                    h[improved] = heuristic(improved)
+                touched.append(improved)
+                open_nodes = np.concatenate((open_nodes, improved))
+        return dist
+
+    @property
+    def cost_per_distance(self) -> float:
+        """
+        Smallest edge cost per unit of straight-line displacement. Primitive
+        end points are snapped to nodes, so an edge can cost less than the
+        distance between its nodes; scaling by this keeps the Euclidean bound
+        admissible.
+        """
+        if self._cost_per_distance is None:
+            src = np.repeat(np.arange(self.lattice.num_nodes, dtype=np.int64), np.diff(self.indptr))
+            sx, sy = self.lattice.node_xy(src)
+            dx, dy = self.lattice.node_xy(self.targets)
+            length = np.hypot(dx - sx, dy - sy)
+            moving = length > 0
+            self._cost_per_distance = float((self.costs[moving] / length[moving]).min()) if moving.any() else 0.0
+        return self._cost_per_distance
+
+    def euclidean_heuristic(self, targets) -> Callable[[np.ndarray], np.ndarray]:
+        """Admissible heuristic: scaled straight-line distance to the nearest target position."""
+        targets = np.asarray(targets, dtype=np.int64)
+        gx, gy = self.lattice.node_xy(np.unique(targets[targets >= 0] // self.lattice.n_headings * self.lattice.n_headings))
+        scale = self.cost_per_distance
+
+        def heuristic(nodes):
+            x, y = self.lattice.node_xy(nodes)
+            return scale * np.hypot(x[:, None] - gx, y[:, None] - gy).min(axis=1)
+
+        return heuristic
+
+    def _parents(self, nodes: np.ndarray) -> np.ndarray:
+        """Parent node of each node, from the source node of its predecessor edge."""
+        return np.searchsorted(self.indptr, self._pred[nodes], side='right') - 1
+
+    def _prune_tree(self, source: int, reached: np.ndarray) -> PathTree:
+        """Collect the tree nodes on the paths to reached, backtracking all of them at once."""
+        mark = self._mark
+        levels = [reached]
+        mark[reached] = True
+        frontier = reached[reached != source]
+        while frontier.size:
+            parents = np.unique(self._parents(frontier))
+            parents = parents[~mark[parents]]
+            mark[parents] = True
+            levels.append(parents)
+            frontier = parents[parents != source]
+        nodes = np.unique(np.concatenate(levels))
+        mark[nodes] = False
+
+        edges = self._pred[nodes]
+        parent_pos = np.full(len(nodes), -1, dtype=np.int64)
+        inner = nodes != source
+        parent_pos[inner] = np.searchsorted(nodes, self._parents(nodes[inner]))
+        edges[~inner] = -1
+        return PathTree(source, nodes, parent_pos, edges, self._dist[nodes].copy(), self.expanded)
+
+    @staticmethod
+    def _empty_tree(source: int) -> PathTree:
+        empty = np.empty(0, dtype=np.int64)
+        return PathTree(source, empty, empty, empty, np.empty(0))
+
+    def _relax(self, frontier: np.ndarray, dist: np.ndarray):
+        """
+        Relax all out-edges of frontier; returns improved nodes, their new
+        distances and the edge that improved them.
+        """
+        starts = self.indptr[frontier]
+        counts = self.indptr[frontier + 1] - starts
+        total = int(counts.sum())
+        if total == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, np.empty(0), empty
+
+        # edge index of every out-edge of the frontier, in frontier order
+        edges = np.arange(total) + np.repeat(starts - (np.cumsum(counts) - counts), counts)
+        heads = self.targets[edges].astype(np.int64)
+        candidate = np.repeat(dist[frontier], counts) + self.costs[edges]
+
+        better = candidate < dist[heads]
+        heads, candidate, edges = heads[better], candidate[better], edges[better]
+        if heads.size == 0:
+            return heads, candidate, edges
+
+        # keep the best candidate per head node
+        order = np.lexsort((candidate, heads))
+        heads, candidate, edges = heads[order], candidate[order], edges[order]
+        first = np.ones(heads.size, dtype=bool)
+        first[1:] = heads[1:] != heads[:-1]
+        return heads[first], candidate[first], edges[first]
+
+
+
+def _row_search(path):
+    _, lattice, _ = load_lattice(path)
+    return LatticeSearch(lattice)
+
+
+def _search_row(row, source, targets):
+    distances, tree = worker_state().distances(source, targets, return_tree=True)
+    return row, distances, tree
+
+
+class RowSearchPool:
+    """
+    Process pool for independent single-source searches. Every worker maps
+    the same lattice file read-only, so the lattice is shared through the
+    page cache instead of being copied into each process.
+    """
+
+    def __init__(self, path: str, workers: int):
+        self.path = path
+        self.workers = workers
+        self.executor = spawn_pool(workers, _row_search, (path,))
+
+    def distance_rows(
+        self,
+        sources: np.ndarray,
+        targets: np.ndarray,
+        on_row: Optional[Callable[[int, int], None]] = None
+    ) -> Tuple[np.ndarray, List[PathTree]]:
+        """
+        Distances from every source to every target and the path tree of each
+        source; on_row(done, total) is called per finished row.
+        """
+        rows = np.empty((len(sources), len(targets)))
+        trees = [None] * len(sources)
+        futures = [self.executor.submit(_search_row, i, int(source), targets) for i, source in enumerate(sources)]
+        for done, future in enumerate(as_completed(futures), 1):
+            i, rows[i], trees[i] = future.result()
+            if on_row is not None:
+                on_row(done, len(sources))
+        return rows, trees
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+_pool: Optional[RowSearchPool] = None
+_pool_lock = threading.Lock()
+
+
+def row_search_pool(path: str, workers: int) -> RowSearchPool:
+    """Shared pool for the lattice file at path, recreated when the lattice changes."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.path != path or _pool.workers != workers:
+            if _pool is not None:
+                _pool.shutdown()
+            _pool = RowSearchPool(path, workers)
+        return _pool
+
+
+def shutdown_row_search_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
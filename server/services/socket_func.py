@@ -1,8 +1,161 @@
 import asyncio
 import json
+import threading
 import time
-from typing import List, Optional
+from collections import deque
+from typing import Dict, Optional
 
 from fastapi import WebSocket
 
 
+def progress_event(
+    process_type: str,
+    progress_val: int,
+    message: str,
+    error: Optional[str] = None,
+    job_id: Optional[str] = None
+) -> dict:
+    """Progress message as sent to the WebSocket clients"""
+    status_message = {
+        "type": "progress",
+        "job_id": job_id,
+        "process": process_type,
+        "progress": progress_val,
+        "message": message,
+        "timestamp": time.time()
+    }
+    if error:
+        status_message["error"] = error
+    return status_message
+
+
+class ProgressBus:
+    """
+    Delivers progress events from worker threads to the WebSocket clients.
+
+    publish() only appends to a bounded queue and, at most once per flush,
+    hands a flush to the event loop with call_soon_threadsafe, so a planner
+    thread never waits on a socket. Flushes run at most every min_interval
+    seconds; while they wait, the in-progress events of one job (and process)
+    are coalesced into its latest one, in the place of the first, while
+    final events (100% or with an error) are always kept. Each client has its own bounded
+    outbox and sender task, so clients are written to concurrently and a
+    slow one only drops its own oldest events. publish_frame() sends binary
+    messages the same way, never coalesced.
+    """
+
+    def __init__(self, max_pending: int = 256, min_interval: float = 0.1, client_buffer: int = 64):
+        self.max_pending = max_pending
+        self.min_interval = min_interval
+        self.client_buffer = client_buffer
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+        self._pending = deque()  # [payload, final, coalescing key] items
+        self._coalescing: Dict[tuple, list] = {}  # (job id, process) -> its pending in-progress item
+        self._flush_scheduled = False
+        self._last_flush = 0.0
+        self._outboxes: Dict[WebSocket, asyncio.Queue] = {}
+        self._senders: Dict[WebSocket, asyncio.Task] = {}
+
+    def publish(
+        self,
+        process_type: str,
+        progress_val: int,
+        message: str,
+        error: Optional[str] = None,
+        job_id: Optional[str] = None
+    ):
+        """ProcessProgress callback; safe to call from any thread"""
+        event = progress_event(process_type, progress_val, message, error, job_id)
+        final = progress_val >= 100 or error is not None
+        key = (job_id, process_type)
+        with self._lock:
+            if self._loop is None:
+                return  # no client has connected yet
+            if final:
+                self._coalescing.pop(key, None)
+            else:
+                item = self._coalescing.get(key)
+                if item is not None:
+                    item[0] = event
+                    return
+        self._enqueue(event, final, key)
+
+    def publish_frame(self, data: bytes):
+        """Binary message for every client; safe to call from any thread"""
+        self._enqueue(data, True)
+
+    def _enqueue(self, payload, final: bool, key: Optional[tuple] = None):
+        with self._lock:
+            if self._loop is None:
+                return
+            item = [payload, final, key]
+            self._pending.append(item)
+            if not final:
+                self._coalescing[key] = item
+            if len(self._pending) > self.max_pending:
+                dropped = self._pending.popleft()
+                if self._coalescing.get(dropped[2]) is dropped:
+                    del self._coalescing[dropped[2]]
+            if self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+            loop = self._loop
+        try:
+            loop.call_soon_threadsafe(self._schedule_flush)
+        except RuntimeError:
+            pass  # the loop is closed, the server is shutting down
+
+    def _schedule_flush(self):
+        delay = self._last_flush + self.min_interval - time.monotonic()
+        if delay > 0:
+            self._loop.call_later(delay, self._flush)
+        else:
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            events = [item[0] for item in self._pending]
+            self._pending.clear()
+            self._coalescing.clear()
+            self._flush_scheduled = False
+        self._last_flush = time.monotonic()
+        for event in events:
+            message = event if isinstance(event, bytes) else json.dumps(event)
+            for outbox in self._outboxes.values():
+                self._put(outbox, message)
+
+    @staticmethod
+    def _put(outbox: asyncio.Queue, message):
+        if outbox.full():
+            outbox.get_nowait()
+        outbox.put_nowait(message)
+
+    def connect(self, websocket: WebSocket, initial: Optional[dict] = None):
+        """Start sending events to an accepted websocket; call from the event loop"""
+        with self._lock:
+            self._loop = asyncio.get_running_loop()
+        outbox = asyncio.Queue(maxsize=self.client_buffer)
+        if initial is not None:
+            self._put(outbox, json.dumps(initial))
+        self._outboxes[websocket] = outbox
+        self._senders[websocket] = asyncio.create_task(self._send(websocket, outbox))
+
+    def disconnect(self, websocket: WebSocket):
+        self._outboxes.pop(websocket, None)
+        sender = self._senders.pop(websocket, None)
+        if sender is not None and sender is not asyncio.current_task():
+            sender.cancel()
+
+    async def _send(self, websocket: WebSocket, outbox: asyncio.Queue):
+        try:
+            while True:
+                message = await outbox.get()
+                if isinstance(message, bytes):
+                    await websocket.send_bytes(message)
+                else:
+                    await websocket.send_text(message)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.disconnect(websocket)
@@ -0,0 +1,42 @@
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+
+class StartupReport:
+    """
+    Durations of the server's startup phases, counted from started (a
+    time.perf_counter() value). Printed once the server accepts requests and
+    served on /status; phases that finish later, like restoring the cached
+    lattice in a job, are added when they end.
+    """
+
+    def __init__(self, started: float):
+        self.started = started
+        self.phases: Dict[str, float] = {}
+        self.ready_after: Optional[float] = None
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, seconds: float):
+        self.phases[name] = seconds
+        if self.ready_after is not None:
+            print(f"Startup: {name} took {seconds:.3f} s")
+
+    def ready(self):
+        """Mark the server as accepting requests and print the report"""
+        self.ready_after = time.perf_counter() - self.started
+        phases = ", ".join(f"{name} {seconds:.3f} s" for name, seconds in self.phases.items())
+        print(f"Server ready after {self.ready_after:.3f} s ({phases})")
+
+    def to_dict(self) -> dict:
+        return {
+            "ready_after": self.ready_after,
+            "phases": {name: round(seconds, 4) for name, seconds in self.phases.items()}
+        }
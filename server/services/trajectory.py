@@ -0,0 +1,535 @@
+"""
+Curvature-bounded, densified trajectories from lattice paths, for Nav2's followPath.
+
+A lattice path only holds node states two cells apart, and the primitive
+arcs between them end off the nodes: the lattice snaps them, so the swept
+arcs meet with position and heading jumps that no smoothing which stays on
+the path can remove. smooth_trajectory replaces the lattice motion with
+Reeds-Shepp curves (arcs of the turning radius and straight lines, driven
+forwards or backwards) between states of the path instead. The waypoints
+are kept; from each kept or reached state the curve goes to the farthest
+later state it can reach without leaving the free space of the inflated
+map or costing much more than the lattice edges it replaces. Curves start
+and end on the lattice headings of the states they join, so the
+trajectory is continuous in heading, and its curvature is at most
+1/turning_radius between cusps. A span that no curve can replace, even
+between consecutive states, keeps its swept primitive and makes the
+trajectory infeasible: the robot is then sent the waypoints instead.
+"""
+import math
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from server.services.lattice import PRIMITIVES, REVERSE_PRIMITIVES, Lattice, LatticeParams, Primitive, compile_primitives
+
+# turn direction of the segments of a curve word: left, straight, right
+TURNS = {'L': 1, 'S': 0, 'R': -1}
+
+
+class Trajectory(NamedTuple):
+    """
+    Points in map cells, whether the robot drives backwards to reach each
+    one, the largest curvature (1/cells) and whether it is within the
+    turning bound.
+    """
+    xy: np.ndarray
+    reverse: np.ndarray
+    max_curvature: float
+    feasible: bool
+
+
+@lru_cache(maxsize=None)
+def _primitives(params: LatticeParams) -> Dict[Tuple[int, int], Primitive]:
+    """Primitive of every (start heading, primitive id) stored on the lattice edges."""
+    compiled = compile_primitives(params.n_headings, params.turning_radius, params.primitive_length,
+                                  params.nb_points, params.reverse_penalty_factor)
+    return {(h, PRIMITIVES.index(prim.name)): prim for h, prims in enumerate(compiled) for prim in prims}
+
+
+def path_edges(lattice: Lattice, nodes: List[int]) -> np.ndarray:
+    """Cheapest lattice edge between every pair of consecutive nodes."""
+    edges = np.empty(max(len(nodes) - 1, 0), dtype=np.int64)
+    for k, (u, v) in enumerate(zip(nodes, nodes[1:])):
+        start, end = int(lattice.indptr[u]), int(lattice.indptr[u + 1])
+        hits = np.flatnonzero(np.asarray(lattice.targets[start:end]) == v) + start
+        if hits.size == 0:
+            raise ValueError(f"No lattice edge from node {u} to node {v}")
+        edges[k] = hits[np.argmin(lattice.costs[hits])]
+    return edges
+
+
+def primitive_samples(lattice: Lattice, params: LatticeParams, nodes: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Points swept by the primitives along a node path, in map cells, and for
+    each point whether it is reached driving backwards. Every arc is shifted
+    progressively along its length so that it ends on the snapped node.
+    """
+    primitives = _primitives(params)
+    xs, ys = lattice.node_xy(nodes)
+    points = [np.array([[xs[0], ys[0]]], dtype=np.float64)]
+    reverse = [np.zeros(1, dtype=bool)]
+    for k, edge in enumerate(path_edges(lattice, nodes)):
+        prim = primitives[(int(nodes[k]) % lattice.n_headings, int(lattice.primitives[edge]))]
+        step = np.hypot(*np.diff(prim.path, axis=0).T)
+        along = np.concatenate([[0.0], np.cumsum(step)])
+        along /= along[-1]
+        snap = np.array([xs[k + 1] - xs[k] - prim.end_x, ys[k + 1] - ys[k] - prim.end_y])
+        swept = np.array([xs[k], ys[k]]) + prim.path + along[:, None] * snap
+        points.append(swept[1:])
+        reverse.append(np.full(len(swept) - 1, prim.name in REVERSE_PRIMITIVES))
+    if len(reverse) > 1:
+        reverse[0][:] = reverse[1][0]
+    return np.concatenate(points), np.concatenate(reverse)
+
+
+def _mod2pi(angle: float) -> float:
+    return angle % (2 * math.pi)
+
+
+def _wrap(angle: float) -> float:
+    """angle in [-π, π)"""
+    return (angle + math.pi) % (2 * math.pi) - math.pi
+
+
+def dubins_curve(start: Sequence[float], goal: Sequence[float], radius: float) -> Tuple[str, Tuple[float, float, float]]:
+    """
+    Shortest forward curve between two (x, y, theta) states with turns of the
+    given radius: its word (like "LSR") and the lengths of its three segments.
+    """
+    dx, dy = goal[0] - start[0], goal[1] - start[1]
+    d = math.hypot(dx, dy) / radius
+    theta = math.atan2(dy, dx) if d > 0 else 0.0
+    alpha, beta = _mod2pi(start[2] - theta), _mod2pi(goal[2] - theta)
+    sa, sb, ca, cb = math.sin(alpha), math.sin(beta), math.cos(alpha), math.cos(beta)
+    c_ab = math.cos(alpha - beta)
+
+    candidates = []
+    p2 = 2 + d * d - 2 * c_ab + 2 * d * (sa - sb)
+    if p2 >= 0:
+        t = math.atan2(cb - ca, d + sa - sb)
+        candidates.append(('LSL', _mod2pi(t - alpha), math.sqrt(p2), _mod2pi(beta - t)))
+    p2 = 2 + d * d - 2 * c_ab + 2 * d * (sb - sa)
+    if p2 >= 0:
+        t = math.atan2(ca - cb, d - sa + sb)
+        candidates.append(('RSR', _mod2pi(alpha - t), math.sqrt(p2), _mod2pi(t - beta)))
+    p2 = -2 + d * d + 2 * c_ab + 2 * d * (sa + sb)
+    if p2 >= 0:
+        p = math.sqrt(p2)
+        t = math.atan2(-ca - cb, d + sa + sb) - math.atan2(-2, p)
+        candidates.append(('LSR', _mod2pi(t - alpha), p, _mod2pi(t - beta)))
+    p2 = -2 + d * d + 2 * c_ab - 2 * d * (sa + sb)
+    if p2 >= 0:
+        p = math.sqrt(p2)
+        t = math.atan2(ca + cb, d - sa - sb) - math.atan2(2, p)
+        candidates.append(('RSL', _mod2pi(alpha - t), p, _mod2pi(beta - t)))
+    c = (6 - d * d + 2 * c_ab + 2 * d * (sa - sb)) / 8
+    if abs(c) <= 1:
+        p = _mod2pi(2 * math.pi - math.acos(c))
+        t = _mod2pi(alpha - math.atan2(ca - cb, d - sa + sb) + p / 2)
+        candidates.append(('RLR', t, p, _mod2pi(alpha - beta - t + p)))
+    c = (6 - d * d + 2 * c_ab + 2 * d * (sb - sa)) / 8
+    if abs(c) <= 1:
+        p = _mod2pi(2 * math.pi - math.acos(c))
+        t = _mod2pi(-alpha - math.atan2(ca - cb, d + sa - sb) + p / 2)
+        candidates.append(('LRL', t, p, _mod2pi(beta - alpha - t + p)))
+
+    word, *lengths = min(candidates, key=lambda candidate: sum(candidate[1:]))
+    return word, tuple(radius * length for length in lengths)
+
+
+# Reeds-Shepp curve families (Reeds & Shepp 1990) for a goal (x, y, phi) in
+# the frame of the start state, with unit turning radius. Each returns the
+# word and the signed segment lengths (negative drives backwards) or None.
+
+def _polar(x: float, y: float) -> Tuple[float, float]:
+    return math.hypot(x, y), math.atan2(y, x)
+
+
+def _lsl(x, y, phi):
+    u, t = _polar(x - math.sin(phi), y - 1 + math.cos(phi))
+    v = _wrap(phi - t)
+    if t >= 0 and v >= 0:
+        return 'LSL', (t, u, v)
+
+
+def _lsr(x, y, phi):
+    u1, t1 = _polar(x + math.sin(phi), y - 1 - math.cos(phi))
+    if u1 * u1 >= 4:
+        u = math.sqrt(u1 * u1 - 4)
+        t = _wrap(t1 + math.atan2(2, u))
+        v = _wrap(t - phi)
+        if t >= 0 and v >= 0:
+            return 'LSR', (t, u, v)
+
+
+def _lxrxl(x, y, phi):
+    u1, theta = _polar(x - math.sin(phi), y - 1 + math.cos(phi))
+    if u1 <= 4:
+        a = math.acos(u1 / 4)
+        t = _wrap(a + theta + math.pi / 2)
+        u = _wrap(math.pi - 2 * a)
+        v = _wrap(phi - t - u)
+        return 'LRL', (t, -u, v)
+
+
+def _lxrl(x, y, phi):
+    u1, theta = _polar(x - math.sin(phi), y - 1 + math.cos(phi))
+    if u1 <= 4:
+        a = math.acos(u1 / 4)
+        t = _wrap(a + theta + math.pi / 2)
+        u = _wrap(math.pi - 2 * a)
+        v = _wrap(-phi + t + u)
+        return 'LRL', (t, -u, -v)
+
+
+def _lrxl(x, y, phi):
+    u1, theta = _polar(x - math.sin(phi), y - 1 + math.cos(phi))
+    if 0 < u1 <= 4:
+        u = math.acos(1 - u1 * u1 / 8)
+        a = math.asin(max(-1.0, min(1.0, 2 * math.sin(u) / u1)))
+        t = _wrap(-a + theta + math.pi / 2)
+        v = _wrap(t - u - phi)
+        return 'LRL', (t, u, -v)
+
+
+def _lrxlr(x, y, phi):
+    u1, theta = _polar(x + math.sin(phi), y - 1 - math.cos(phi))
+    if u1 <= 2:
+        a = math.acos((u1 + 2) / 4)
+        t = _wrap(theta + a + math.pi / 2)
+        u = _wrap(a)
+        v = _wrap(phi - t + 2 * u)
+        if t >= 0 and u >= 0 and v >= 0:
+            return 'LRLR', (t, u, -u, -v)
+
+
+def _lxrlxr(x, y, phi):
+    u1, theta = _polar(x + math.sin(phi), y - 1 - math.cos(phi))
+    u2 = (20 - u1 * u1) / 16
+    if u1 > 0 and 0 <= u2 <= 1:
+        u = math.acos(u2)
+        a = math.asin(max(-1.0, min(1.0, 2 * math.sin(u) / u1)))
+        t = _wrap(theta + a + math.pi / 2)
+        v = _wrap(t - phi)
+        if t >= 0 and v >= 0:
+            return 'LRLR', (t, -u, -u, v)
+
+
+def _lxr90sl(x, y, phi):
+    u1, theta = _polar(x - math.sin(phi), y - 1 + math.cos(phi))
+    if u1 >= 2:
+        root = math.sqrt(u1 * u1 - 4)
+        t = _wrap(theta + math.atan2(2, root) + math.pi / 2)
+        v = _wrap(t - phi + math.pi / 2)
+        if t >= 0 and v >= 0:
+            return 'LRSL', (t, -math.pi / 2, -(root - 2), -v)
+
+
+def _lsr90xl(x, y, phi):
+    u1, theta = _polar(x - math.sin(phi), y - 1 + math.cos(phi))
+    if u1 >= 2:
+        root = math.sqrt(u1 * u1 - 4)
+        t = _wrap(theta - math.atan2(root, 2) + math.pi / 2)
+        v = _wrap(t - phi - math.pi / 2)
+        if t >= 0 and v >= 0:
+            return 'LSRL', (t, root - 2, math.pi / 2, -v)
+
+
+def _lxr90sr(x, y, phi):
+    u1, theta = _polar(x + math.sin(phi), y - 1 - math.cos(phi))
+    if u1 >= 2:
+        t = _wrap(theta + math.pi / 2)
+        v = _wrap(phi - t - math.pi / 2)
+        if t >= 0 and v >= 0:
+            return 'LRSR', (t, -math.pi / 2, -(u1 - 2), -v)
+
+
+def _lsl90xr(x, y, phi):
+    u1, theta = _polar(x + math.sin(phi), y - 1 - math.cos(phi))
+    if u1 >= 2:
+        t = _wrap(theta)
+        v = _wrap(phi - t - math.pi / 2)
+        if t >= 0 and v >= 0:
+            return 'LSLR', (t, u1 - 2, math.pi / 2, -v)
+
+
+def _lxr90sl90xr(x, y, phi):
+    u1, theta = _polar(x + math.sin(phi), y - 1 - math.cos(phi))
+    if u1 >= 4:
+        root = math.sqrt(u1 * u1 - 4)
+        t = _wrap(theta + math.atan2(2, root) + math.pi / 2)
+        v = _wrap(t - phi)
+        if t >= 0 and v >= 0:
+            return 'LRSLR', (t, -math.pi / 2, -(root - 4), -math.pi / 2, v)
+
+
+_FAMILIES = (_lsl, _lsr, _lxrxl, _lxrl, _lrxl, _lrxlr, _lxrlxr, _lxr90sl, _lsr90xl, _lxr90sr, _lsl90xr, _lxr90sl90xr)
+_MIRROR = str.maketrans('LR', 'RL')
+
+
+def curve_end(start: Sequence[float], word: str, lengths: Sequence[float], radius: float) -> Tuple[float, float, float]:
+    """State reached by driving the segments of a curve from start."""
+    x, y, theta = start
+    for letter, length in zip(word, lengths):
+        turn = TURNS[letter]
+        if turn == 0:
+            x, y = x + length * math.cos(theta), y + length * math.sin(theta)
+        else:
+            end = theta + turn * length / radius
+            x, y = x + radius * turn * (math.sin(end) - math.sin(theta)), y - radius * turn * (math.cos(end) - math.cos(theta))
+            theta = end
+    return x, y, theta
+
+
+def reeds_shepp_curves(start: Sequence[float], goal: Sequence[float], radius: float) -> List[Tuple[str, Tuple[float, ...]]]:
+    """
+    Curves between two (x, y, theta) states with turns of the given radius,
+    driving forwards and backwards: every Reeds-Shepp candidate (including the
+    shortest forward Dubins curve) that reaches the goal.
+    """
+    dx, dy = goal[0] - start[0], goal[1] - start[1]
+    c, s = math.cos(start[2]), math.sin(start[2])
+    x, y = (c * dx + s * dy) / radius, (-s * dx + c * dy) / radius
+    phi = _wrap(goal[2] - start[2])
+    # the same families driven backwards (timeflip), mirrored (reflect), and read from the goal (backwards)
+    xb, yb = x * math.cos(phi) + y * math.sin(phi), x * math.sin(phi) - y * math.cos(phi)
+    curves = [dubins_curve(start, goal, radius)]
+    for family in _FAMILIES:
+        for (gx, gy, gphi), backwards in (((x, y, phi), False), ((xb, yb, phi), True)):
+            for flip, mirror in ((1, False), (-1, False), (1, True), (-1, True)):
+                found = family(flip * gx, -gy if mirror else gy, -gphi if (flip < 0) != mirror else gphi)
+                if found is None:
+                    continue
+                word, lengths = found
+                if mirror:
+                    word = word.translate(_MIRROR)
+                lengths = tuple(flip * radius * length for length in lengths)
+                if backwards:
+                    word, lengths = word[::-1], lengths[::-1]
+                curves.append((word, lengths))
+
+    valid = []
+    for word, lengths in curves:
+        ex, ey, etheta = curve_end(start, word, lengths, radius)
+        if math.hypot(ex - goal[0], ey - goal[1]) < 1e-6 * radius and abs(_wrap(etheta - goal[2])) < 1e-6:
+            valid.append((word, lengths))
+    return valid
+
+
+def curve_points(
+    start: Sequence[float],
+    word: str,
+    lengths: Sequence[float],
+    radius: float,
+    spacing: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Points at most spacing apart along a curve, both ends included, and for
+    each point whether the segment reaching it drives backwards.
+    """
+    # segments that round to nothing would only repeat a point
+    spans = np.abs(np.asarray(lengths, dtype=np.float64))
+    spans[spans < 1e-9] = 0.0
+    # every segment end is a point, so that no cusp falls between two of them
+    at = [np.zeros(1)] + [np.linspace(0.0, span, int(np.ceil(span / spacing)) + 1)[1:] if span else np.empty(0) for span in spans]
+    segment = np.concatenate([np.zeros(1, dtype=np.int64)] + [np.full(len(a), k) for k, a in enumerate(at[1:])])
+    at = np.concatenate(at)
+    points = np.empty((len(at), 2))
+    state = tuple(start)
+    for k, (letter, length) in enumerate(zip(word, lengths)):
+        inside = segment == k
+        if inside.any():
+            x, y, theta = state
+            s = at[inside] * math.copysign(1.0, length)
+            turn = TURNS[letter]
+            if turn == 0:
+                points[inside, 0] = x + s * math.cos(theta)
+                points[inside, 1] = y + s * math.sin(theta)
+            else:
+                # arc around the centre on the turn side, radius * turn to the left of the heading
+                points[inside, 0] = x + radius * turn * (np.sin(theta + turn * s / radius) - math.sin(theta))
+                points[inside, 1] = y - radius * turn * (np.cos(theta + turn * s / radius) - math.cos(theta))
+        state = curve_end(state, letter, (length,), radius)
+    backwards = np.asarray(lengths)[segment] < 0
+    moving = np.flatnonzero(spans > 0)
+    if len(moving):
+        backwards[0] = lengths[moving[0]] < 0
+    return points, backwards
+
+
+def curve_length(lengths: Sequence[float], reverse_penalty: float) -> float:
+    """Length of a curve with its backward segments weighted like reverse lattice edges."""
+    return sum(abs(length) * (reverse_penalty if length < 0 else 1.0) for length in lengths)
+
+
+def collides(points: np.ndarray, occ: np.ndarray) -> bool:
+    """Whether any point lies on an occupied cell of occ or off the map."""
+    px = np.rint(points[:, 0]).astype(np.int64)
+    py = np.rint(points[:, 1]).astype(np.int64)
+    h, w = occ.shape
+    inside = (px >= 0) & (px < w) & (py >= 0) & (py < h)
+    return not inside.all() or bool(occ[py, px].any())
+
+
+def resample(points: np.ndarray, spacing: float) -> np.ndarray:
+    """Points at equal arc length along a polyline, keeping both ends."""
+    along = np.concatenate([[0.0], np.cumsum(np.hypot(*np.diff(points, axis=0).T))])
+    if along[-1] == 0.0:
+        return points[[0, -1]]
+    at = np.linspace(0.0, along[-1], max(int(np.ceil(along[-1] / spacing)), 1) + 1)
+    return np.stack([np.interp(at, along, points[:, 0]), np.interp(at, along, points[:, 1])], axis=1)
+
+
+def curvature(points: np.ndarray) -> np.ndarray:
+    """Curvature at the interior points of a polyline, from the circle through each point and its neighbours."""
+    a = points[1:-1] - points[:-2]
+    b = points[2:] - points[1:-1]
+    c = points[2:] - points[:-2]
+    cross = np.abs(a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0])
+    lengths = np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1) * np.linalg.norm(c, axis=1)
+    return np.divide(2 * cross, lengths, out=np.zeros(len(cross)), where=lengths > 0)
+
+
+def _first_curve(
+    start: Sequence[float],
+    goals: List[Tuple[float, float, float]],
+    limits: List[float],
+    offsets: np.ndarray,
+    params: LatticeParams,
+    occ: np.ndarray
+) -> Optional[Tuple[int, float, str, Tuple[float, ...]]]:
+    """
+    Shortest collision-free curve from start to the first of goals (with its
+    heading turned by the first of offsets) whose length, reverse segments
+    weighted by the reverse penalty, is within its limit: (goal index,
+    heading offset, word, lengths), or None.
+    """
+    radius = params.turning_radius
+    for k, ((x, y, theta), limit) in enumerate(zip(goals, limits)):
+        if math.hypot(x - start[0], y - start[1]) > limit:
+            continue
+        for offset in offsets:
+            curves = sorted(
+                (curve_length(lengths, params.reverse_penalty_factor), word, lengths)
+                for word, lengths in reeds_shepp_curves(start, (x, y, theta + offset), radius)
+            )
+            for length, word, lengths in curves:
+                if length > limit:
+                    break
+                if not collides(curve_points(start, word, lengths, radius, 0.5)[0], occ):
+                    return k, float(offset), word, lengths
+    return None
+
+
+def smooth_trajectory(
+    lattice: Lattice,
+    params: LatticeParams,
+    paths: List[List[int]],
+    occ: np.ndarray,
+    spacing: float = 1.0,
+    stretch: float = 1.25,
+    lookahead: int = 48
+) -> Trajectory:
+    """
+    Trajectory through the node paths of consecutive tour legs, with points
+    at most spacing map cells apart. occ is the occupancy grid the lattice
+    was built from, inflated by the footprint (see inflate_obstacles).
+
+    Every span between waypoints is covered by Reeds-Shepp curves between
+    its states, each to the farthest state at most lookahead nodes ahead
+    whose curve is collision-free and costs at most stretch times (plus one
+    node spacing) the lattice edges it replaces. Legs that do not join (a
+    leg without a path) also make the trajectory infeasible.
+    """
+    radius = params.turning_radius
+    runs: List[List[int]] = []
+    waypoints = set()
+    for nodes in paths:
+        if len(nodes) < 2:
+            continue
+        if runs and runs[-1][-1] == nodes[0]:
+            runs[-1].extend(nodes[1:])
+        else:
+            runs.append(list(nodes))
+        waypoints.add((len(runs) - 1, len(runs[-1]) - 1))
+    if not runs:
+        return Trajectory(np.empty((0, 2)), np.empty(0, dtype=bool), 0.0, True)
+
+    headings = np.asarray(lattice.headings)
+    # a lattice heading is the nearest bin to the motion: curves may end up to a bin off it
+    offsets = np.pi / lattice.n_headings * np.array([0, 1, -1, 2, -2])
+    reverse_ids = [PRIMITIVES.index(name) for name in REVERSE_PRIMITIVES]
+    # points, per-point reverse flags and curvature (None for a kept primitive) of every span
+    spans: List[Tuple[np.ndarray, np.ndarray, Optional[float]]] = []
+    for r, nodes in enumerate(runs):
+        edges = path_edges(lattice, nodes)
+        reverse = np.isin(lattice.primitives[edges], reverse_ids)
+        # lattice cost up to each state, which a curve replacing the edges between two states is held to
+        cost = np.concatenate([[0.0], np.cumsum(lattice.costs[edges], dtype=np.float64)])
+        xs, ys = lattice.node_xy(nodes)
+        thetas = headings[np.asarray(nodes) % lattice.n_headings]
+        kept = sorted({0, len(nodes) - 1} | {i for run, i in waypoints if run == r})
+
+        # robot heading at the current state: the lattice one, or the one a curve reached it with
+        heading = thetas[0]
+        for first, last in zip(kept, kept[1:]):
+            i = first
+            while i < last:
+                start = (xs[i], ys[i], heading)
+                ahead = range(min(last, i + lookahead), i, -1)
+                curve = _first_curve(
+                    start,
+                    [(xs[j], ys[j], thetas[j]) for j in ahead],
+                    [stretch * (cost[j] - cost[i]) + params.node_spacing for j in ahead],
+                    offsets, params, occ
+                )
+                if curve is None:
+                    # no curve leaves this state: keep the lattice primitive to the next one
+                    swept, _ = primitive_samples(lattice, params, nodes[i:i + 2])
+                    points = resample(swept, spacing)
+                    spans.append((points, np.full(len(points), reverse[i]), None))
+                    i += 1
+                    heading = thetas[i]
+                    continue
+                k, offset, word, lengths = curve
+                points, backwards = curve_points(start, word, lengths, radius, spacing)
+                turns = any(TURNS[letter] and abs(length) > 1e-9 for letter, length in zip(word, lengths))
+                spans.append((points, backwards, 1.0 / radius if turns else 0.0))
+                i = ahead[k]
+                heading = thetas[i] + offset
+
+    # consecutive spans share their joint point
+    xy = np.concatenate([spans[0][0]] + [points[1:] for points, _, _ in spans[1:]])
+    reverse = np.concatenate([spans[0][1]] + [backwards[1:] for _, backwards, _ in spans[1:]])
+    bounds = [bound for _, _, bound in spans if bound is not None]
+    highest = max(bounds, default=0.0)
+    feasible = len(runs) == 1 and len(bounds) == len(spans)
+    if not feasible:
+        # the kept primitives meet their neighbours with kinks: measure them, per direction
+        cusps = np.flatnonzero(reverse[1:] != reverse[:-1])
+        for piece in np.split(xy, cusps + 1):
+            if len(piece) > 2:
+                highest = max(highest, float(curvature(piece).max()))
+    return Trajectory(xy, reverse, highest, feasible)
+
+
+def trajectory_poses(trajectory: Trajectory, resolution: float, origin_x: float, origin_y: float, height: int) -> List[dict]:
+    """
+    nav_msgs/Path-style poses of a trajectory in the map frame: metres, y up
+    (grid rows count down from the top), yaw along the motion reaching each
+    pose, flipped when driving backwards.
+    """
+    if len(trajectory.xy) == 0:
+        return []
+    x = trajectory.xy[:, 0] * resolution + origin_x
+    y = (height - trajectory.xy[:, 1]) * resolution + origin_y
+    # direction of the motion reaching each point, so cusps keep the yaw they are reached with
+    dx = np.diff(x, prepend=x[0]) if len(x) > 1 else np.zeros(1)
+    dy = np.diff(y, prepend=y[0]) if len(y) > 1 else np.zeros(1)
+    if len(x) > 1:
+        dx[0], dy[0] = dx[1], dy[1]
+    yaw = np.arctan2(dy, dx) + np.where(trajectory.reverse, np.pi, 0.0)
+    yaw = (yaw + np.pi) % (2 * np.pi) - np.pi
+    return [{"x": float(px), "y": float(py), "yaw": float(pyaw)} for px, py, pyaw in zip(x, y, yaw)]
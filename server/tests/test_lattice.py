@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from server.services import lattice as lattice_module
+from server.services.lattice import build_lattice_graph_from_pgm, update_lattice
+from server.services.optimizer import LATTICE_PARAMS
+from server.services.progress_checker import ProcessProgress
+
+
+def build(grid, **kwargs):
+    params = LATTICE_PARAMS
+    return build_lattice_graph_from_pgm(
+        grid, params.node_spacing, params.n_headings, params.turning_radius, params.primitive_length,
+        ProcessProgress(), nb_points=params.nb_points, reverse_penalty_factor=params.reverse_penalty_factor,
+        footprint_radius=params.footprint_radius, **kwargs
+    )
+
+
+def assert_same_lattice(actual, expected):
+    np.testing.assert_array_equal(actual.free, expected.free)
+    np.testing.assert_array_equal(actual.indptr, expected.indptr)
+    np.testing.assert_array_equal(actual.targets, expected.targets)
+    np.testing.assert_array_equal(actual.costs, expected.costs)
+    np.testing.assert_array_equal(actual.primitives, expected.primitives)
+
+
+@pytest.fixture(scope="module")
+def grid():
+    grid = np.zeros((64, 80), dtype=np.uint8)
+    grid[20:30, 30:36] = 100
+    grid[44:48, 10:60] = 100
+    return grid
+
+
+def test_update_matches_full_rebuild(grid):
+    changed = grid.copy()
+    changed[20:30, 30:36] = 0  # obstacle removed
+    changed[8:14, 56:62] = 100  # obstacle added
+
+    updated, rebuilt = update_lattice(build(grid), grid, changed, LATTICE_PARAMS)
+
+    assert 0 < rebuilt < updated.free.size
+    assert_same_lattice(updated, build(changed))
+
+
+def test_update_without_changes_keeps_lattice(grid):
+    lattice = build(grid)
+    assert update_lattice(lattice, grid, grid.copy(), LATTICE_PARAMS) == (lattice, 0)
+
+
+def test_parallel_build_matches_serial(grid, monkeypatch):
+    monkeypatch.setattr(lattice_module, "MIN_PARALLEL_NODES", 0)
+    assert_same_lattice(build(grid, workers=2, tile_rows=8), build(grid))
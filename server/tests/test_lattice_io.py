@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+import pytest
+
+from server.models.waypoints_request import MapMetaData, Point
+from server.services.lattice import build_lattice_graph_from_pgm
+from server.services.lattice_cache import LatticeCache
+from server.services.lattice_io import load_lattice, save_lattice
+from server.services.optimizer import LATTICE_PARAMS
+from server.services.progress_checker import ProcessProgress
+
+
+@pytest.fixture(scope="module")
+def grid_and_lattice():
+    params = LATTICE_PARAMS
+    grid = np.zeros((40, 48), dtype=np.uint8)
+    grid[10:20, 20:26] = 100
+    lattice = build_lattice_graph_from_pgm(
+        grid, params.node_spacing, params.n_headings, params.turning_radius, params.primitive_length,
+        ProcessProgress(), nb_points=params.nb_points, reverse_penalty_factor=params.reverse_penalty_factor,
+        footprint_radius=params.footprint_radius
+    )
+    return grid, lattice
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_round_trip(tmp_path, grid_and_lattice, mmap):
+    grid, lattice = grid_and_lattice
+    path = str(tmp_path / "map.lattice")
+    save_lattice(path, grid, lattice, meta={"name": "test"})
+
+    loaded_grid, loaded, meta = load_lattice(path, mmap=mmap)
+
+    assert meta["name"] == "test"
+    assert (loaded.width, loaded.height) == (lattice.width, lattice.height)
+    assert (loaded.node_spacing, loaded.n_headings) == (lattice.node_spacing, lattice.n_headings)
+    assert loaded.path == (path if mmap else None)
+    np.testing.assert_array_equal(loaded_grid, grid)
+    for name in ("free", "indptr", "targets", "costs", "primitives"):
+        np.testing.assert_array_equal(getattr(loaded, name), getattr(lattice, name))
+
+
+def test_truncated_cache_entry_is_a_miss(tmp_path, grid_and_lattice):
+    grid, lattice = grid_and_lattice
+    info = MapMetaData(width=grid.shape[1], height=grid.shape[0], resolution=0.05, origin=Point(x=0, y=0, z=0))
+    cache = LatticeCache(str(tmp_path))
+    key = cache.key(grid, info, LATTICE_PARAMS)
+    cache.put(key, grid, lattice, info)
+    assert cache.get(key) is not None
+
+    path = os.path.join(cache.directory, f"{key}.lattice")
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) // 2)
+
+    assert cache.get(key) is None
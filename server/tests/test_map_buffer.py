@@ -0,0 +1,33 @@
+import zlib
+
+import numpy as np
+import pytest
+
+from server.services.optimizer import RLE_RECORD, load_map_buffer
+
+CELLS = bytes(range(12))
+GRID = np.flipud(np.frombuffer(CELLS, dtype=np.uint8).reshape(3, 4))
+
+
+@pytest.mark.parametrize("encoding, payload", [
+    ("raw", CELLS),
+    ("zlib", zlib.compress(CELLS)),
+    ("rle", np.array([(1, value) for value in CELLS], dtype=RLE_RECORD).tobytes()),
+])
+def test_decodes_every_encoding(encoding, payload):
+    np.testing.assert_array_equal(load_map_buffer(payload, 4, 3, encoding), GRID)
+
+
+@pytest.mark.parametrize("encoding, payload", [
+    ("raw", CELLS[:-1]),
+    ("zlib", b"not a zlib stream"),
+    ("zlib", zlib.compress(CELLS)[:-3]),
+    ("zlib", zlib.compress(CELLS) + b"trailing"),
+    ("zlib", zlib.compress(CELLS * 100)),
+    ("rle", np.array([(6, 0), (5, 100)], dtype=RLE_RECORD).tobytes()),
+    ("rle", np.array([(6, 0), (6, 100)], dtype=RLE_RECORD).tobytes()[:-1]),
+    ("gzip", CELLS),
+])
+def test_rejects_malformed_payloads(encoding, payload):
+    with pytest.raises(ValueError):
+        load_map_buffer(payload, 4, 3, encoding)
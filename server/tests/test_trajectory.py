@@ -0,0 +1,82 @@
+import math
+
+import numpy as np
+import pytest
+
+from server.services.lattice import build_lattice_graph_from_pgm, inflate_obstacles
+from server.services.optimizer import LATTICE_PARAMS
+from server.services.progress_checker import ProcessProgress
+from server.services.search import LatticeSearch
+from server.services.trajectory import curve_end, curve_points, reeds_shepp_curves, smooth_trajectory
+
+
+def build(grid):
+    params = LATTICE_PARAMS
+    return build_lattice_graph_from_pgm(
+        grid, params.node_spacing, params.n_headings, params.turning_radius, params.primitive_length,
+        ProcessProgress(), nb_points=params.nb_points, reverse_penalty_factor=params.reverse_penalty_factor,
+        footprint_radius=params.footprint_radius
+    )
+
+
+@pytest.fixture(scope="module")
+def empty():
+    grid = np.zeros((160, 200), dtype=np.uint8)
+    return grid, build(grid)
+
+
+def leg_paths(lattice, states):
+    """Shortest lattice paths between consecutive (x, y, heading index) states."""
+    search = LatticeSearch(lattice)
+    paths = []
+    for start, goal in zip(states, states[1:]):
+        target = lattice.node_id(*goal)
+        _, tree = search.distances(lattice.node_id(*start), np.array([target]), return_tree=True)
+        paths.append(tree.path_to(target))
+    return paths
+
+
+def assert_feasible(grid, lattice, paths):
+    occ = inflate_obstacles(grid > 0, LATTICE_PARAMS.footprint_radius)
+    trajectory = smooth_trajectory(lattice, LATTICE_PARAMS, paths, occ)
+    assert trajectory.feasible
+    assert trajectory.max_curvature <= 1 / LATTICE_PARAMS.turning_radius + 1e-9
+    first_x, first_y = lattice.node_xy([paths[0][0]])
+    last_x, last_y = lattice.node_xy([paths[-1][-1]])
+    np.testing.assert_allclose(trajectory.xy[0], [first_x[0], first_y[0]], atol=1e-9)
+    np.testing.assert_allclose(trajectory.xy[-1], [last_x[0], last_y[0]], atol=1e-6)
+    assert np.hypot(*np.diff(trajectory.xy, axis=0).T).max() <= 1.0 + 1e-9
+    return trajectory
+
+
+def test_straight_route_is_feasible(empty):
+    grid, lattice = empty
+    trajectory = assert_feasible(grid, lattice, leg_paths(lattice, [(20, 80, 0), (180, 80, 0)]))
+    assert trajectory.max_curvature == 0.0
+    assert not trajectory.reverse.any()
+    np.testing.assert_allclose(trajectory.xy[:, 1], 80.0)
+
+
+def test_gently_curved_route_is_feasible(empty):
+    grid, lattice = empty
+    # heading 0 along +x, then about 22.5 degrees toward -y at each waypoint
+    n = lattice.n_headings
+    states = [(20, 120, 0), (100, 100, n - 1), (180, 60, n - 2)]
+    trajectory = assert_feasible(grid, lattice, leg_paths(lattice, states))
+    assert not trajectory.reverse.any()
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_reeds_shepp_curves_reach_the_goal(seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(50):
+        start = (*rng.uniform(-30, 30, 2), rng.uniform(-math.pi, math.pi))
+        goal = (*rng.uniform(-30, 30, 2), rng.uniform(-math.pi, math.pi))
+        curves = reeds_shepp_curves(start, goal, 12.0)
+        assert curves
+        for word, lengths in curves:
+            x, y, _ = curve_end(start, word, lengths, 12.0)
+            assert math.hypot(x - goal[0], y - goal[1]) < 1e-6
+            points, backwards = curve_points(start, word, lengths, 12.0, 1.0)
+            np.testing.assert_allclose(points[-1], goal[:2], atol=1e-6)
+            assert len(backwards) == len(points)